@@ -0,0 +1,86 @@
+"""
+ASR Backends — Pluggable speech recognisers behind one session contract.
+
+A backend is an async function run as a task per dictation session:
+
+    async def run(session, asr_config: dict) -> None
+
+- audio in: raw LINEAR16 PCM from session.audio_buffer (AudioRingBuffer,
+  read with read_chunk(); None means the session ended)
+- messages out, on session.transcript_queue:
+    {"text": str, "is_final": bool}   interim / final transcript
+    {"speech_event": "begin" | "end"}  voice activity
+    {"info": str} / {"error": str}     shown to the client
+  transcript and speech-event messages carry "t": time.monotonic() when the
+  result arrived, the start of the batch's latency trace
+- stop when the buffer is closed or session.cancel_event is set, and
+  close the buffer on exit
+- while session.asr_paused (threading.Event) is set, the session is detached
+  from its client and no audio arrives: hold recognition (close the STT
+  stream rather than let it time out) and pick up again once it clears
+
+Selected with config.yaml asr.backend. Modules are imported on first use, so
+the replay backend runs without the Google Cloud libraries installed.
+
+Session-long blocking loops go through run_in_thread(), not asyncio.to_thread:
+the default executor has only min(32, CPUs + 4) workers, so a handful of
+sessions would occupy all of them and the next session's audio (and every
+other to_thread call) would wait.
+"""
+
+import asyncio
+import importlib
+import logging
+import threading
+
+log = logging.getLogger("ehr-voice")
+
+_DEFAULT_BACKEND = "google"
+
+# Backend name → (module, entry point)
+_BACKENDS = {
+    "google": ("asr_bridge", "run_asr_bridge"),    # Google Cloud Speech-to-Text v2
+    "replay": ("asr_replay", "run_replay_asr"),    # Recorded WAV + transcript script, offline
+}
+
+
+def get_asr_backend(asr_config: dict | None = None):
+    """
+    Return the entry point of the configured backend.
+
+    Raises ValueError for an unknown name and ImportError when the backend's
+    dependencies are missing.
+    """
+    name = (asr_config or {}).get("backend", _DEFAULT_BACKEND)
+    if name not in _BACKENDS:
+        raise ValueError(f"Unknown ASR backend {name!r} (expected one of {', '.join(_BACKENDS)})")
+    module_name, func_name = _BACKENDS[name]
+    module = importlib.import_module(module_name)
+    log.info("ASR backend: %s", name)
+    return getattr(module, func_name)
+
+
+def _resolve_future(fut: asyncio.Future, result=None, error: BaseException | None = None):
+    if fut.done():
+        return  # Awaiting task was cancelled
+    if error is not None:
+        fut.set_exception(error)
+    else:
+        fut.set_result(result)
+
+
+async def run_in_thread(fn, name: str):
+    """Run a blocking callable in its own daemon thread and await its result."""
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+
+    def target():
+        try:
+            result = fn()
+        except BaseException as e:
+            loop.call_soon_threadsafe(_resolve_future, fut, None, e)
+        else:
+            loop.call_soon_threadsafe(_resolve_future, fut, result)
+
+    threading.Thread(target=target, name=name, daemon=True).start()
+    return await fut
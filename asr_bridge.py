@@ -2,28 +2,36 @@
 ASR Bridge — Streams audio from WebSocket to Google Cloud Speech-to-Text v2.
 
 Threading model:
-  asyncio event loop                     background thread
-  ==================                     =================
-  session.audio_queue                    sync_audio_queue (queue.Queue)
-          |                                      |
-          v                                      v
-  audio_pump() coroutine -------->       request_generator()
-                                                 |
-                                                 v
-                                         streaming_recognize()
-                                                 |
-                                         transcript results
-                                                 |
-                                  loop.call_soon_threadsafe()
-                                                 |
-                                                 v
+  asyncio event loop                     background threads
+  ==================                     ==================
+  WebSocket receive loop
+          |
+          v
+  session.audio_buffer (AudioRingBuffer) ---->  _StreamManager.run()
+    bounded, coalesces ~100ms chunks             keeps last few seconds for replay
+                                                      |
+                                          per-stream audio queue(s)
+                                                      |
+                                                      v
+                                    streaming_recognize() — one thread per
+                                    stream; two overlap during rollover
+                                                      |
+                                       transcript results + speech events
+                                       (overlap de-duplicated by end offset)
+                                                      |
+                                        loop.call_soon_threadsafe()
+                                                      |
+                                                      v
                                   session.transcript_queue → batcher
 """
 
 import asyncio
+import hashlib
 import logging
 import queue
 import threading
+import time
+from collections import OrderedDict, deque
 
 from google.api_core.client_options import ClientOptions
 from google.api_core.exceptions import OutOfRange
@@ -31,6 +39,9 @@ from google.auth import default
 from google.cloud.speech_v2 import SpeechClient
 from google.cloud.speech_v2.types import cloud_speech as cloud_speech_types
 
+from asr_backend import run_in_thread
+from audio_buffer import AudioRingBuffer
+
 log = logging.getLogger("ehr-voice")
 
 # ── Defaults (overridden by config dict passed to run_asr_bridge) ──
@@ -41,6 +52,12 @@ _DEFAULT_SAMPLE_RATE = 16000
 _DEFAULT_MAX_PHRASES_PER_SET = 1200
 _DEFAULT_PHRASE_BOOST = 5.0
 
+# Voice-activity events forwarded to the batcher as {"speech_event": ...}
+_SPEECH_EVENTS = {
+    cloud_speech_types.StreamingRecognizeResponse.SpeechEventType.SPEECH_ACTIVITY_BEGIN: "begin",
+    cloud_speech_types.StreamingRecognizeResponse.SpeechEventType.SPEECH_ACTIVITY_END: "end",
+}
+
 
 def _build_phrase_set_inline(hints: list[str], max_per_set: int = 1200,
                              boost: float = 5.0) -> list[cloud_speech_types.SpeechAdaptation.AdaptationPhraseSet]:
@@ -60,26 +77,90 @@ def _build_phrase_set_inline(hints: list[str], max_per_set: int = 1200,
     return phrase_sets
 
 
-def _create_client_and_config(phrase_hints: list[str], asr_config: dict | None = None):
-    """Create STT client and streaming config."""
+# ── Shared clients and configs ──
+# Credentials and SpeechClients (one gRPC channel each) are created once per
+# process and shared by all sessions; the prebuilt config_request is cached
+# per (procedure, ASR settings, hint set) — the hint set is identified by the
+# schema_key it was derived from, so the phrase-set protos are built once per
+# schema. Protos in the cache are never mutated.
+
+_pool_lock = threading.Lock()
+_credentials = None               # (creds, project_id) from google.auth.default()
+_client_pool: dict[tuple[str, str], SpeechClient] = {}
+_CONFIG_CACHE_MAX = 16
+_config_cache: OrderedDict = OrderedDict()
+
+
+def _get_credentials():
+    global _credentials
+    with _pool_lock:
+        if _credentials is None:
+            _credentials = default()
+        return _credentials
+
+
+def _get_client(location: str, endpoint: str) -> SpeechClient:
+    """Shared SpeechClient per (location, endpoint), created on first use."""
+    key = (location, endpoint)
+    with _pool_lock:
+        client = _client_pool.get(key)
+        if client is None:
+            t0 = time.perf_counter()
+            client = SpeechClient(client_options=ClientOptions(api_endpoint=endpoint))
+            _client_pool[key] = client
+            log.info("STT client created for %s (%.0f ms)", endpoint,
+                     (time.perf_counter() - t0) * 1000)
+        return client
+
+
+def _hints_key(hints: list[str]) -> str:
+    return hashlib.sha256("\n".join(hints).encode("utf-8")).hexdigest()[:16]
+
+
+def _create_client_and_config(phrase_hints: list[str], asr_config: dict | None = None,
+                              procedure_type: str = "endoscopy", hints_key: str | None = None):
+    """
+    Return the shared STT client and the (cached) streaming config request.
+
+    hints_key identifies the hint list (the schema_key it was derived from);
+    without one the list is hashed.
+    """
     cfg = asr_config or {}
     stt_location = cfg.get("location", _DEFAULT_STT_LOCATION)
+    endpoint = cfg.get("endpoint") or f"{stt_location}-speech.googleapis.com"
     model = cfg.get("model", _DEFAULT_MODEL)
     language_codes = cfg.get("language_codes", _DEFAULT_LANGUAGE_CODES)
     sample_rate = cfg.get("sample_rate", _DEFAULT_SAMPLE_RATE)
     max_phrases = cfg.get("max_phrases_per_set", _DEFAULT_MAX_PHRASES_PER_SET)
     phrase_boost = cfg.get("phrase_boost", _DEFAULT_PHRASE_BOOST)
 
-    creds, project_id = default()
+    _, project_id = _get_credentials()
+    client = _get_client(stt_location, endpoint)
 
-    client = SpeechClient(
-        client_options=ClientOptions(
-            api_endpoint=f"{stt_location}-speech.googleapis.com"
-        )
+    key = (procedure_type, stt_location, endpoint, model, tuple(language_codes), sample_rate,
+           max_phrases, phrase_boost, hints_key or _hints_key(phrase_hints))
+    with _pool_lock:
+        config_request = _config_cache.get(key)
+        if config_request is not None:
+            _config_cache.move_to_end(key)
+            return client, config_request
+
+    config_request = _build_config_request(
+        client.recognizer_path(project_id, stt_location, "_"), phrase_hints,
+        model, language_codes, sample_rate, max_phrases, phrase_boost,
     )
+    with _pool_lock:
+        _config_cache[key] = config_request
+        while len(_config_cache) > _CONFIG_CACHE_MAX:
+            _config_cache.popitem(last=False)
+    log.info("STT config built for %s (%d hints)", procedure_type, len(phrase_hints))
+    return client, config_request
 
-    recognizer = client.recognizer_path(project_id, stt_location, "_")
 
+def _build_config_request(recognizer: str, phrase_hints: list[str], model: str,
+                          language_codes: list[str], sample_rate: int,
+                          max_phrases: int, phrase_boost: float):
+    """Build the first StreamingRecognizeRequest (recognizer + streaming config)."""
     # Explicit decoding for raw PCM from browser AudioWorklet
     recognition_config = cloud_speech_types.RecognitionConfig(
         explicit_decoding_config=cloud_speech_types.ExplicitDecodingConfig(
@@ -109,85 +190,241 @@ def _create_client_and_config(phrase_hints: list[str], asr_config: dict | None =
         streaming_features=streaming_features,
     )
 
-    config_request = cloud_speech_types.StreamingRecognizeRequest(
+    return cloud_speech_types.StreamingRecognizeRequest(
         recognizer=recognizer,
         streaming_config=streaming_config,
     )
 
-    return client, config_request
-
-
-def _run_stt_stream(
-    client: SpeechClient,
-    config_request,
-    sync_audio_q: queue.Queue,
-    loop: asyncio.AbstractEventLoop,
-    transcript_queue: asyncio.Queue,
-    cancel_event: asyncio.Event,
-):
-    """
-    Run a single STT streaming session in a background thread.
-    Auto-restarts on 5-minute timeout (OutOfRange).
-    """
-
-    while not cancel_event.is_set():
-        def request_generator():
-            # First message: config
-            yield config_request
-            # Subsequent: audio chunks
-            while not cancel_event.is_set():
-                try:
-                    data = sync_audio_q.get(timeout=1.0)
-                except queue.Empty:
-                    continue
-                if data is None:
-                    return
-                yield cloud_speech_types.StreamingRecognizeRequest(audio=data)
 
+# ── Streaming with gapless rollover ──
+# A streaming_recognize call is cut off after ~5 minutes. Before that, the
+# next stream is opened in parallel and primed with the last few seconds of
+# audio; both get live audio until the current one reports end of speech
+# (or the overlap grows too long), then the old stream is closed and drains
+# its last results. Results of the new stream that end before the switch
+# point repeat what the old stream transcribed and are dropped.
+
+_DEFAULT_ROLLOVER_SECONDS = 240
+_DEFAULT_MAX_OVERLAP_SECONDS = 45
+_DEFAULT_REPLAY_SECONDS = 3.0
+_DEDUPE_MARGIN_SECONDS = 0.3
+_REPLAY_CHUNK_BYTES = 16000
+
+
+class _SttStream:
+    """One streaming_recognize call, fed from its own queue and run in its own thread."""
+
+    def __init__(self, sid: int, origin_bytes: int, replay: bytes):
+        self.sid = sid
+        self.origin_bytes = origin_bytes   # Global audio offset of the stream's first byte
+        self.audio_q: queue.Queue = queue.Queue()
+        self.started_at = time.monotonic()
+        self.speaking = False
+        self.skip_until = 0.0              # Stream seconds already covered by the previous stream
+        self.final_end = 0.0               # Stream seconds up to the last final result
+        self.timed_out = False
+        self.error: Exception | None = None
+        self.done = threading.Event()
+        self.thread: threading.Thread | None = None
+        for i in range(0, len(replay), _REPLAY_CHUNK_BYTES):
+            self.audio_q.put(replay[i:i + _REPLAY_CHUNK_BYTES])
+
+    def requests(self, config_request, cancel_event):
+        # First message: config
+        yield config_request
+        # Subsequent: audio chunks
+        while not cancel_event.is_set():
+            try:
+                data = self.audio_q.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            if data is None:
+                return
+            yield cloud_speech_types.StreamingRecognizeRequest(audio=data)
+
+
+class _StreamManager:
+    """Feeds session audio to the current (and, during rollover, the next) STT stream."""
+
+    def __init__(self, client: SpeechClient, config_request, audio_buffer: AudioRingBuffer,
+                 loop: asyncio.AbstractEventLoop, transcript_queue: asyncio.Queue,
+                 cancel_event: asyncio.Event, cfg: dict, paused: threading.Event | None = None):
+        self.client = client
+        self.config_request = config_request
+        self.audio_buffer = audio_buffer
+        self.loop = loop
+        self.transcript_queue = transcript_queue
+        self.cancel_event = cancel_event
+        self.paused = paused or threading.Event()
+        self.rollover_seconds = cfg.get("rollover_seconds", _DEFAULT_ROLLOVER_SECONDS)
+        self.max_overlap = cfg.get("rollover_max_overlap_seconds", _DEFAULT_MAX_OVERLAP_SECONDS)
+        self.replay_seconds = cfg.get("rollover_replay_seconds", _DEFAULT_REPLAY_SECONDS)
+        self.bytes_per_sec = audio_buffer.bytes_per_sec
+
+        self._lock = threading.Lock()
+        self._history: deque = deque()     # Recent audio kept for replay
+        self._history_bytes = 0
+        self._fed = 0                      # Total audio bytes fed so far
+        self._sid = 0
+        self.primary: _SttStream | None = None
+        self.next: _SttStream | None = None
+        self._retiring: list[_SttStream] = []
+
+    def _post(self, msg: dict):
+        msg = dict(msg, t=time.monotonic())  # When the result arrived (metrics.Trace)
+        self.loop.call_soon_threadsafe(self.transcript_queue.put_nowait, msg)
+
+    def _remember(self, data: bytes):
+        keep = int(self.replay_seconds * self.bytes_per_sec)
+        self._history.append(data)
+        self._history_bytes += len(data)
+        while self._history and self._history_bytes - len(self._history[0]) >= keep:
+            self._history_bytes -= len(self._history.popleft())
+
+    def _replay(self) -> bytes:
+        data = b"".join(self._history)
+        keep = int(self.replay_seconds * self.bytes_per_sec) & ~1
+        return data[-keep:] if keep else b""
+
+    def _start_stream(self, replay: bytes = b"") -> _SttStream:
+        self._sid += 1
+        stream = _SttStream(self._sid, self._fed - len(replay), replay)
+        stream.thread = threading.Thread(target=self._run_stream, args=(stream,), daemon=True)
+        stream.thread.start()
+        return stream
+
+    def _run_stream(self, stream: _SttStream):
         try:
-            responses = client.streaming_recognize(requests=request_generator())
-
+            responses = self.client.streaming_recognize(
+                requests=stream.requests(self.config_request, self.cancel_event))
             for response in responses:
-                if cancel_event.is_set():
+                if self.cancel_event.is_set():
                     break
-
-                for result in response.results:
-                    if not result.alternatives:
-                        continue
-                    text = result.alternatives[0].transcript
-                    is_final = result.is_final
-
-                    msg = {"text": text, "is_final": is_final}
-                    loop.call_soon_threadsafe(transcript_queue.put_nowait, msg)
-
+                self._on_response(stream, response)
         except OutOfRange:
-            # STT stream hit 5-minute limit — restart
-            log.info("STT stream timeout, restarting...")
-            loop.call_soon_threadsafe(
-                transcript_queue.put_nowait,
-                {"info": "ASR stream restarted (timeout)"},
-            )
-            continue
-
+            stream.timed_out = True
         except Exception as e:
-            if cancel_event.is_set():
+            stream.error = e
+        finally:
+            stream.done.set()
+
+    def _on_response(self, stream: _SttStream, response):
+        event = _SPEECH_EVENTS.get(response.speech_event_type)
+        if event:
+            stream.speaking = event == "begin"
+        with self._lock:
+            if stream is not self.primary and stream not in self._retiring:
+                return  # Next stream warming up — the current one still owns this audio
+            is_primary = stream is self.primary
+        if event and is_primary:
+            self._post({"speech_event": event})
+
+        for result in response.results:
+            if not result.alternatives:
+                continue
+            end = result.result_end_offset.total_seconds() if result.result_end_offset else 0.0
+            if end and end <= stream.skip_until + _DEDUPE_MARGIN_SECONDS:
+                continue  # Overlap audio, already transcribed by the previous stream
+            if result.is_final:
+                stream.final_end = max(stream.final_end, end)
+            self._post({"text": result.alternatives[0].transcript, "is_final": result.is_final})
+
+    def _switch(self, reason: str):
+        """Make the next stream current; close the old one (it drains its last results)."""
+        old, new = self.primary, self.next
+        new.skip_until = (self._fed - new.origin_bytes) / self.bytes_per_sec
+        with self._lock:
+            self.primary, self.next = new, None
+            self._retiring.append(old)
+        old.audio_q.put(None)
+        log.info("STT rollover: stream #%d → #%d after %.0fs (%s)",
+                 old.sid, new.sid, time.monotonic() - old.started_at, reason)
+
+    def _check_streams(self) -> bool:
+        """Roll over / restart streams as needed. False when the bridge must stop."""
+        now = time.monotonic()
+        primary = self.primary
+        self._retiring = [s for s in self._retiring if not s.done.is_set()]
+
+        if primary.done.is_set():
+            if primary.error is not None and not self.cancel_event.is_set():
+                log.error("STT stream error", exc_info=primary.error)
+                self._post({"error": f"ASR error: {primary.error}"})
+                return False
+            if self.next is not None:
+                self._switch("stream ended")
+                return True
+            # Unplanned restart: replay recent audio, skip what was already final
+            log.info("STT stream timeout, restarting...")
+            self._post({"info": "ASR stream restarted (timeout)"})
+            dead = primary
+            self.primary = self._start_stream(self._replay())
+            covered = dead.origin_bytes / self.bytes_per_sec + dead.final_end
+            self.primary.skip_until = max(0.0, covered - self.primary.origin_bytes / self.bytes_per_sec)
+            return True
+
+        if self.next is None:
+            if self.rollover_seconds and now - primary.started_at >= self.rollover_seconds:
+                self.next = self._start_stream(self._replay())
+                log.info("STT rollover: opened stream #%d alongside #%d", self.next.sid, primary.sid)
+        elif not primary.speaking:
+            self._switch("silence")
+        elif now - self.next.started_at >= self.max_overlap:
+            self._switch("overlap limit")
+        return True
+
+    def _pause(self):
+        """Session detached: close the streams (they drain their last results) until it resumes."""
+        if self.primary is None:
+            return
+        streams = [s for s in (self.primary, self.next) if s]
+        with self._lock:
+            self._retiring += streams
+            self.primary = self.next = None
+        for s in streams:
+            s.audio_q.put(None)
+        self._history.clear()
+        self._history_bytes = 0
+        log.info("STT paused (session detached)")
+
+    def run(self):
+        self.primary = self._start_stream()
+        while not self.cancel_event.is_set():
+            data = self.audio_buffer.read_chunk(timeout=0.5)
+            if data is None:
+                break
+            if self.paused.is_set():
+                self._pause()
+                continue
+            if self.primary is None:
+                self.primary = self._start_stream()
+                log.info("STT resumed on stream #%d", self.primary.sid)
+            if data:
+                self._remember(data)
+                self._fed += len(data)
+                self.primary.audio_q.put(data)
+                if self.next is not None:
+                    self.next.audio_q.put(data)
+            if not self._check_streams():
                 break
-            log.exception("STT stream error")
-            loop.call_soon_threadsafe(
-                transcript_queue.put_nowait,
-                {"error": f"ASR error: {str(e)}"},
-            )
-            break
 
-    log.info("STT thread exiting")
+        streams = [s for s in (self.primary, self.next) if s] + self._retiring
+        for s in streams:
+            s.audio_q.put(None)
+        for s in streams:
+            s.thread.join(timeout=5.0)
+        log.info("STT thread exiting")
 
 
-async def run_asr_bridge(ws, session, asr_config: dict | None = None):
+async def run_asr_bridge(session, asr_config: dict | None = None):
     """
     Main entry point — called as an asyncio task from server.py.
 
-    Pumps audio from session.audio_queue (async) → sync queue → STT thread,
-    and STT results back into session.transcript_queue.
+    Runs the stream manager thread, which reads coalesced chunks from
+    session.audio_buffer, feeds them to the STT stream(s) and posts results
+    into session.transcript_queue. The streams are closed while
+    session.asr_paused is set and a new one is opened when it clears.
+    Returns when the buffer is closed (session end) or the stream fails.
     """
     cfg = asr_config or {}
     phrase_hints = getattr(session, "phrase_hints", [])
@@ -199,44 +436,26 @@ async def run_asr_bridge(ws, session, asr_config: dict | None = None):
     )
 
     try:
-        client, config_request = _create_client_and_config(phrase_hints, asr_config=cfg)
+        t0 = time.perf_counter()
+        client, config_request = await asyncio.to_thread(
+            _create_client_and_config, phrase_hints, cfg,
+            getattr(session, "procedure_type", "endoscopy"),
+            getattr(session, "phrase_hints_key", None),
+        )
+        log.info("STT client + config ready in %.0f ms", (time.perf_counter() - t0) * 1000)
     except Exception as e:
         log.exception("Failed to create STT client")
         await session.transcript_queue.put({"error": f"ASR init failed: {e}"})
         return
 
-    sync_audio_q = queue.Queue()
-    loop = asyncio.get_event_loop()
-
-    # Start STT thread
-    stt_thread = threading.Thread(
-        target=_run_stt_stream,
-        args=(client, config_request, sync_audio_q, loop,
-              session.transcript_queue, session.cancel_event),
-        daemon=True,
-    )
-    stt_thread.start()
-
-    # Audio pump: async queue → sync queue
+    loop = asyncio.get_running_loop()
     try:
-        while not session.cancel_event.is_set():
-            try:
-                audio_data = await asyncio.wait_for(
-                    session.audio_queue.get(), timeout=1.0
-                )
-            except asyncio.TimeoutError:
-                continue
-
-            if audio_data is None:
-                # Sentinel: stop
-                sync_audio_q.put(None)
-                break
-
-            sync_audio_q.put(audio_data)
-
+        manager = _StreamManager(client, config_request, session.audio_buffer, loop,
+                                 session.transcript_queue, session.cancel_event, cfg,
+                                 getattr(session, "asr_paused", None))
+        await run_in_thread(manager.run, "asr-stt")
     except asyncio.CancelledError:
         log.info("ASR bridge cancelled")
     finally:
-        sync_audio_q.put(None)  # Ensure STT thread exits
-        stt_thread.join(timeout=5.0)
-        log.info("ASR bridge stopped")
+        session.audio_buffer.close()  # Ensure STT thread exits
+        log.info("ASR bridge stopped (audio buffer: %s)", session.audio_buffer.stats())
@@ -0,0 +1,258 @@
+"""
+ASR Replay — Offline ASR backend that replays a recorded session.
+
+Plays a timestamped transcript script, optionally alongside a WAV recording,
+into session.transcript_queue exactly as the Google bridge would, so the
+batcher / LLM / report-sync path can be exercised and profiled without
+network access or credentials.
+
+Script (JSON Lines, one event per line; "t" = seconds of audio):
+    {"t": 1.2, "text": "gastric ulcer in the", "final": false}
+    {"t": 2.0, "text": "gastric ulcer in the antrum", "final": true}
+    {"t": 2.1, "event": "end"}
+Blank lines and lines starting with "#" are ignored; "final" defaults to true.
+
+Timeline (config.yaml asr.replay):
+- wav set: the recording is read in chunk_ms chunks, paced at `speed` × real
+  time (speed 0 = as fast as possible); audio sent by the client is drained
+  and discarded
+- no wav: the client's own audio is the clock — an event fires once that
+  much audio has arrived, so any microphone or load generator drives it
+- loop: restart the script (and recording) when it ends; otherwise the
+  backend idles, draining audio, until the session closes
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import wave
+from dataclasses import dataclass
+from pathlib import Path
+
+from asr_backend import run_in_thread
+from audio_buffer import AudioRingBuffer
+
+log = logging.getLogger("ehr-voice")
+
+PROJECT_DIR = Path(__file__).parent
+
+# ── Defaults (overridden by asr.replay config) ──
+_DEFAULT_SCRIPT = "replay_sample.jsonl"
+_DEFAULT_SPEED = 1.0
+_DEFAULT_CHUNK_MS = 100
+
+_SPEECH_EVENTS = ("begin", "end")
+
+# Parsed scripts and decoded recordings, shared by all sessions
+_cache_lock = threading.Lock()
+_script_cache: dict[Path, list] = {}
+_wav_cache: dict[Path, tuple[bytes, int]] = {}
+
+
+@dataclass(frozen=True)
+class ReplayEvent:
+    t: float                      # Seconds of audio at which the event is emitted
+    message: dict                 # transcript_queue message
+
+
+def _resolve(path: str) -> Path:
+    p = Path(path)
+    return p if p.is_absolute() else PROJECT_DIR / p
+
+
+def load_script(path: Path) -> list[ReplayEvent]:
+    """Parse a replay script (cached per path). Raises ValueError on a bad line."""
+    with _cache_lock:
+        if path in _script_cache:
+            return _script_cache[path]
+
+    events = []
+    for lineno, line in enumerate(path.read_text(encoding="utf-8").splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            item = json.loads(line)
+            t = float(item["t"])
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"{path.name}:{lineno}: {e}") from e
+        if "text" in item:
+            message = {"text": str(item["text"]), "is_final": bool(item.get("final", True))}
+        elif item.get("event") in _SPEECH_EVENTS:
+            message = {"speech_event": item["event"]}
+        else:
+            raise ValueError(f"{path.name}:{lineno}: needs \"text\" or \"event\": begin|end")
+        events.append(ReplayEvent(t, message))
+    events.sort(key=lambda e: e.t)  # Stable: same-time events keep file order
+
+    with _cache_lock:
+        _script_cache[path] = events
+    log.info("Replay script loaded: %s (%d events, %.1fs)", path.name, len(events),
+             events[-1].t if events else 0.0)
+    return events
+
+
+def load_wav(path: Path) -> tuple[bytes, int]:
+    """Return (PCM bytes, sample rate) of a mono 16-bit WAV (cached per path)."""
+    with _cache_lock:
+        if path in _wav_cache:
+            return _wav_cache[path]
+    with wave.open(str(path), "rb") as w:
+        if w.getnchannels() != 1 or w.getsampwidth() != 2:
+            raise ValueError(f"{path.name}: expected mono 16-bit PCM, got "
+                             f"{w.getnchannels()} ch × {w.getsampwidth() * 8} bit")
+        entry = (w.readframes(w.getnframes()), w.getframerate())
+    with _cache_lock:
+        _wav_cache[path] = entry
+    return entry
+
+
+class _Replayer:
+    """Emits script events against the recording's or the client's audio clock."""
+
+    def __init__(self, events: list[ReplayEvent], audio_buffer: AudioRingBuffer,
+                 loop: asyncio.AbstractEventLoop, transcript_queue: asyncio.Queue,
+                 cancel_event: asyncio.Event, wav: tuple[bytes, int] | None,
+                 speed: float, chunk_ms: int, repeat: bool,
+                 paused: threading.Event | None = None):
+        self.events = events
+        self.audio_buffer = audio_buffer
+        self.loop = loop
+        self.transcript_queue = transcript_queue
+        self.cancel_event = cancel_event
+        self.paused = paused or threading.Event()
+        self.wav = wav
+        self.speed = speed
+        self.chunk_ms = chunk_ms
+        self.repeat = repeat
+        self.emitted = 0
+        self.audio_seconds = 0.0
+
+    def _post(self, msg: dict):
+        msg = dict(msg, t=time.monotonic())  # When the result arrived (metrics.Trace)
+        self.loop.call_soon_threadsafe(self.transcript_queue.put_nowait, msg)
+
+    def _stopped(self) -> bool:
+        return self.cancel_event.is_set() or self.audio_buffer.closed
+
+    def _hold(self) -> float:
+        """Wait while the session is detached; seconds spent waiting (the recording's clock stops)."""
+        if not self.paused.is_set():
+            return 0.0
+        t0 = time.monotonic()
+        while self.paused.is_set() and not self._stopped():
+            time.sleep(0.1)
+        return time.monotonic() - t0
+
+    def _drain(self) -> bool:
+        """Discard client audio without waiting. False once the session has ended."""
+        while True:
+            data = self.audio_buffer.read_chunk(timeout=0)
+            if data is None:
+                return False
+            if not data:
+                return True
+
+    def _ticks(self):
+        """Yield the audio clock (seconds since start of this pass) until the audio ends."""
+        if self.wav is None:
+            pos = 0.0
+            bytes_per_sec = self.audio_buffer.bytes_per_sec
+            while not self.cancel_event.is_set():
+                data = self.audio_buffer.read_chunk(timeout=0.5)
+                if data is None:
+                    return
+                pos += len(data) / bytes_per_sec
+                yield pos
+            return
+
+        pcm, rate = self.wav
+        bytes_per_sec = rate * 2
+        step = max(2, int(bytes_per_sec * self.chunk_ms / 1000) & ~1)
+        start = time.monotonic()
+        for offset in range(0, len(pcm), step):
+            start += self._hold()
+            if self._stopped() or not self._drain():
+                return
+            pos = min(len(pcm), offset + step) / bytes_per_sec
+            if self.speed > 0:
+                delay = start + pos / self.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            yield pos
+
+    def _play_once(self) -> bool:
+        """One pass over the script. False when the session ended during it."""
+        i, n = 0, len(self.events)
+        pos = 0.0
+        for pos in self._ticks():
+            while i < n and self.events[i].t <= pos:
+                self._post(self.events[i].message)
+                self.emitted += 1
+                i += 1
+            if i == n and self.wav is None:
+                break
+        self.audio_seconds += pos
+        if self._stopped():
+            return False
+        if i < n and self.wav is not None:
+            # Script runs past the recording: play the rest on wall-clock time
+            for ev in self.events[i:]:
+                self._hold()
+                if self.speed > 0:
+                    time.sleep(max(0.0, ev.t - pos) / self.speed)
+                    pos = max(pos, ev.t)
+                if self._stopped():
+                    return False
+                self._post(ev.message)
+                self.emitted += 1
+            return True
+        return i == n
+
+    def run(self):
+        while self._play_once() and self.repeat and self.events:
+            pass
+        while not self.cancel_event.is_set():
+            if self.audio_buffer.read_chunk(timeout=0.5) is None:
+                break
+        log.info("Replay thread exiting (%d events, %.1fs audio)", self.emitted, self.audio_seconds)
+
+
+async def run_replay_asr(session, asr_config: dict | None = None):
+    """
+    Replay backend entry point — same contract as asr_bridge.run_asr_bridge.
+
+    Reads asr.replay {script, wav, speed, loop}; a bad script or recording is
+    reported to the client as an ASR init error.
+    """
+    cfg = asr_config or {}
+    rcfg = cfg.get("replay") or {}
+    speed = float(rcfg.get("speed", _DEFAULT_SPEED))
+    try:
+        events = await asyncio.to_thread(load_script, _resolve(rcfg.get("script", _DEFAULT_SCRIPT)))
+        wav = None
+        if rcfg.get("wav"):
+            wav = await asyncio.to_thread(load_wav, _resolve(rcfg["wav"]))
+            if wav[1] != cfg.get("sample_rate", wav[1]):
+                log.warning("Replay WAV is %d Hz, asr.sample_rate is %s", wav[1], cfg["sample_rate"])
+    except (OSError, ValueError, wave.Error) as e:
+        log.error("Replay ASR init failed: %s", e)
+        await session.transcript_queue.put({"error": f"ASR init failed: {e}"})
+        session.audio_buffer.close()
+        return
+
+    log.info("Replay ASR starting (%d events, %s, speed=%s)", len(events),
+             f"{len(wav[0]) / (wav[1] * 2):.1f}s recording" if wav else "client audio clock", speed)
+    replayer = _Replayer(events, session.audio_buffer, asyncio.get_running_loop(),
+                         session.transcript_queue, session.cancel_event, wav, speed,
+                         cfg.get("chunk_ms", _DEFAULT_CHUNK_MS), bool(rcfg.get("loop", False)),
+                         getattr(session, "asr_paused", None))
+    try:
+        await run_in_thread(replayer.run, "asr-replay")
+    except asyncio.CancelledError:
+        log.info("Replay ASR cancelled")
+    finally:
+        session.audio_buffer.close()  # Ensure the replay thread exits
+        log.info("Replay ASR stopped (audio buffer: %s)", session.audio_buffer.stats())
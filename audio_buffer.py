@@ -0,0 +1,141 @@
+"""
+Audio Ring Buffer — Bounded, coalescing byte buffer between WebSocket and STT.
+
+The WebSocket receive loop writes raw PCM frames (non-blocking, any size);
+the STT request generator thread reads fixed ~100 ms chunks. Memory is one
+preallocated bytearray per session: if STT stalls and the buffer fills, the
+oldest audio is dropped (the newest speech matters most for live dictation)
+and write() reports how much was lost so the caller can warn the client.
+"""
+
+import threading
+import time
+
+_SAMPLE_WIDTH = 2          # LINEAR16
+_MAX_REQUEST_BYTES = 25600  # STT streaming request audio limit
+
+
+class AudioRingBuffer:
+    """Single-producer / single-consumer PCM ring buffer with drop-oldest overflow."""
+
+    def __init__(self, sample_rate: int = 16000, chunk_ms: int = 100,
+                 capacity_seconds: float = 10.0):
+        bytes_per_sec = sample_rate * _SAMPLE_WIDTH
+        self.chunk_bytes = max(_SAMPLE_WIDTH, int(bytes_per_sec * chunk_ms / 1000) & ~1)
+        self.capacity = max(self.chunk_bytes * 2, int(bytes_per_sec * capacity_seconds) & ~1)
+        self.bytes_per_sec = bytes_per_sec
+        self._buf = bytearray(self.capacity)
+        self._read = 0
+        self._fill = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        # Metrics
+        self.written_bytes = 0
+        self.dropped_bytes = 0
+        self.chunks_read = 0
+        self.peak_fill = 0
+
+    # ── Producer ──
+
+    def write(self, data: bytes) -> int:
+        """
+        Append PCM bytes; never blocks.
+
+        Returns the number of bytes dropped from the oldest end to make room
+        (0 normally). Writes after close() are ignored.
+        """
+        n = len(data)
+        if not n:
+            return 0
+        with self._cond:
+            if self._closed:
+                return 0
+            if n > self.capacity:
+                # Larger than the whole buffer: keep only the newest part
+                self.dropped_bytes += n - self.capacity
+                data = data[n - self.capacity:]
+                n = self.capacity
+            dropped = max(0, self._fill + n - self.capacity)
+            if dropped:
+                dropped = min(dropped + (dropped & 1), self._fill)  # Keep sample alignment
+                self._read = (self._read + dropped) % self.capacity
+                self._fill -= dropped
+                self.dropped_bytes += dropped
+
+            write_pos = (self._read + self._fill) % self.capacity
+            first = min(n, self.capacity - write_pos)
+            self._buf[write_pos:write_pos + first] = data[:first]
+            if first < n:
+                self._buf[:n - first] = data[first:]
+            self._fill += n
+            self.written_bytes += n
+            self.peak_fill = max(self.peak_fill, self._fill)
+            if self._fill >= self.chunk_bytes:
+                self._cond.notify()
+            return dropped
+
+    def close(self):
+        """Stop accepting audio; the reader drains what is left and then gets None."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    # ── Consumer ──
+
+    def read_chunk(self, timeout: float | None = None) -> bytes | None:
+        """
+        Wait for at least one chunk and return it (up to a few chunks when
+        catching up after a stall).
+
+        If the timeout expires first, returns whatever partial audio is
+        buffered (b"" if none) so a trailing short utterance is not held back.
+        Returns None once the buffer is closed and drained.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._fill < self.chunk_bytes and not self._closed:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if not self._fill:
+                return None if self._closed else b""
+            n = min(self._fill, _MAX_REQUEST_BYTES)
+            if n >= self.chunk_bytes:
+                n -= n % self.chunk_bytes
+            out = self._take(n)
+            self.chunks_read += 1
+            return out
+
+    def _take(self, n: int) -> bytes:
+        end = self._read + n
+        if end <= self.capacity:
+            out = bytes(self._buf[self._read:end])
+        else:
+            out = bytes(self._buf[self._read:]) + bytes(self._buf[:end - self.capacity])
+        self._read = end % self.capacity
+        self._fill -= n
+        return out
+
+    # ── Metrics ──
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def stats(self) -> dict:
+        """Fill level and counters (bytes, plus milliseconds of audio)."""
+        with self._cond:
+            fill = self._fill
+        to_ms = 1000.0 / self.bytes_per_sec
+        return {
+            "fill_bytes": fill,
+            "fill_ms": round(fill * to_ms),
+            "fill_ratio": round(fill / self.capacity, 3),
+            "peak_fill_ms": round(self.peak_fill * to_ms),
+            "capacity_ms": round(self.capacity * to_ms),
+            "written_ms": round(self.written_bytes * to_ms),
+            "dropped_ms": round(self.dropped_bytes * to_ms),
+            "chunks_read": self.chunks_read,
+        }
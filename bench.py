@@ -0,0 +1,368 @@
+"""
+Micro-benchmarks for the voice pipeline hot paths.
+
+Usage:
+    python bench.py commands          # voice command matcher vs. command list size
+    python bench.py cache             # LLM response cache key + hit vs. report size
+    python bench.py validate          # compiled validator vs. Pydantic path vs. report size
+    python bench.py update            # per-update CPU: parse → validate → prompt → send
+    python bench.py prompt            # _build_prompt with / without pre-serialised segments
+    python bench.py encoding          # prompt / output tokens with names vs. ID-encoded schema
+                                      # (count_tokens with Vertex credentials, else offline estimate)
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import statistics
+import time
+from pathlib import Path
+
+import jsonfast
+from json_patch import make_patch
+from llm_caller import _DEFAULT_LLM_LOCATION, _DEFAULT_LLM_MODEL, PromptSegments, _build_prompt
+from models import validate_llm_response
+from report_validator import ReportValidator, compile_validator
+from response_cache import ResponseCache, cache_key
+from schema_builder import SchemaCodec, build_schema, freeze_schema
+from schema_retrieval import select_schema
+from voice_commands import CommandEngine, _DEFAULT_COMMANDS
+
+# Realistic final transcripts (findings, commands, ASR variants)
+_TRANSCRIPTS = [
+    "pause",
+    "pause the dictation",
+    "take a foto",
+    "resume dictation",
+    "there is a pause in peristalsis noted in the lower esophagus",
+    "gastric ulcer in the antrum lesser curvature forrest two b with adherent clot",
+    "LA grade B",
+    "multiple erosions in the duodenal bulb",
+    "start recording now",
+    "the patient had a similar ulcer last year which was treated with clips",
+    "sessile polyp in the sigmoid about 8 mm removed with cold snare",
+    "capture photo",
+]
+
+_WORDS = [
+    "open", "close", "mark", "next", "previous", "frame", "clip", "video", "undo", "redo",
+    "save", "report", "delete", "finding", "zoom", "in", "out", "toggle", "lights", "notes",
+    "switch", "view", "select", "disease", "biopsy", "label", "record", "snapshot", "scope",
+]
+
+
+def _time_per_call(fn, texts, repeat: int) -> float:
+    """Median microseconds per transcript over `repeat` passes."""
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for t in texts:
+            fn(t)
+        samples.append((time.perf_counter() - t0) / len(texts) * 1e6)
+    return statistics.median(samples)
+
+
+def _synthetic_commands(n: int, rng: random.Random) -> dict[str, list[str]]:
+    commands = {k: list(v) for k, v in _DEFAULT_COMMANDS.items()}
+    extra = []
+    while len(extra) < n:
+        phrase = " ".join(rng.sample(_WORDS, rng.randint(2, 3))) + f" {len(extra)}"
+        extra.append(phrase)
+    commands["synthetic"] = extra
+    return commands
+
+
+def bench_commands(args):
+    rng = random.Random(0)
+    print(f"{'commands':>9} {'engine µs':>10} {'substring µs':>13}")
+    for n in args.sizes:
+        commands = _synthetic_commands(n, rng)
+        engine = CommandEngine(commands)
+        phrases = [p for ps in commands.values() for p in ps]
+
+        def substring_scan(text, phrases=phrases):
+            normalized = text.strip().lower().rstrip(".")
+            for p in phrases:
+                if p in normalized:
+                    return p
+            return None
+
+        eng = _time_per_call(engine.match, _TRANSCRIPTS, args.repeat)
+        sub = _time_per_call(substring_scan, _TRANSCRIPTS, args.repeat)
+        print(f"{len(phrases):>9} {eng:>10.1f} {sub:>13.1f}")
+
+
+def _synthetic_report(schema: dict, n: int, rng: random.Random) -> dict:
+    """Report with n schema diseases at their first location, a few attributes each."""
+    report = {}
+    for dname in rng.sample(sorted(schema["diseases"]), min(n, len(schema["diseases"]))):
+        d = schema["diseases"][dname]
+        sections = {}
+        for sname, sec in list(d.get("sections", {}).items())[:3]:
+            attrs = list(sec.get("attributes", []))[:2]
+            sections[sname] = {"attrs": {a: True for a in attrs}, "inputs": [], "subsections": {}}
+        loc = report.setdefault(d["locations"][0], {"diseases": {}})
+        loc["diseases"][dname] = {"sublocations": [], "sections": sections, "comments": ""}
+    return report
+
+
+def bench_cache(args):
+    rng = random.Random(0)
+    schema = build_schema(Path(args.csv).read_text(encoding="utf-8"))
+    cache = ResponseCache(max_entries=args.entries)
+    loop = asyncio.new_event_loop()
+    print(f"{'diseases':>9} {'key µs':>8} {'hit µs':>8} {'key+hit µs':>11}")
+    for n in args.sizes:
+        report = _synthetic_report(schema, n, rng)
+
+        def key(text, report=report):
+            return cache_key("voice", "gemini-2.5-flash", 0.1, 8192, "full", "endoscopy",
+                             "schema-hash", report, "", text, "")
+
+        for i in range(args.entries):  # Full LRU, every transcript stored
+            loop.run_until_complete(cache.put(key(f"{i}"), "voice", {"report": report}))
+        for t in _TRANSCRIPTS:
+            loop.run_until_complete(cache.put(key(t), "voice", {"report": report}))
+        keys = {t: key(t) for t in _TRANSCRIPTS}
+
+        k = _time_per_call(key, _TRANSCRIPTS, args.repeat)
+        hit = _time_per_call(lambda t: loop.run_until_complete(cache.get(keys[t], "voice")),
+                             _TRANSCRIPTS, args.repeat)
+        both = _time_per_call(lambda t: loop.run_until_complete(cache.get(key(t), "voice")),
+                              _TRANSCRIPTS, args.repeat)
+        print(f"{n:>9} {k:>8.1f} {hit:>8.1f} {both:>11.1f}")
+    loop.close()
+
+
+def _valid_report(schema: dict, n: int, rng: random.Random, noise: float) -> dict:
+    """
+    Report with n disease entries (diseases cycled over their locations), each
+    section filled as the UI would: one attribute (all selected if multi-select)
+    and the first subsection. A `noise` fraction of entries get a hallucinated
+    section, attribute and sublocation.
+    """
+    pairs = [(loc, d) for d in sorted(schema["diseases"]) for loc in schema["diseases"][d]["locations"]]
+    rng.shuffle(pairs)
+    report = {}
+    for loc, dname in pairs[:n]:
+        sections = {}
+        for sname, sec in schema["diseases"][dname].get("sections", {}).items():
+            attrs = [a for a in sec.get("attributes", []) if "_box" not in a and not a.startswith("Range(")]
+            entry = {"attrs": {a: True for a in (attrs if sec.get("multi") else attrs[:1])},
+                     "inputs": [], "subsections": {}}
+            for subname, sub in list(sec.get("subsections", {}).items())[:1]:
+                if sub.get("attributes") and not sub.get("conditional"):
+                    entry["subsections"][subname] = {"attrs": {sub["attributes"][0]: True}, "inputs": []}
+            sections[sname] = entry
+        disease = {"sublocations": [], "sections": sections, "comments": ""}
+        if rng.random() < noise:
+            disease["sections"]["Hallucinated Section"] = {"attrs": {"Grade 9": True}}
+            for sec in disease["sections"].values():
+                sec["attrs"]["Made-up attribute"] = True
+                break
+            disease["sublocations"].append("Nowhere")
+        report.setdefault(loc, {"diseases": {}})["diseases"][dname] = disease
+    return {"report": report, "overallRemarks": ""}
+
+
+def bench_validate(args):
+    rng = random.Random(0)
+    schema = build_schema(Path(args.csv).read_text(encoding="utf-8"))
+    t0 = time.perf_counter()
+    ReportValidator(schema)
+    print(f"compile: {(time.perf_counter() - t0) * 1000:.2f} ms "
+          f"({len(schema['diseases'])} diseases, once per schema)")
+    validator = compile_validator(schema)
+
+    def pydantic_path(data):
+        # What call_llm_wrapper did: model_validate, then model_dump per location
+        parsed = validate_llm_response(data, schema)
+        return {"report": {k: v.model_dump() for k, v in parsed.report.items()},
+                "overallRemarks": parsed.overallRemarks}
+
+    print(f"{'entries':>8} {'pydantic µs':>12} {'compiled µs':>12} {'speedup':>8} {'dropped':>8}")
+    for n in args.sizes:
+        data = _valid_report(schema, n, rng, args.noise)
+        _, dropped = validator.validate(data)
+        pyd = _time_per_call(pydantic_path, [data], args.repeat)
+        comp = _time_per_call(validator.validate, [data], args.repeat)
+        print(f"{n:>8} {pyd:>12.1f} {comp:>12.1f} {pyd / comp:>7.1f}x {len(dropped):>8}")
+
+
+def bench_update(args):
+    """
+    CPU per LLM update on the server, as the report grows: parse the response
+    text, validate, diff against the session state, serialise the state into
+    the next prompt and the report_update sent to the client.
+    before: json + Pydantic model_validate / model_dump; after: jsonfast + compiled validator.
+    """
+    rng = random.Random(0)
+    schema = build_schema(Path(args.csv).read_text(encoding="utf-8"))
+    validator = compile_validator(schema)
+
+    def before(case):
+        state, text = case
+        parsed = validate_llm_response(json.loads(text), schema)
+        doc = {"report": {k: v.model_dump() for k, v in parsed.report.items()},
+               "overallRemarks": parsed.overallRemarks}
+        make_patch(state, doc)
+        json.dumps(doc, separators=(",", ":"), ensure_ascii=False)
+        json.dumps({"type": "report_update", "version": 1, **doc})
+
+    def after(case):
+        state, text = case
+        doc, _ = validator.validate(jsonfast.loads(text))
+        make_patch(state, doc)
+        jsonfast.dumps(doc)
+        jsonfast.dumps({"type": "report_update", "version": 1, **doc})
+
+    print(f"codec: {jsonfast.BACKEND}")
+    print(f"{'entries':>8} {'KB':>6} {'before µs':>10} {'after µs':>9} {'speedup':>8}")
+    for n in args.sizes:
+        full = _valid_report(schema, n + 1, rng, 0.0)
+        full, _ = validator.validate(full)      # Session state holds validated reports
+        state = {"report": {loc: {"diseases": dict(e["diseases"])} for loc, e in full["report"].items()},
+                 "overallRemarks": ""}
+        loc = next(iter(state["report"]))
+        del state["report"][loc]["diseases"][next(iter(state["report"][loc]["diseases"]))]
+        text = json.dumps(full, ensure_ascii=False)   # The response adds one finding
+        case = (state, text)
+        b = _time_per_call(before, [case], args.repeat)
+        a = _time_per_call(after, [case], args.repeat)
+        print(f"{n:>8} {len(text) / 1024:>6.1f} {b:>10.1f} {a:>9.1f} {b / a:>7.1f}x")
+
+
+def bench_prompt(args):
+    """_build_prompt cost vs. report size: schema re-encoded per call vs. pre-serialised segments."""
+    rng = random.Random(0)
+    schema = freeze_schema(build_schema(Path(args.csv).read_text(encoding="utf-8")))
+    t0 = time.perf_counter()
+    segments = PromptSegments(schema)
+    print(f"segments: {(time.perf_counter() - t0) * 1000:.2f} ms once per schema, "
+          f"{len(segments.full) / 1024:.1f} KB schema text")
+    transcript = "gastric ulcer in the antrum lesser curvature forrest two b with adherent clot"
+    print(f"{'entries':>8} {'state KB':>9} {'full µs':>8} {'seg µs':>7} "
+          f"{'subset µs':>10} {'seg µs':>7}")
+    for n in args.sizes:
+        report = _valid_report(schema, n, rng, 0.0)["report"]
+        state_kb = len(jsonfast.dumps(report)) / 1024
+        subset, _ = select_schema(schema, transcript, report, llm_config={"schema_top_k": args.top_k})
+        row = []
+        for prompt_schema, is_subset in ((schema, False), (subset, True)):
+            for segs in (None, segments):
+                row.append(_time_per_call(
+                    lambda t: _build_prompt(prompt_schema, report, "", t, schema_is_subset=is_subset,
+                                            segments=segs),
+                    [transcript], args.repeat))
+        print(f"{n:>8} {state_kb:>9.1f} {row[0]:>8.1f} {row[1]:>7.1f} {row[2]:>10.1f} {row[3]:>7.1f}")
+
+
+_WORD_PIECES = re.compile(r"[A-Za-z]+|\d{1,3}|[^\w\s]")
+
+
+def _token_counter(args):
+    """
+    (label, text → token count): the model's own tokenizer (count_tokens API,
+    needs Vertex credentials), or offline word pieces — a conservative
+    estimate for IDs, which it splits at every letter/digit boundary.
+    """
+    if args.tokenizer != "estimate":
+        try:
+            from llm_caller import _get_model
+            model = _get_model({"model": args.model, "location": args.location})
+            model.count_tokens("probe")
+            return "count_tokens", lambda text: model.count_tokens(text).total_tokens
+        except Exception as e:
+            if args.tokenizer == "api":
+                raise
+            print(f"count_tokens unavailable ({type(e).__name__}), using offline estimates")
+    return "word-piece estimate", lambda text: len(_WORD_PIECES.findall(text))
+
+
+def bench_encoding(args):
+    """Prompt and response tokens, names vs. llm.schema_encoding: ids (full-schema calls)."""
+    rng = random.Random(0)
+    schema = freeze_schema(build_schema(Path(args.csv).read_text(encoding="utf-8")))
+    codec = SchemaCodec(schema)
+    transcript = "gastric ulcer in the antrum lesser curvature forrest two b with adherent clot"
+    label, count = _token_counter(args)
+
+    def row(name, names_text, ids_text):
+        a, b = count(names_text), count(ids_text)
+        print(f"{name:<24} {len(names_text):>8} {len(ids_text):>8} {a:>8} {b:>8} "
+              f"{100 * (1 - b / max(a, 1)):>6.0f}%")
+
+    print(f"{args.model} tokens ({label}); saved < 0% = ids is larger")
+    print(f"{'':<24} {'chars':>8} {'(ids)':>8} {'tokens':>8} {'(ids)':>8} {'saved':>7}")
+    row("schema (full)", jsonfast.dumps(schema), jsonfast.dumps(codec.encode_schema()))
+    for n in args.sizes:
+        report = _valid_report(schema, n, rng, 0.0)["report"]
+        row(f"prompt (full schema), {n}", _build_prompt(schema, report, "", transcript),
+            _build_prompt(schema, report, "", transcript, codec=codec))
+        row(f"state / full output, {n}", jsonfast.dumps(report), jsonfast.dumps(codec.encode_report(report)))
+        grown = dict(report)                            # One more finding dictated
+        for loc, entry in _valid_report(schema, 1, rng, 0.0)["report"].items():
+            grown[loc] = {"diseases": {**(report.get(loc) or {}).get("diseases", {}), **entry["diseases"]}}
+        patch_names = make_patch({"report": report}, {"report": grown})
+        patch_ids = make_patch({"report": codec.encode_report(report)}, {"report": codec.encode_report(grown)})
+        row("delta output, +1 dis.", jsonfast.dumps({"patch": patch_names}),
+            jsonfast.dumps({"patch": patch_ids}))
+    print("Retrieval-subset calls (schema_top_k > 0) are sent with names in either mode.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("commands", help="Voice command matcher scaling")
+    p.add_argument("--sizes", type=int, nargs="+", default=[0, 10, 100, 1000, 10000])
+    p.add_argument("--repeat", type=int, default=20)
+    p.set_defaults(func=bench_commands)
+
+    p = sub.add_parser("cache", help="LLM response cache key + hit latency")
+    p.add_argument("--csv", default=str(Path(__file__).parent / "EHR_Menu - 20260226.csv"))
+    p.add_argument("--sizes", type=int, nargs="+", default=[0, 5, 20, 50])
+    p.add_argument("--entries", type=int, default=512)
+    p.add_argument("--repeat", type=int, default=20)
+    p.set_defaults(func=bench_cache)
+
+    p = sub.add_parser("validate", help="Compiled schema validator vs. Pydantic validation")
+    p.add_argument("--csv", default=str(Path(__file__).parent / "EHR_Menu - 20260226.csv"))
+    p.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50, 200])
+    p.add_argument("--noise", type=float, default=0.2, help="Fraction of entries with hallucinations")
+    p.add_argument("--repeat", type=int, default=50)
+    p.set_defaults(func=bench_validate)
+
+    p = sub.add_parser("update", help="Per-update CPU: parse, validate, diff, serialise")
+    p.add_argument("--csv", default=str(Path(__file__).parent / "EHR_Menu - 20260226.csv"))
+    p.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50, 200])
+    p.add_argument("--repeat", type=int, default=50)
+    p.set_defaults(func=bench_update)
+
+    p = sub.add_parser("prompt", help="Prompt assembly with / without cached schema segments")
+    p.add_argument("--csv", default=str(Path(__file__).parent / "EHR_Menu - 20260226.csv"))
+    p.add_argument("--sizes", type=int, nargs="+", default=[0, 5, 20, 50, 200])
+    p.add_argument("--top-k", type=int, default=8)
+    p.add_argument("--repeat", type=int, default=200)
+    p.set_defaults(func=bench_prompt)
+
+    p = sub.add_parser("encoding", help="Prompt / output size, names vs. ID-encoded schema")
+    p.add_argument("--csv", default=str(Path(__file__).parent / "EHR_Menu - 20260226.csv"))
+    p.add_argument("--sizes", type=int, nargs="+", default=[1, 5, 20])
+    p.add_argument("--top-k", type=int, default=8)
+    p.add_argument("--tokenizer", choices=["auto", "api", "estimate"], default="auto",
+                   help="api: GenerativeModel.count_tokens; estimate: offline word pieces; "
+                        "auto: api, else estimate")
+    p.add_argument("--model", default=_DEFAULT_LLM_MODEL)
+    p.add_argument("--location", default=_DEFAULT_LLM_LOCATION)
+    p.set_defaults(func=bench_encoding)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
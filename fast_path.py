@@ -0,0 +1,331 @@
+"""
+Fast Path — Resolves short, formulaic dictation locally without the LLM.
+
+Utterances like "Forrest 2B", "LA grade B" or "antrum lesser curvature" map
+one-to-one onto schema entries. A PhraseMatcher compiled once per schema
+(disease names, locations, sublocations, section names and attribute values
+with their short forms) finds them; resolve() then turns an utterance into
+JSON Patch ops on the {report, overallRemarks} document, scoped to the active
+disease (or to a disease named in the same utterance).
+
+resolve() is deliberately conservative and returns None — send it to the
+LLM — whenever:
+- any word is not part of a recognised phrase (negations, past tense,
+  numbers for input boxes, side talk all end up here)
+- a phrase fits more than one section/sublocation and nothing disambiguates it
+- two values are given for a single-select section
+- more than one disease is named, or no disease is active
+- a bare number/letter value ("3", "B") comes without its section name
+"""
+
+import logging
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from json_patch import _escape_token
+from phrase_matcher import PhraseMatcher, tokenize
+
+log = logging.getLogger("ehr-voice")
+
+# Words that may appear around recognised phrases without changing the meaning
+_IGNORABLE = {
+    "a", "an", "the", "is", "are", "of", "in", "on", "at", "with", "and", "there",
+    "seen", "noted", "grade", "grading", "class", "classification", "score",
+    "scale", "type", "stage",
+}
+# Trailing words dropped from section names to form short cues ("LA grade")
+_GENERIC_SECTION_WORDS = {"grading", "grade", "classification", "class", "score", "scale", "type"}
+# Short words an acronym cue must not collide with
+_COMMON_WORDS = {"as", "be", "by", "do", "he", "if", "in", "it", "me", "no", "or", "so", "to", "up", "we"}
+_ROMAN_RE = re.compile(r"^(iv|i{1,3})([abc]?)$")
+_ROMAN = {"i": "1", "ii": "2", "iii": "3", "iv": "4"}
+_BOX_RE = re.compile(r"(int|float|alphanum)_box")
+
+_MATCHER_CACHE_MAX = 16
+_matcher_cache: OrderedDict = OrderedDict()
+
+
+# ── Compilation ──
+
+def _attribute_aliases(attr: str) -> list[list[str]]:
+    """
+    Token sequences a doctor might say for an attribute label.
+
+    "IIb — Adherent clot" → "iib adherent clot", "iib", "2 b", "adherent clot".
+    """
+    aliases = [tokenize(attr)]
+    parts = re.split(r"\s+[—–-]\s+", attr, maxsplit=1)
+    if len(parts) == 2:
+        aliases.extend([tokenize(parts[0]), tokenize(parts[1])])
+    head = tokenize(parts[0])
+    if len(head) == 1:
+        m = _ROMAN_RE.match(head[0])
+        if m:
+            aliases.append([_ROMAN[m.group(1)]] + ([m.group(2)] if m.group(2) else []))
+    return [a for a in aliases if a]
+
+
+def _section_cues(name: str) -> list[list[str]]:
+    """Section name, minus generic trailing words, plus its acronym ("Los Angeles" → "la")."""
+    tokens = tokenize(name)
+    cues = [tokens]
+    core = [t for t in tokens if t not in _GENERIC_SECTION_WORDS]
+    if core and core != tokens:
+        cues.append(core)
+    if len(core) >= 2:
+        acronym = "".join(t[0] for t in core)
+        if acronym not in _IGNORABLE and acronym not in _COMMON_WORDS:
+            cues.append([acronym])
+    return cues
+
+
+def _disease_aliases(name: str) -> list[str]:
+    """Full name plus its "/"-separated and parenthesis-free forms ("Reflux Esophagitis/GERD")."""
+    aliases = [name]
+    plain = re.sub(r"\s*\(.*?\)", "", name).strip()
+    aliases.append(plain)
+    if "/" in plain:
+        aliases.extend(p.strip() for p in plain.split("/"))
+    return [a for a in dict.fromkeys(aliases) if tokenize(a)]
+
+
+def _is_bare(tokens: list[str]) -> bool:
+    """A single short token ("3", "b") — too weak to stand without its section cue."""
+    return len(tokens) == 1 and len(tokens[0]) <= 2
+
+
+class FastPathMatcher:
+    """Phrase automaton plus lookup tables compiled from one schema."""
+
+    def __init__(self, schema: dict):
+        self.schema = schema
+        self.matcher = PhraseMatcher()
+        m = self.matcher
+
+        for loc in schema.get("locations", []):
+            m.add(loc, ("location", loc))
+        for loc, sub in schema.get("sublocations", {}).items():
+            if isinstance(sub, dict):
+                for region, options in sub.items():
+                    if region == "_standalone":
+                        for s in options:
+                            m.add(s, ("subloc", loc, s))
+                        continue
+                    m.add(region, ("region", loc, region))
+                    for opt in options:
+                        m.add(opt, ("option", loc, region, opt))
+            else:
+                for s in sub:
+                    m.add(s, ("subloc", loc, s))
+
+        for dname, ddef in schema.get("diseases", {}).items():
+            for alias in _disease_aliases(dname):
+                m.add(alias, ("disease", dname))
+            for sname, sdef in ddef.get("sections", {}).items():
+                self._add_section(dname, sname, None, sdef)
+                for subname, subdef in sdef.get("subsections", {}).items():
+                    self._add_section(dname, sname, subname, subdef)
+        m.build()
+
+    def _add_section(self, dname: str, sname: str, subname, sdef: dict):
+        for cue in _section_cues(subname or sname):
+            self.matcher.add(cue, ("section", dname, sname, subname))
+        multi = bool(sdef.get("multi"))
+        for attr in sdef.get("attributes", []):
+            if _BOX_RE.search(attr):
+                continue  # Needs a spoken value — leave to the LLM
+            for alias in _attribute_aliases(attr):
+                self.matcher.add(alias, ("attr", dname, sname, subname, attr, multi, _is_bare(alias)))
+
+
+def get_matcher(schema: dict, schema_key: str | None = None) -> FastPathMatcher:
+    """Return the compiled matcher for a schema, built once per schema_key."""
+    if schema_key is None:
+        return FastPathMatcher(schema)
+    matcher = _matcher_cache.get(schema_key)
+    if matcher is None:
+        matcher = FastPathMatcher(schema)
+        _matcher_cache[schema_key] = matcher
+        while len(_matcher_cache) > _MATCHER_CACHE_MAX:
+            _matcher_cache.popitem(last=False)
+        log.info("Fast path matcher compiled: %d phrases", len(matcher.matcher))
+    else:
+        _matcher_cache.move_to_end(schema_key)
+    return matcher
+
+
+# ── Resolution ──
+
+@dataclass
+class FastPathResult:
+    ops: list                     # JSON Patch ops on {report, overallRemarks}
+    active: dict                  # {"loc", "disease"} the update applied to
+    summary: list = field(default_factory=list)
+
+
+def _pick(candidates: list):
+    """The single candidate, or None when there are zero or several."""
+    unique = list(dict.fromkeys(candidates))
+    return unique[0] if len(unique) == 1 else None
+
+
+def resolve(fpm: FastPathMatcher, text: str, report: dict | None,
+            active: dict | None, ignorable: set | None = None) -> FastPathResult | None:
+    """Turn an utterance into patch ops, or None when the LLM should handle it."""
+    tokens = tokenize(text)
+    if not tokens:
+        return None
+    ignorable = _IGNORABLE | (ignorable or set())
+    matches = fpm.matcher.cover(tokens)
+
+    covered = set()
+    for mt in matches:
+        covered.update(range(mt.start, mt.end))
+    if any(i not in covered and t not in ignorable for i, t in enumerate(tokens)):
+        return None
+
+    kinds = [{p[0] for p in mt.payloads} for mt in matches]
+    schema = fpm.schema
+    report = report or {}
+
+    # ── Target disease ──
+    named = set()
+    for mt, kind in zip(matches, kinds):
+        if "disease" in kind:
+            if len(mt.payloads) > 1:
+                return None  # Disease name that is also a place or a value
+            named.add(mt.payloads[0][1])
+    if len(named) > 1:
+        return None
+    locs_said = {p[1] for mt in matches for p in mt.payloads
+                 if p[0] in ("location", "subloc", "region", "option")}
+    if named:
+        dname = named.pop()
+        allowed = schema["diseases"][dname].get("locations", [])
+        if active and active.get("disease") == dname and active.get("loc") in allowed:
+            loc = active["loc"]
+            if locs_said and loc not in locs_said:
+                loc = _pick([l for l in allowed if l in locs_said])
+        else:
+            loc = _pick([l for l in allowed if l in locs_said] if locs_said else allowed)
+        if loc is None:
+            return None
+    else:
+        if not active:
+            return None
+        loc, dname = active.get("loc"), active.get("disease")
+        if dname not in schema.get("diseases", {}):
+            return None
+        if dname not in (report.get(loc) or {}).get("diseases", {}):
+            return None
+    entry = (report.get(loc) or {}).get("diseases", {}).get(dname)
+    ddef = schema["diseases"][dname]
+
+    # ── Sublocations, section cues and attributes ──
+    sublocs, attrs, cues = [], [], set()
+    region = None
+    for mt, kind in zip(matches, kinds):
+        payloads = mt.payloads
+        if "disease" in kind:
+            region = None
+            continue
+        place = [p for p in payloads if p[0] in ("location", "subloc", "region", "option") and p[1] == loc]
+        own = [p for p in payloads if p[0] in ("section", "attr") and p[1] == dname]
+        if place and own:
+            return None
+        if place:
+            if all(p[0] == "location" for p in place):
+                region = None
+                continue
+            p = _pick([p for p in place if p[0] != "option" or p[2] == region])
+            if p is None:
+                return None
+            if p[0] == "region":
+                region = p[2]
+                sublocs.append(region)
+            elif p[0] == "option":
+                sublocs.append(f"{region} - {p[3]}")
+            else:
+                region = None
+                sublocs.append(p[2])
+            continue
+        region = None
+        if not own:
+            return None  # Place, section or value that does not fit the target
+        cue_hits = [p for p in own if p[0] == "section"]
+        attr_hits = [p for p in own if p[0] == "attr"]
+        if cue_hits and not attr_hits:
+            cues.update((p[2], p[3]) for p in cue_hits)
+            continue
+        attrs.append(attr_hits)
+
+    resolved = []
+    for cands in attrs:
+        if cues:
+            narrowed = [p for p in cands if (p[2], p[3]) in cues]
+            cands = narrowed or cands
+        p = _pick(cands)
+        if p is None or (p[6] and (p[2], p[3]) not in cues):
+            return None
+        resolved.append(p)
+
+    if not resolved and not sublocs and entry is not None:
+        return None  # Nothing to change beyond what the LLM might infer
+
+    # Single-select sections take one value per utterance
+    per_section: dict = {}
+    for p in resolved:
+        per_section.setdefault((p[2], p[3]), []).append(p)
+    for key, ps in per_section.items():
+        if not ps[0][5] and len({p[4] for p in ps}) > 1:
+            return None
+
+    # ── Build patch ──
+    base = f"/report/{_escape_token(loc)}/diseases/{_escape_token(dname)}"
+    ops, summary = [], []
+    if entry is None:
+        entry = {"sublocations": [], "sections": {}, "comments": ""}
+        default = ddef.get("default_sublocation")
+        if default and not sublocs:
+            entry["sublocations"] = [default]
+        ops.append({"op": "add", "path": base, "value": entry})
+        summary.append(f"+{dname} @ {loc}")
+
+    if sublocs:
+        current = list(entry.get("sublocations", []))
+        for s in sublocs:
+            if " - " in s:
+                reg = s.split(" - ", 1)[0]
+                if reg not in current:
+                    current.append(reg)
+            if s not in current:
+                current.append(s)
+        ops.append({"op": "add", "path": f"{base}/sublocations", "value": current})
+        summary.append("sub: " + ", ".join(sublocs))
+
+    sections = entry.get("sections", {})
+    for (sname, subname), ps in per_section.items():
+        sec = sections.get(sname)
+        path = f"{base}/sections/{_escape_token(sname)}"
+        if subname is not None:
+            if sec is None:
+                sec = {"attrs": {}, "inputs": [], "subsections": {}}
+                ops.append({"op": "add", "path": path, "value": sec})
+            node = sec.get("subsections", {}).get(subname)
+            path = f"{path}/subsections/{_escape_token(subname)}"
+        else:
+            node = sec
+        new_attrs = {p[4]: True for p in ps}
+        if node is None:
+            value = {"attrs": new_attrs, "inputs": []}
+            if subname is None:
+                value["subsections"] = {}
+            ops.append({"op": "add", "path": path, "value": value})
+        else:
+            merged = dict(node.get("attrs", {})) if ps[0][5] else {}
+            merged.update(new_attrs)
+            ops.append({"op": "add", "path": f"{path}/attrs", "value": merged})
+        summary.append(f"{subname or sname}={', '.join(new_attrs)}")
+
+    return FastPathResult(ops, {"loc": loc, "disease": dname}, summary)
@@ -0,0 +1,282 @@
+"""
+JSON Patch — minimal RFC 6902 implementation for LLM delta output.
+
+apply_patch() never mutates its input. Containers along each operation's path
+are shallow-copied (copy-on-write), so untouched subtrees stay shared with the
+original document and applying a small patch to a large report stays cheap.
+
+LLM output is not always strictly conformant, so by default the applier is
+lenient: missing parent objects are created on "add"/"replace", "replace" of
+a missing key behaves like "add", and the op aliases "modify"/"set"/"delete"
+are accepted.
+
+merge() is a three-way merge for rebasing one change (base → result) onto a
+document that has changed since (base → current).
+"""
+
+from __future__ import annotations
+
+import copy
+
+_OP_ALIASES = {"modify": "replace", "set": "replace", "delete": "remove"}
+
+
+class JsonPatchError(ValueError):
+    """Raised when a patch is malformed or cannot be applied."""
+
+
+class MergeConflict(JsonPatchError):
+    """Raised by merge() when both sides changed the same value differently."""
+
+_MISSING = object()
+
+
+def _parse_pointer(path: str) -> list[str]:
+    """Split an RFC 6901 JSON Pointer into unescaped reference tokens."""
+    if not isinstance(path, str):
+        raise JsonPatchError(f"Path must be a string: {path!r}")
+    if path == "":
+        return []
+    if not path.startswith("/"):
+        raise JsonPatchError(f"Path must start with '/': {path!r}")
+    return [t.replace("~1", "/").replace("~0", "~") for t in path[1:].split("/")]
+
+
+def _escape_token(token: str) -> str:
+    return token.replace("~", "~0").replace("/", "~1")
+
+
+def _list_index(container: list, token: str, allow_end: bool) -> int:
+    if token == "-" and allow_end:
+        return len(container)
+    try:
+        idx = int(token)
+    except ValueError:
+        raise JsonPatchError(f"Invalid array index: {token!r}")
+    limit = len(container) if allow_end else len(container) - 1
+    if idx < 0 or idx > limit:
+        raise JsonPatchError(f"Array index out of range: {idx}")
+    return idx
+
+
+def _child(container, token: str):
+    if isinstance(container, dict):
+        if token not in container:
+            raise JsonPatchError(f"Missing key: {token!r}")
+        return container[token]
+    if isinstance(container, list):
+        return container[_list_index(container, token, allow_end=False)]
+    raise JsonPatchError(f"Cannot traverse into {type(container).__name__}")
+
+
+def _get(doc, tokens: list[str]):
+    node = doc
+    for t in tokens:
+        node = _child(node, t)
+    return node
+
+
+def _copy_path(doc, tokens: list[str], create: bool):
+    """
+    Copy containers from the root down to the parent of tokens[-1].
+
+    Returns (new_root, parent) where parent is a fresh copy owned by new_root.
+    """
+    root = doc.copy() if isinstance(doc, (dict, list)) else doc
+    if not isinstance(root, (dict, list)):
+        raise JsonPatchError("Document root is not a container")
+    node = root
+    for t in tokens[:-1]:
+        if isinstance(node, dict):
+            child = node.get(t)
+            if child is None:
+                if not create:
+                    raise JsonPatchError(f"Missing key: {t!r}")
+                child = {}
+            elif not isinstance(child, (dict, list)):
+                raise JsonPatchError(f"Cannot traverse into {type(child).__name__} at {t!r}")
+            else:
+                child = child.copy()
+            node[t] = child
+        else:
+            idx = _list_index(node, t, allow_end=False)
+            child = node[idx]
+            if not isinstance(child, (dict, list)):
+                raise JsonPatchError(f"Cannot traverse into {type(child).__name__} at {t!r}")
+            child = child.copy()
+            node[idx] = child
+        node = child
+    return root, node
+
+
+def _apply_op(doc, op: dict, lenient: bool):
+    if not isinstance(op, dict):
+        raise JsonPatchError(f"Operation must be an object: {op!r}")
+    name = op.get("op")
+    if lenient:
+        name = _OP_ALIASES.get(name, name)
+    tokens = _parse_pointer(op.get("path"))
+
+    if name in ("add", "replace"):
+        if "value" not in op:
+            raise JsonPatchError(f"'{name}' requires a value")
+        value = op["value"]
+        if not tokens:
+            return value
+        root, parent = _copy_path(doc, tokens, create=lenient)
+        last = tokens[-1]
+        if isinstance(parent, dict):
+            if name == "replace" and last not in parent and not lenient:
+                raise JsonPatchError(f"Cannot replace missing key: {last!r}")
+            parent[last] = value
+        elif name == "add":
+            parent.insert(_list_index(parent, last, allow_end=True), value)
+        else:
+            parent[_list_index(parent, last, allow_end=False)] = value
+        return root
+
+    if name == "remove":
+        if not tokens:
+            raise JsonPatchError("Cannot remove the document root")
+        try:
+            root, parent = _copy_path(doc, tokens, create=False)
+        except JsonPatchError:
+            if lenient:
+                return doc  # Already absent
+            raise
+        last = tokens[-1]
+        if isinstance(parent, dict):
+            if last not in parent:
+                if lenient:
+                    return doc
+                raise JsonPatchError(f"Cannot remove missing key: {last!r}")
+            del parent[last]
+        else:
+            del parent[_list_index(parent, last, allow_end=False)]
+        return root
+
+    if name in ("move", "copy"):
+        src_tokens = _parse_pointer(op.get("from"))
+        value = _get(doc, src_tokens)
+        if name == "move":
+            if tokens[:len(src_tokens)] == src_tokens and tokens != src_tokens:
+                raise JsonPatchError("Cannot move a value into its own child")
+            doc = _apply_op(doc, {"op": "remove", "path": op["from"]}, lenient=False)
+        else:
+            value = copy.deepcopy(value)
+        return _apply_op(doc, {"op": "add", "path": op["path"], "value": value}, lenient)
+
+    if name == "test":
+        if _get(doc, tokens) != op.get("value"):
+            raise JsonPatchError(f"Test failed at {op.get('path')!r}")
+        return doc
+
+    raise JsonPatchError(f"Unknown op: {name!r}")
+
+
+def apply_patch(doc, ops: list, lenient: bool = True, skip_errors: bool = False):
+    """
+    Apply a list of JSON Patch operations and return the patched document.
+
+    The input document is left unmodified. Raises JsonPatchError on the first
+    operation that cannot be applied, unless skip_errors is set, in which case
+    failing operations are dropped and the rest still apply.
+    """
+    if not isinstance(ops, list):
+        raise JsonPatchError(f"Patch must be a list, got {type(ops).__name__}")
+    for op in ops:
+        try:
+            doc = _apply_op(doc, op, lenient)
+        except JsonPatchError:
+            if not skip_errors:
+                raise
+    return doc
+
+
+def make_patch(src, dst, path: str = "") -> list[dict]:
+    """
+    Compute a patch that turns src into dst.
+
+    Objects are compared key by key; lists and scalars that differ are
+    replaced wholesale, which keeps patches small for the report structure
+    (lists there are short sublocation/input arrays).
+    """
+    if src is dst:
+        return []
+    if isinstance(src, dict) and isinstance(dst, dict):
+        ops = []
+        for key, value in src.items():
+            child = f"{path}/{_escape_token(key)}"
+            if key not in dst:
+                ops.append({"op": "remove", "path": child})
+            else:
+                ops.extend(make_patch(value, dst[key], child))
+        for key, value in dst.items():
+            if key not in src:
+                ops.append({"op": "add", "path": f"{path}/{_escape_token(key)}", "value": value})
+        return ops
+    if src == dst and type(src) is type(dst):
+        return []
+    return [{"op": "replace", "path": path, "value": dst}]
+
+
+def _merge_text(base: str, current: str, result: str) -> str | None:
+    """Both sides appended to base: the result's addition goes after the current text."""
+    if not (current.startswith(base) and result.startswith(base)):
+        return None
+    added = result[len(base):]
+    if current and added and not current[-1].isspace() and not added[0].isspace():
+        added = " " + added
+    return current + added
+
+
+def merge(base, current, result, path: str = "", strict: bool = True):
+    """
+    Three-way merge: apply the changes base → result on top of current.
+
+    Objects merge key by key, so an entry added on both sides keeps both
+    sides' children. Lists keep current's items, drop those the result
+    removed from base and add those it introduced. Strings both sides
+    extended from base keep both additions (current's first). Changes the
+    result makes inside a key current removed are dropped. Anything else
+    changed differently on both sides raises MergeConflict, or keeps
+    current's value when strict is False. No input is modified.
+    """
+    if result is base or result == base:
+        return current
+    if current is base or current == base or current == result:
+        return result
+    if base is _MISSING or base is None:
+        base = {} if isinstance(current, dict) and isinstance(result, dict) else \
+            [] if isinstance(current, list) and isinstance(result, list) else \
+            "" if isinstance(current, str) and isinstance(result, str) else base
+    if isinstance(current, dict) and isinstance(result, dict) and isinstance(base, dict):
+        merged = dict(current)
+        for key in {**base, **result}:
+            b, r = base.get(key, _MISSING), result.get(key, _MISSING)
+            c = current.get(key, _MISSING)
+            if r is b or r == b:
+                continue
+            child = f"{path}/{_escape_token(key)}"
+            if c is _MISSING:
+                if b is _MISSING:
+                    merged[key] = r       # Added by the result only
+                continue                  # Removed meanwhile: the result's edit is dropped
+            if r is _MISSING:
+                if c == b:
+                    del merged[key]
+                elif strict:
+                    raise MergeConflict(f"Removed by one side, changed by the other: {child}")
+                continue
+            merged[key] = merge(b, c, r, child, strict)
+        return merged
+    if isinstance(current, list) and isinstance(result, list) and isinstance(base, list):
+        return ([x for x in current if x not in base or x in result]
+                + [x for x in result if x not in current and x not in base])
+    if isinstance(current, str) and isinstance(result, str) and isinstance(base, str):
+        text = _merge_text(base, current, result)
+        if text is not None:
+            return text
+    if strict:
+        raise MergeConflict(f"Changed differently on both sides: {path or '/'}")
+    return current
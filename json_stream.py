@@ -0,0 +1,200 @@
+"""
+JSON Stream — Incremental JSON parser that yields completed subtrees.
+
+Fed a JSON document in arbitrary text chunks (e.g. a streamed LLM response),
+it reports each object or array whose path matches one of the given patterns
+as soon as its closing bracket arrives — without waiting for the rest of the
+document. Patterns are tuples of keys / array indices, "*" matching any:
+
+    stream = JsonSubtreeStream([("report", "*", "diseases", "*")])
+    for chunk in chunks:
+        for path, value in stream.feed(chunk):
+            ...   # path = ("report", "Stomach", "diseases", "Gastric Ulcer")
+
+Only the structure is tracked while scanning (string / escape state, the
+container stack and the current key); a matched subtree is decoded once,
+with jsonfast.loads on its slice of the buffer. Text before the top-level value
+(a stray code fence, whitespace) is skipped. Malformed input does not raise
+here — the caller parses the complete text afterwards as usual.
+
+StreamedResult applies this to an LLM report response: it keeps a provisional
+{report, overallRemarks} document, updated as each disease entry (full
+output mode) or patch operation (delta mode) completes.
+"""
+
+from typing import Any
+
+import jsonfast
+from json_patch import JsonPatchError, apply_patch
+
+WILDCARD = "*"
+
+
+class _Frame:
+    """An open object or array on the parse stack."""
+    __slots__ = ("is_object", "path", "key", "expect_key", "capture_start")
+
+    def __init__(self, is_object: bool, path: tuple, capture_start: int | None):
+        self.is_object = is_object
+        self.path = path
+        self.key: Any = None if is_object else 0    # Current key, or array index
+        self.expect_key = is_object                 # Next string is a key, not a value
+        self.capture_start = capture_start          # Buffer offset if this subtree is matched
+
+
+def _matches(path: tuple, pattern: tuple) -> bool:
+    return len(path) == len(pattern) and all(
+        p == WILDCARD or p == k for k, p in zip(path, pattern))
+
+
+class JsonSubtreeStream:
+    """Scans JSON text incrementally and returns matched subtrees as they complete."""
+
+    def __init__(self, patterns: list[tuple]):
+        self.patterns = [tuple(p) for p in patterns]
+        self.buf = ""
+        self.pos = 0
+        self.stack: list[_Frame] = []
+        self.done = False
+        self.in_string = False
+        self.escape = False
+        self.key_start: int | None = None           # Offset of the key string being read
+
+    def _wanted(self, path: tuple) -> bool:
+        return any(_matches(path, p) for p in self.patterns)
+
+    def _child_path(self) -> tuple:
+        if not self.stack:
+            return ()
+        top = self.stack[-1]
+        return top.path + (top.key,)
+
+    def feed(self, chunk: str) -> list[tuple[tuple, Any]]:
+        """Consume a chunk; return (path, value) for each matched subtree completed by it."""
+        if self.done or not chunk:
+            return []
+        self.buf += chunk
+        out = []
+        buf, i, n = self.buf, self.pos, len(self.buf)
+        while i < n:
+            c = buf[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+                    if self.key_start is not None:
+                        top = self.stack[-1]
+                        try:
+                            top.key = jsonfast.loads(buf[self.key_start:i + 1])
+                        except ValueError:
+                            top.key = buf[self.key_start + 1:i]
+                        top.expect_key = False
+                        self.key_start = None
+                i += 1
+                continue
+
+            if c in "{[":
+                path = self._child_path()
+                start = i if self.stack and self._wanted(path) else None
+                self.stack.append(_Frame(c == "{", path, start))
+            elif c in "}]":
+                if not self.stack:
+                    i += 1
+                    continue
+                frame = self.stack.pop()
+                if frame.capture_start is not None:
+                    try:
+                        out.append((frame.path, jsonfast.loads(buf[frame.capture_start:i + 1])))
+                    except ValueError:
+                        pass  # Malformed subtree: reported by the final parse
+                if not self.stack:
+                    self.done = True
+                    self.pos = i + 1
+                    return out
+            elif c == '"' and self.stack:
+                self.in_string = True
+                top = self.stack[-1]
+                self.key_start = i if top.is_object and top.expect_key else None
+            elif c == "," and self.stack:
+                top = self.stack[-1]
+                if top.is_object:
+                    top.expect_key = True
+                else:
+                    top.key += 1
+            i += 1
+        self.pos = i
+        return out
+
+
+# ── Streamed LLM results ──
+
+_FULL_PATTERNS = [("report", WILDCARD, "diseases", WILDCARD)]
+_DELTA_PATTERNS = [("patch", WILDCARD), (WILDCARD,)]   # {"patch": [...]} or a bare op list
+
+
+class StreamedResult:
+    """
+    Provisional state of a streamed LLM response, against the state it was based on.
+
+    Full mode overlays each completed disease entry on the base report
+    (entries not streamed yet keep their base value; removals and
+    overallRemarks only show in the final response). Delta mode applies each
+    completed patch operation, skipping ones that do not apply.
+
+    With codec (schema_builder.SchemaCodec, llm.schema_encoding: ids), each
+    entry / operation is decoded to canonical names before it is applied.
+    """
+
+    def __init__(self, base_report: dict, overall_remarks: str, output_mode: str = "full",
+                 codec=None):
+        self.delta = output_mode == "delta"
+        self.codec = codec
+        self.parser = JsonSubtreeStream(_DELTA_PATTERNS if self.delta else _FULL_PATTERNS)
+        self.doc = {"report": dict(base_report or {}), "overallRemarks": overall_remarks or ""}
+        self.updates = 0                            # Subtrees applied so far
+
+    def feed(self, chunk: str) -> dict | None:
+        """Consume a chunk; return the provisional document if it changed, else None."""
+        changed = False
+        for path, value in self.parser.feed(chunk):
+            if self.delta:
+                if self.codec is not None and isinstance(value, dict) and "op" in value:
+                    value = self.codec.decode_op(value)
+                changed |= self._apply_op(value)
+            else:
+                dname = path[3]
+                if self.codec is not None:
+                    dname, value = self.codec.decode_disease(dname, value)
+                changed |= self._set_disease(path[1], dname, value)
+        if changed:
+            self.updates += 1
+            return self.doc
+        return None
+
+    def _set_disease(self, loc, dname, entry) -> bool:
+        if not isinstance(loc, str) or not isinstance(dname, str) or not isinstance(entry, dict):
+            return False
+        report = self.doc["report"]
+        loc_entry = dict(report.get(loc) or {})     # Copy on write: the base is shared
+        diseases = dict(loc_entry.get("diseases") or {})
+        if diseases.get(dname) == entry:
+            return False
+        diseases[dname] = entry
+        loc_entry["diseases"] = diseases
+        report[loc] = loc_entry
+        return True
+
+    def _apply_op(self, op) -> bool:
+        if not isinstance(op, dict) or "op" not in op:
+            return False                            # The enclosing "patch" list itself
+        try:
+            doc = apply_patch(self.doc, [op])
+        except JsonPatchError:
+            return False
+        if not isinstance(doc, dict) or doc == self.doc:
+            return False
+        self.doc = doc
+        return True
@@ -0,0 +1,43 @@
+"""
+JSON Fast — JSON codec for the voice hot path, using orjson when installed.
+
+Every utterance parses an LLM response, serialises the current report into
+the prompt and sends an update to the client; with a growing report these
+are the largest JSON documents the server handles. orjson does each several
+times faster than the standard library and is picked up automatically; when
+it is missing (or cannot encode a value, e.g. a non-string key), the
+standard json module is used with the same output:
+
+    dumps(obj)                  compact separators, UTF-8 kept (ensure_ascii=False)
+    dumps(obj, sort_keys=True)  canonical form (cache keys)
+    loads(text)                 str or bytes
+
+Output is identical for the JSON types the pipeline uses, so prompt text,
+prefix cache and response cache keys do not change with the backend.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # Optional: pip install orjson
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def dumps(obj, sort_keys: bool = False) -> str:
+    """Compact JSON text of obj."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0).decode("utf-8")
+        except TypeError:
+            pass  # Non-string keys, big ints, custom types: the stdlib handles or reports them
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, sort_keys=sort_keys)
+
+
+def loads(text: str | bytes):
+    """Parse JSON text. Raises ValueError (json.JSONDecodeError or orjson.JSONDecodeError) if malformed."""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
@@ -2,16 +2,45 @@
 LLM Caller — Uses Gemini 2.5 Flash to update EHR JSON from voice transcripts.
 
 Single-shot calls: sends schema + current report + transcript each time.
-Returns updated report JSON with {report, overallRemarks}.
+Returns updated report JSON with {report, overallRemarks}, or in delta mode
+(llm.output_mode: delta) a JSON Patch {patch: [...]} against the current state.
+
+With llm.stream the response is consumed as it is generated: completed
+disease entries / patch operations are handed to an on_partial callback as a
+provisional state while the rest of the response is still being produced.
+
+With llm.response_cache, successful responses of both calls are memoized by
+a hash of the model, generation settings and prompt inputs (response_cache.py).
+
+With llm.schema_encoding: ids, calls that send the full schema send it and
+the current state with short IDs for diseases, sections, subsections and
+attributes, and the model answers in them (schema_builder.SchemaCodec); the
+response is decoded back to canonical names before it is returned. Calls
+that send a retrieval subset use names: a subset is not smaller in IDs.
 """
 
+import asyncio
+import datetime
 import json
 import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
 
 import vertexai
 from google.auth import default
 from vertexai.generative_models import GenerativeModel, GenerationConfig
 
+import jsonfast
+from json_stream import StreamedResult
+from response_cache import ResponseCache, cache_key
+from schema_builder import SchemaCodec, get_codec
+from schema_retrieval import select_schema
+
+PROJECT_DIR = Path(__file__).parent
+
 log = logging.getLogger("ehr-voice")
 
 # ── Defaults (overridden by llm_config dict passed to call_llm / generate_sentences_report) ──
@@ -21,6 +50,13 @@ _DEFAULT_VOICE_TEMP = 0.1
 _DEFAULT_VOICE_MAX_TOKENS = 8192
 _DEFAULT_SENTENCES_TEMP = 0.3
 _DEFAULT_SENTENCES_MAX_TOKENS = 8192
+_DEFAULT_OUTPUT_MODE = "full"      # full | delta
+_DEFAULT_PREFIX_CACHE = "off"      # off | local | vertex
+_DEFAULT_PREFIX_CACHE_TTL = 3600   # seconds
+_DEFAULT_STREAM = False
+_DEFAULT_RESPONSE_CACHE = "off"    # off | memory | disk
+_DEFAULT_RESPONSE_CACHE_PATH = "llm_cache.sqlite3"
+_DEFAULT_SCHEMA_ENCODING = "names" # names | ids
 
 # ── Lazy init ──
 _model = None
@@ -84,63 +120,459 @@ GARBAGE FILTERING — CRITICAL:
 - When in doubt whether speech is about the current procedure → return report UNCHANGED
 - It is better to miss a finding (doctor can repeat) than to add incorrect data
 
+{output_format}
+Return ONLY valid JSON. No markdown, no explanation, no code fences.
+"""
+
+_FULL_OUTPUT_FORMAT = """\
 OUTPUT FORMAT — return ONLY this JSON structure:
-{{
-  "report": {{
-    "<LocationName>": {{
-      "diseases": {{
-        "<DiseaseName>": {{
+{
+  "report": {
+    "<LocationName>": {
+      "diseases": {
+        "<DiseaseName>": {
           "sublocations": ["..."],
-          "sections": {{
-            "<SectionName>": {{
-              "attrs": {{ "<AttributeName>": true }},
+          "sections": {
+            "<SectionName>": {
+              "attrs": { "<AttributeName>": true },
               "inputs": [],
-              "subsections": {{
-                "<SubsectionName>": {{
-                  "attrs": {{ "<AttributeName>": true }},
+              "subsections": {
+                "<SubsectionName>": {
+                  "attrs": { "<AttributeName>": true },
                   "inputs": []
-                }}
-              }}
-            }}
-          }},
+                }
+              }
+            }
+          },
           "comments": ""
-        }}
-      }}
-    }}
-  }},
+        }
+      }
+    }
+  },
   "overallRemarks": "..."
-}}
+}
+"""
 
-Return ONLY valid JSON. No markdown, no explanation, no code fences.
+_DELTA_OUTPUT_FORMAT = """\
+OUTPUT FORMAT — DELTA MODE. Do NOT return the whole report. Return ONLY a JSON Patch
+(RFC 6902) describing the changes to the CURRENT STATE, wrapped in this object:
+{"patch": [ {"op": "add" | "replace" | "remove", "path": "/...", "value": ...} ]}
+
+The CURRENT STATE document has this shape (paths are JSON Pointers into it):
+{
+  "report": {
+    "<LocationName>": {
+      "diseases": {
+        "<DiseaseName>": {
+          "sublocations": ["..."],
+          "sections": {
+            "<SectionName>": {
+              "attrs": { "<AttributeName>": true },
+              "inputs": [],
+              "subsections": { "<SubsectionName>": { "attrs": {}, "inputs": [] } }
+            }
+          },
+          "comments": ""
+        }
+      }
+    }
+  },
+  "overallRemarks": "..."
+}
+
+- New disease: one "add" at /report/<LocationName>/diseases/<DiseaseName> with the full entry
+- Set an attribute: "add" at .../sections/<SectionName>/attrs/<AttributeName> with value true
+- Single-select change: "remove" the old attribute and "add" the new one
+- Remove a disease: "remove" at /report/<LocationName>/diseases/<DiseaseName>
+- Overall remarks: "replace" at /overallRemarks with the full updated text
+- Escape "/" inside names as "~1" and "~" as "~0"
+- If nothing should change, return {"patch": []}
+"""
+
+_ID_ENCODING_NOTE = """
+SCHEMA IDS — the schema uses short IDs instead of names:
+- "diseases" are keyed by disease ID ("D3"); "name" gives the disease name
+- Section and subsection IDs ("S5", "U2") are named in the "sections" and "subsections" tables
+- A section or subsection is written "<list>[*][ if <condition>]": <list> names its attribute
+  list in "attribute_lists", "*" marks multi-select, the condition is as in the menu
+- Attribute N of list "b" (counting from 0) has the ID "b<N>": "b0", "b1", ...
+- Sections with subsections are {"attributes": "<list>", "subsections": {...}}
+The CURRENT STATE uses the same IDs. In your output use these IDs wherever the format says
+<DiseaseName>, <SectionName>, <SubsectionName> or <AttributeName>, and for input "rawKey".
+Locations and sublocations keep their names.
 """
 
-def _get_system_prompt(procedure_type: str = "endoscopy") -> str:
-    return _SYSTEM_PROMPT_TEMPLATE.format(procedure=procedure_type)
 
+_system_prompts: dict[tuple[str, str, str], str] = {}
+
+
+def _get_system_prompt(procedure_type: str = "endoscopy", output_mode: str = "full",
+                       encoding: str = "names") -> str:
+    key = (procedure_type, output_mode, encoding)
+    prompt = _system_prompts.get(key)
+    if prompt is None:
+        output_format = _DELTA_OUTPUT_FORMAT if output_mode == "delta" else _FULL_OUTPUT_FORMAT
+        if encoding == "ids":
+            output_format += _ID_ENCODING_NOTE
+        prompt = _system_prompts[key] = _SYSTEM_PROMPT_TEMPLATE.format(
+            procedure=procedure_type, output_format=output_format)
+    return prompt
+
+
+# ── Prompt segments ──
+# The schema part of the user prompt only changes with the schema, so it is
+# serialised once per schema_key: the full schema text, and each disease entry
+# as a '"name":{...}' fragment, so a retrieval subset is assembled by joining
+# fragments instead of re-encoding tens of kilobytes per call. The output is
+# the same text jsonfast.dumps() would produce. Only the current state, the
+# earlier-dictation context and the transcript are serialised per call. This
+# relies on cached schemas being immutable (schema_builder.freeze_schema).
+# ID-encoded segments (llm.schema_encoding: ids) keep the encoded full schema,
+# the only schema call_llm sends in IDs.
+
+_SCHEMA_HEADER = "=== SCHEMA ==="
+_SUBSET_HEADER = ("=== SCHEMA (subset: diseases relevant to this transcript "
+                  "and diseases already in the report) ===")
+_STATE_HEADER = "\n=== CURRENT REPORT STATE ==="
+_CONTEXT_HEADER = ("\n=== EARLIER DICTATION (already being applied separately — "
+                   "use only to resolve references, do NOT apply it again) ===")
+_TRANSCRIPT_HEADER = "\n=== TRANSCRIPT ==="
+_INSTRUCTION = {
+    "full": "\n=== INSTRUCTION ===\n"
+            "Update the report based on the transcript. Return the complete updated JSON.",
+    "delta": "\n=== INSTRUCTION ===\n"
+             "Update the report based on the transcript. "
+             "Return ONLY the JSON Patch against the current report state.",
+}
+_SCHEMA_KEYS = ["locations", "sublocations", "diseases"]   # build_schema() layout
+
+_SEGMENTS_CACHE_MAX = 16
+_segments_cache: OrderedDict = OrderedDict()
+
+
+class PromptSegments:
+    """Pre-serialised schema text of one schema: full, or any disease subset of it."""
+
+    def __init__(self, schema: dict, codec: SchemaCodec | None = None):
+        self.schema = schema
+        self.codec = codec
+        self.fragments: dict[str, str] = {}
+        self.head = ""
+        if codec is not None:
+            self.full = jsonfast.dumps(codec.encode_schema())
+            return
+        if list(schema) == _SCHEMA_KEYS:
+            self.head = ('{"locations":' + jsonfast.dumps(schema["locations"])
+                         + ',"sublocations":' + jsonfast.dumps(schema["sublocations"])
+                         + ',"diseases":{')
+            self.fragments = {name: jsonfast.dumps(name) + ":" + jsonfast.dumps(ddef)
+                              for name, ddef in schema["diseases"].items()}
+        self.full = jsonfast.dumps(schema)
+
+    def schema_json(self, schema: dict) -> str:
+        """JSON text of this schema, or of a select_schema() subset of it."""
+        if schema is self.schema:
+            return self.full
+        if self.codec is not None:
+            return jsonfast.dumps(self.codec.encode_schema(schema))
+        fragments = self.fragments
+        if (not self.head or list(schema) != _SCHEMA_KEYS
+                or schema["locations"] is not self.schema["locations"]
+                or schema["sublocations"] is not self.schema["sublocations"]
+                or not all(name in fragments for name in schema["diseases"])):
+            return jsonfast.dumps(schema)
+        return self.head + ",".join(fragments[name] for name in schema["diseases"]) + "}}"
+
+
+def get_prompt_segments(schema: dict, schema_key: str | None,
+                        codec: SchemaCodec | None = None) -> PromptSegments | None:
+    """Segments for a cached schema (None without a schema_key: nothing to reuse them by)."""
+    if schema_key is None or schema is None:
+        return None
+    key = (schema_key, codec is not None)
+    segments = _segments_cache.get(key)
+    if segments is not None and segments.schema is schema:
+        _segments_cache.move_to_end(key)
+        return segments
+    segments = PromptSegments(schema, codec)
+    _segments_cache[key] = segments
+    while len(_segments_cache) > _SEGMENTS_CACHE_MAX:
+        _segments_cache.popitem(last=False)
+    log.info("Prompt segments built: %d diseases, %d schema chars",
+             len(segments.fragments), len(segments.full))
+    return segments
+
+
+def _build_prompt(schema: dict, current_report: dict, overall_remarks: str, transcript: str,
+                  output_mode: str = "full", schema_is_subset: bool = False,
+                  context: str = "", segments: PromptSegments | None = None,
+                  codec: SchemaCodec | None = None) -> str:
+    """
+    Build the user prompt with schema, current state, and transcript.
 
-def _build_prompt(schema: dict, current_report: dict, overall_remarks: str, transcript: str) -> str:
-    """Build the user prompt with schema, current state, and transcript."""
+    schema=None leaves the schema out (it is already in the cached prefix).
+    With segments, the schema text comes pre-serialised. With codec, schema
+    and state are ID-encoded.
+    """
     parts = []
 
-    parts.append("=== SCHEMA ===")
-    parts.append(json.dumps(schema, separators=(",", ":"), ensure_ascii=False))
+    if schema is not None:
+        parts.append(_SUBSET_HEADER if schema_is_subset else _SCHEMA_HEADER)
+        if segments is not None:
+            parts.append(segments.schema_json(schema))
+        else:
+            parts.append(jsonfast.dumps(codec.encode_schema(schema) if codec is not None else schema))
 
-    parts.append("\n=== CURRENT REPORT STATE ===")
+    parts.append(_STATE_HEADER)
+    report = current_report or {}
     current_state = {
-        "report": current_report or {},
+        "report": codec.encode_report(report) if codec is not None else report,
         "overallRemarks": overall_remarks or "",
     }
-    parts.append(json.dumps(current_state, separators=(",", ":"), ensure_ascii=False))
+    parts.append(jsonfast.dumps(current_state))
 
-    parts.append("\n=== TRANSCRIPT ===")
-    parts.append(transcript)
+    if context:
+        parts.append(_CONTEXT_HEADER)
+        parts.append(context)
 
-    parts.append("\n=== INSTRUCTION ===")
-    parts.append("Update the report based on the transcript. Return the complete updated JSON.")
+    parts.append(_TRANSCRIPT_HEADER)
+    parts.append(transcript)
+    parts.append(_INSTRUCTION["delta" if output_mode == "delta" else "full"])
 
     return "\n".join(parts)
 
 
+# ── Prompt prefix cache ──
+# The system prompt plus the serialized full schema is identical for every call
+# that shares a schema, so with llm.prefix_cache it is registered once per
+# (schema, procedure, output mode, schema encoding, model) and reused until its TTL expires:
+#   vertex — Vertex AI context cache; the prefix is not re-sent or re-processed
+#   local  — in-memory stand-in that keeps the prefix and re-sends it, so the
+#            same code path can be exercised offline
+# Calls that send a retrieval subset of the schema (schema_retrieval.py) differ
+# in the schema part, so they use a prefix of the system prompt alone (one per
+# procedure, output mode, encoding and model) and send the subset per call.
+# Vertex rejects caches below _PREFIX_MIN_TOKENS, so smaller prefixes (the
+# system prompt alone, in practice) are not cached — by either backend, so the
+# local one behaves the same. A failed creation falls back to full prompts for
+# _PREFIX_RETRY_SECONDS.
+
+_PREFIX_RETRY_SECONDS = 300        # Back-off after a failed cache creation
+_PREFIX_REFRESH_MARGIN = 60        # Recreate this long before the TTL runs out
+_PREFIX_MIN_TOKENS = 1024          # Vertex minimum cached-content size (estimated tokens)
+
+
+@dataclass
+class PrefixHandle:
+    """A cached system prompt (+ full schema) prefix ready to be used by call_llm."""
+    key: str
+    model: GenerativeModel          # Model to call (bound to the cache for vertex)
+    contents: list = field(default_factory=list)  # Parts to prepend (local only)
+    token_count: int = 0
+    expires_at: float = 0.0
+    name: str = ""
+
+
+def _estimate_tokens(*texts: str) -> int:
+    """Rough token estimate (~4 characters per token) for logging."""
+    return sum(len(t) for t in texts) // 4
+
+
+class LocalPrefixCache:
+    """In-memory stand-in for the Vertex context cache (prefix is re-sent)."""
+
+    def create(self, key: str, system_prompt: str, schema_text: str,
+               ttl: int, llm_config: dict) -> PrefixHandle:
+        return PrefixHandle(
+            key=key,
+            model=_get_model(llm_config),
+            contents=[system_prompt, schema_text] if schema_text else [system_prompt],
+            token_count=_estimate_tokens(system_prompt, schema_text),
+            expires_at=time.monotonic() + ttl,
+            name=f"local/{key}",
+        )
+
+
+class VertexPrefixCache:
+    """Vertex AI context caching (CachedContent) for the prompt prefix."""
+
+    def create(self, key: str, system_prompt: str, schema_text: str,
+               ttl: int, llm_config: dict) -> PrefixHandle:
+        from vertexai.preview import caching
+        from vertexai.preview.generative_models import GenerativeModel as PreviewModel
+
+        _get_model(llm_config)  # Ensures vertexai.init() ran for this location
+        model_name = llm_config.get("model", _DEFAULT_LLM_MODEL)
+        cached = caching.CachedContent.create(
+            model_name=model_name,
+            system_instruction=system_prompt,
+            contents=[schema_text] if schema_text else None,
+            ttl=datetime.timedelta(seconds=ttl),
+            display_name=f"ehr-prefix-{key}"[:128],
+        )
+        usage = getattr(cached.gca_resource, "usage_metadata", None)
+        token_count = getattr(usage, "total_token_count", 0) or \
+            _estimate_tokens(system_prompt, schema_text)
+        return PrefixHandle(
+            key=key,
+            model=PreviewModel.from_cached_content(cached_content=cached),
+            token_count=token_count,
+            expires_at=time.monotonic() + ttl,
+            name=cached.resource_name,
+        )
+
+
+_PREFIX_BACKENDS = {"local": LocalPrefixCache(), "vertex": VertexPrefixCache()}
+_prefix_handles: dict[str, PrefixHandle] = {}
+_prefix_failures: dict[str, float] = {}
+_prefix_locks: dict[str, asyncio.Lock] = {}
+_prefix_too_small: set[str] = set()
+
+
+async def _get_prefix(cfg: dict, schema: dict, schema_key: str | None, procedure_type: str,
+                      output_mode: str, codec: SchemaCodec | None = None,
+                      with_schema: bool = True) -> PrefixHandle | None:
+    """
+    Return a live prefix handle, creating or refreshing it: system prompt plus
+    the full schema, or the system prompt alone (with_schema=False, for calls
+    that send a schema subset).
+    """
+    backend = _PREFIX_BACKENDS.get(cfg.get("prefix_cache", _DEFAULT_PREFIX_CACHE))
+    if backend is None or (with_schema and schema_key is None):
+        return None
+
+    model_name = cfg.get("model", _DEFAULT_LLM_MODEL)
+    encoding = "ids" if codec is not None else "names"
+    key = f"{schema_key if with_schema else 'system'}:{procedure_type}:{output_mode}:{encoding}:{model_name}"
+    now = time.monotonic()
+    handle = _prefix_handles.get(key)
+    if handle is not None and now < handle.expires_at - _PREFIX_REFRESH_MARGIN:
+        log.info("Prefix cache hit (%s): ~%d prefix tokens reused", handle.name, handle.token_count)
+        return handle
+    if key in _prefix_too_small or now < _prefix_failures.get(key, 0.0):
+        return None
+
+    lock = _prefix_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        handle = _prefix_handles.get(key)
+        if handle is not None and time.monotonic() < handle.expires_at - _PREFIX_REFRESH_MARGIN:
+            return handle
+        reason = "expired" if handle is not None else "miss"
+        system_prompt = _get_system_prompt(procedure_type, output_mode, encoding)
+        schema_text = ""
+        if with_schema:
+            schema_text = _SCHEMA_HEADER + "\n" + get_prompt_segments(schema, schema_key, codec).full
+        tokens = _estimate_tokens(system_prompt, schema_text)
+        if tokens < _PREFIX_MIN_TOKENS:
+            log.info("Prefix cache skipped (%s): ~%d tokens, below the %d-token minimum",
+                     key, tokens, _PREFIX_MIN_TOKENS)
+            _prefix_too_small.add(key)
+            return None
+        ttl = int(cfg.get("prefix_cache_ttl", _DEFAULT_PREFIX_CACHE_TTL))
+        try:
+            handle = await asyncio.to_thread(backend.create, key, system_prompt,
+                                             schema_text, ttl, cfg)
+        except Exception:
+            log.exception("Prefix cache creation failed — sending full prompts for %ds",
+                          _PREFIX_RETRY_SECONDS)
+            _prefix_failures[key] = time.monotonic() + _PREFIX_RETRY_SECONDS
+            _prefix_handles.pop(key, None)
+            return None
+        _prefix_handles[key] = handle
+        log.info("Prefix cache %s (%s): created %s, ~%d prefix tokens, ttl %ds",
+                 reason, key, handle.name, handle.token_count, ttl)
+        return handle
+
+
+# ── Response cache ──
+
+_response_cache: ResponseCache | None = None
+_response_cache_conf: tuple | None = None
+
+
+def _get_response_cache(cfg: dict) -> ResponseCache | None:
+    """The response cache for this config (None when off), re-created if its settings change."""
+    global _response_cache, _response_cache_conf
+    mode = cfg.get("response_cache", _DEFAULT_RESPONSE_CACHE)
+    if mode not in ("memory", "disk"):
+        return None
+    path = None
+    if mode == "disk":
+        path = Path(cfg.get("response_cache_path", _DEFAULT_RESPONSE_CACHE_PATH))
+        if not path.is_absolute():
+            path = PROJECT_DIR / path
+    conf = (path, cfg.get("response_cache_max_entries"), cfg.get("response_cache_ttl"),
+            cfg.get("response_cache_disk_max_entries"))
+    if _response_cache is None or conf != _response_cache_conf:
+        kwargs = {name: value for name, value in zip(
+            ("max_entries", "ttl", "disk_max_entries"), conf[1:]) if value is not None}
+        try:
+            _response_cache = ResponseCache(path=path, **kwargs)
+        except (OSError, sqlite3.Error):
+            log.exception("LLM response cache: cannot open %s — memory only", path)
+            _response_cache = ResponseCache(**kwargs)
+        _response_cache_conf = conf
+    return _response_cache
+
+
+# Prompt templates, so a stored response is not reused once they change
+_PROMPT_TEMPLATE_ID = cache_key(_SYSTEM_PROMPT_TEMPLATE, _FULL_OUTPUT_FORMAT, _DELTA_OUTPUT_FORMAT,
+                                _ID_ENCODING_NOTE)
+
+
+def _voice_cache_key(cfg: dict, schema: dict, schema_key: str | None, current_report: dict,
+                     overall_remarks: str, transcript: str, procedure_type: str,
+                     context: str) -> str:
+    """
+    Cache key of a call_llm call: its prompt parts by what they are built from.
+
+    Hashing the inputs of schema retrieval and _build_prompt rather than their
+    output lets a hit skip both — the schema stands in as its schema_key (the
+    content hash the schema cache uses) when one is given. The prefix cache
+    setting is left out: it changes how the prompt is sent, not what it says.
+    """
+    return cache_key(
+        "voice", _PROMPT_TEMPLATE_ID,
+        cfg.get("model", _DEFAULT_LLM_MODEL),
+        cfg.get("voice_temperature", _DEFAULT_VOICE_TEMP),
+        cfg.get("voice_max_tokens", _DEFAULT_VOICE_MAX_TOKENS),
+        cfg.get("output_mode", _DEFAULT_OUTPUT_MODE),
+        [cfg.get(k) for k in ("schema_top_k", "schema_min_score", "schema_full_fallback",
+                              "schema_encoding")],
+        procedure_type,
+        schema_key if schema_key is not None else schema,
+        current_report or {}, overall_remarks or "", transcript, context,
+    )
+
+
+# ── Streaming ──
+
+async def _stream_response(model, contents: list, generation_config: GenerationConfig,
+                           partial: StreamedResult, on_partial) -> str:
+    """Generate with streaming; return the full text, reporting provisional states on the way."""
+    responses = await model.generate_content_async(
+        contents,
+        generation_config=generation_config,
+        stream=True,
+    )
+    chunks = []
+    async for response in responses:
+        try:
+            text = response.text
+        except ValueError:
+            continue  # Chunk without text parts (e.g. the final usage-only chunk)
+        if not text:
+            continue
+        chunks.append(text)
+        doc = partial.feed(text)
+        if doc is not None and on_partial is not None:
+            try:
+                await on_partial(doc)
+            except Exception:
+                log.exception("Provisional update failed")
+    return "".join(chunks)
+
+
 async def call_llm(
     schema: dict,
     current_report: dict,
@@ -148,57 +580,106 @@ async def call_llm(
     transcript: str,
     procedure_type: str = "endoscopy",
     llm_config: dict | None = None,
+    schema_key: str | None = None,
+    context: str = "",
+    trace=None,
+    on_partial=None,
 ) -> dict | None:
     """
     Call Gemini to update EHR report from transcript.
 
+    Only the diseases relevant to the transcript are sent (see
+    schema_retrieval.py); schema_key lets the retrieval index and the cached
+    prompt prefix be reused across calls that share a schema.
+
+    trace (metrics.Trace), if given, gets the "prompt" and "llm" stages.
+
+    With llm.stream, on_partial (async, called with a provisional
+    {report, overallRemarks}) is awaited each time the streamed response
+    completes another disease entry or patch operation. The document is
+    reused between calls — copy anything kept beyond the call.
+
     Returns:
-        dict with {"report": {...}, "overallRemarks": "..."} or None on failure.
+        dict with {"report": {...}, "overallRemarks": "..."}, or in delta mode
+        {"patch": [...]} to be applied to the current state, or None on failure.
+        A result from the response cache is shared — treat it as read-only.
     """
     cfg = llm_config or {}
-    model = _get_model(llm_config)
-
-    system_prompt = _get_system_prompt(procedure_type)
-    user_prompt = _build_prompt(schema, current_report, overall_remarks, transcript)
+    output_mode = cfg.get("output_mode", _DEFAULT_OUTPUT_MODE)
+    temperature = cfg.get("voice_temperature", _DEFAULT_VOICE_TEMP)
+    max_tokens = cfg.get("voice_max_tokens", _DEFAULT_VOICE_MAX_TOKENS)
+    encoding = cfg.get("schema_encoding", _DEFAULT_SCHEMA_ENCODING)
+    codec = get_codec(schema, schema_key) if encoding == "ids" and schema else None
+
+    cache = _get_response_cache(cfg)
+    if cache is not None:
+        cache_id = _voice_cache_key(cfg, schema, schema_key, current_report, overall_remarks,
+                                    transcript, procedure_type, context)
+        cached = await cache.get(cache_id, "voice")
+        if cached is not None:
+            log.info("LLM cache hit: transcript=%r", transcript[:80])
+            if trace is not None:
+                trace.mark("prompt")
+                trace.mark("llm")
+            return cached
+
+    model = _get_model(llm_config)  # After the cache: hits need no Vertex init or credentials
+    prompt_schema, is_subset = select_schema(schema, f"{context} {transcript}", current_report,
+                                             llm_config=cfg, schema_key=schema_key)
+    if is_subset:
+        codec = None  # IDs only pay off on the full schema; a subset's IDs cost more tokens than its names
+    prefix = await _get_prefix(cfg, schema, schema_key, procedure_type, output_mode, codec,
+                               with_schema=not is_subset)
+    segments = get_prompt_segments(schema, schema_key, codec)
+
+    if prefix is not None:
+        model = prefix.model
+        user_prompt = _build_prompt(prompt_schema if is_subset else None, current_report,
+                                    overall_remarks, transcript, output_mode=output_mode,
+                                    schema_is_subset=is_subset, context=context,
+                                    segments=segments, codec=codec)
+        contents = prefix.contents + [user_prompt]
+    else:
+        system_prompt = _get_system_prompt(procedure_type, output_mode,
+                                           "ids" if codec is not None else "names")
+        user_prompt = _build_prompt(prompt_schema, current_report, overall_remarks, transcript,
+                                    output_mode=output_mode, schema_is_subset=is_subset,
+                                    context=context, segments=segments, codec=codec)
+        contents = [system_prompt, user_prompt]
 
     generation_config = GenerationConfig(
-        temperature=cfg.get("voice_temperature", _DEFAULT_VOICE_TEMP),
-        max_output_tokens=cfg.get("voice_max_tokens", _DEFAULT_VOICE_MAX_TOKENS),
+        temperature=temperature,
+        max_output_tokens=max_tokens,
         response_mime_type="application/json",
     )
 
     log.info("LLM call: transcript=%r (%d chars)", transcript[:80], len(transcript))
+    if trace is not None:
+        trace.mark("prompt")
 
     try:
-        response = await model.generate_content_async(
-            [system_prompt, user_prompt],
-            generation_config=generation_config,
-        )
-
-        if not response.text:
+        if cfg.get("stream", _DEFAULT_STREAM):
+            partial = StreamedResult(current_report, overall_remarks, output_mode, codec=codec)
+            text = await _stream_response(model, contents, generation_config, partial, on_partial)
+            log.info("LLM stream: %d provisional updates", partial.updates)
+        else:
+            response = await model.generate_content_async(
+                contents,
+                generation_config=generation_config,
+            )
+            text = response.text
+        if trace is not None:
+            trace.mark("llm")
+
+        if not text:
             log.warning("LLM returned empty response")
             return None
 
-        result = json.loads(response.text)
-
-        if not isinstance(result, dict):
-            log.warning("LLM returned non-dict: %s", type(result))
-            return None
-
-        # Ensure expected keys exist
-        if "report" not in result:
-            # Maybe LLM returned report at top level — check for known location names
-            valid_locs = set(schema.get("locations", []))
-            if any(k in result for k in valid_locs):
-                result = {"report": result, "overallRemarks": overall_remarks or ""}
-            else:
-                log.warning("LLM response missing 'report' key")
-                return None
-
-        if "overallRemarks" not in result:
-            result["overallRemarks"] = overall_remarks or ""
-
-        log.info("LLM response: %d locations", len(result.get("report", {})))
+        result = _parse_response(jsonfast.loads(text), schema, overall_remarks, output_mode)
+        if result is not None and codec is not None:
+            result = codec.decode_result(result)
+        if result is not None and cache is not None:
+            await cache.put(cache_id, "voice", result)
         return result
 
     except json.JSONDecodeError as e:
@@ -209,6 +690,37 @@ async def call_llm(
         raise
 
 
+def _parse_response(result, schema: dict, overall_remarks: str, output_mode: str) -> dict | None:
+    """Normalise a decoded voice response to {report, overallRemarks} / {patch}, or None."""
+    if output_mode == "delta":
+        # A bare op list is accepted as the patch; a full report falls through
+        if isinstance(result, list):
+            result = {"patch": result}
+        if isinstance(result, dict) and isinstance(result.get("patch"), list):
+            log.info("LLM response: %d patch ops", len(result["patch"]))
+            return {"patch": result["patch"]}
+
+    if not isinstance(result, dict):
+        log.warning("LLM returned non-dict: %s", type(result))
+        return None
+
+    # Ensure expected keys exist
+    if "report" not in result:
+        # Maybe LLM returned report at top level — check for known location names
+        valid_locs = set(schema.get("locations", []))
+        if any(k in result for k in valid_locs):
+            result = {"report": result, "overallRemarks": overall_remarks or ""}
+        else:
+            log.warning("LLM response missing 'report' key")
+            return None
+
+    if "overallRemarks" not in result:
+        result["overallRemarks"] = overall_remarks or ""
+
+    log.info("LLM response: %d locations", len(result.get("report", {})))
+    return result
+
+
 # ── Sentences Report ──
 
 SENTENCES_REPORT_PROMPT = """\
@@ -237,43 +749,96 @@ FORMAT your output as HTML:
 """
 
 
-async def generate_sentences_report(report_json: dict,
-                                    llm_config: dict | None = None) -> str | None:
-    """
-    Call Gemini to convert structured EHR JSON into natural language sentences.
+SENTENCES_POLISH_PROMPT = """\
+You are an expert endoscopy/colonoscopy report writer. You will receive a draft \
+report in HTML, generated mechanically from a hospital's EHR system.
 
-    Args:
-        report_json: The report data (report, overallRemarks, optionally __retroMeta)
-        llm_config: Optional LLM configuration dict from config.yaml
+Rewrite its sentences into the crisp, natural phrasing of an endoscopy or colonoscopy \
+report, using words which doctors typically use such as "suspected", "noted", "seen", \
+"revealed", "appeared", "suggestive of", etc.
 
-    Returns:
-        HTML string with formatted sentences report, or None on failure.
-    """
-    cfg = llm_config or {}
-    model = _get_model(llm_config)
+RULES:
+- Keep every finding, location, sublocation, measurement and remark. Do NOT add, drop \
+or change any clinical fact.
+- Keep the structure: the same <h2> locations and <h3> findings, in the same order, \
+with <p> sentences below each.
+- Do NOT use bullet points. Use sentences only.
+- Use <strong> for emphasis on key findings and <em> for qualifiers like "suspected", "possible".
+- Do NOT wrap in ```html code fences. Return raw HTML only.
+"""
 
-    user_prompt = json.dumps(report_json, indent=2, ensure_ascii=False)
 
+async def _sentences_call(system_prompt: str, user_prompt: str, llm_config: dict | None,
+                          label: str) -> str | None:
+    """One sentences-report model call (report or polish), through the response cache."""
+    cfg = llm_config or {}
+    temperature = cfg.get("sentences_temperature", _DEFAULT_SENTENCES_TEMP)
+    max_tokens = cfg.get("sentences_max_tokens", _DEFAULT_SENTENCES_MAX_TOKENS)
+
+    cache = _get_response_cache(cfg)
+    if cache is not None:
+        cache_id = cache_key("sentences", cfg.get("model", _DEFAULT_LLM_MODEL), temperature,
+                             max_tokens, system_prompt, user_prompt)
+        cached = await cache.get(cache_id, "sentences")
+        if cached is not None:
+            log.info("%s cache hit: %d chars", label, len(cached))
+            return cached
+
+    model = _get_model(llm_config)
     generation_config = GenerationConfig(
-        temperature=cfg.get("sentences_temperature", _DEFAULT_SENTENCES_TEMP),
-        max_output_tokens=cfg.get("sentences_max_tokens", _DEFAULT_SENTENCES_MAX_TOKENS),
+        temperature=temperature,
+        max_output_tokens=max_tokens,
     )
 
-    log.info("Sentences report LLM call: %d chars input", len(user_prompt))
+    log.info("%s LLM call: %d chars input", label, len(user_prompt))
 
     try:
         response = await model.generate_content_async(
-            [SENTENCES_REPORT_PROMPT, user_prompt],
+            [system_prompt, user_prompt],
             generation_config=generation_config,
         )
 
         if not response.text:
-            log.warning("Sentences report: LLM returned empty response")
+            log.warning("%s: LLM returned empty response", label)
             return None
 
-        log.info("Sentences report generated: %d chars", len(response.text))
+        log.info("%s generated: %d chars", label, len(response.text))
+        if cache is not None:
+            await cache.put(cache_id, "sentences", response.text)
         return response.text
 
     except Exception:
-        log.exception("Sentences report LLM call failed")
+        log.exception("%s LLM call failed", label)
         raise
+
+
+async def generate_sentences_report(report_json: dict,
+                                    llm_config: dict | None = None) -> str | None:
+    """
+    Call Gemini to convert structured EHR JSON into natural language sentences.
+
+    Args:
+        report_json: The report data (report, overallRemarks, optionally __retroMeta)
+        llm_config: Optional LLM configuration dict from config.yaml
+
+    Returns:
+        HTML string with formatted sentences report, or None on failure.
+    """
+    user_prompt = json.dumps(report_json, indent=2, ensure_ascii=False)
+    return await _sentences_call(SENTENCES_REPORT_PROMPT, user_prompt, llm_config,
+                                 "Sentences report")
+
+
+async def polish_sentences_report(draft_html: str,
+                                  llm_config: dict | None = None) -> str | None:
+    """
+    Call Gemini to rephrase a locally rendered sentences report (report_renderer).
+
+    The draft already holds every fact, so the prompt is the short HTML rather
+    than the report JSON; the model only improves the wording.
+
+    Returns:
+        Polished HTML string, or None on failure.
+    """
+    return await _sentences_call(SENTENCES_POLISH_PROMPT, draft_html, llm_config,
+                                 "Sentences polish")
@@ -0,0 +1,119 @@
+"""
+Fake LLM — Offline stand-in for llm_caller.call_llm (llm.backend: fake).
+
+Same signature and result shapes as the Gemini caller, with a configurable
+latency distribution instead of a network call, so the voice pipeline can be
+load-tested and profiled without credentials. The "update" is deterministic
+and cheap but touches the report like a real one would:
+- the first disease named in the transcript is added (at its first allowed
+  location) if it is not in the report yet
+- the transcript is appended to overallRemarks, so every call changes state
+
+Latency is log-normal, set by its median and 95th percentile (llm.fake).
+With llm.stream the response text is released in small chunks, the first
+after a quarter of the latency, through the same StreamedResult as the
+Gemini caller, so provisional updates can be exercised offline.
+"""
+
+import asyncio
+import copy
+import json
+import logging
+import math
+import random
+
+from json_patch import make_patch
+from json_stream import StreamedResult
+
+log = logging.getLogger("ehr-voice")
+
+# ── Defaults (overridden by llm.fake config) ──
+_DEFAULT_LATENCY_MEDIAN_MS = 900
+_DEFAULT_LATENCY_P95_MS = 2500
+_DEFAULT_ERROR_RATE = 0.0
+
+_STREAM_CHUNK_CHARS = 40          # Characters per streamed chunk
+_STREAM_FIRST_FRACTION = 0.25     # Share of the latency before the first chunk
+
+_Z95 = 1.645                      # Standard normal 95th percentile
+
+_rng = random.Random()
+
+
+def sample_latency(median_ms: float, p95_ms: float, rng: random.Random = _rng) -> float:
+    """Seconds drawn from a log-normal with the given median and p95."""
+    if median_ms <= 0:
+        return 0.0
+    sigma = math.log(max(p95_ms, median_ms) / median_ms) / _Z95
+    return rng.lognormvariate(math.log(median_ms), sigma) / 1000.0
+
+
+def _named_disease(schema: dict, text: str) -> str | None:
+    """Longest schema disease name that occurs in the text."""
+    lowered = text.lower()
+    names = [d for d in schema.get("diseases", {}) if d.lower() in lowered]
+    return max(names, key=len) if names else None
+
+
+async def call_llm(
+    schema: dict,
+    current_report: dict,
+    overall_remarks: str,
+    transcript: str,
+    procedure_type: str = "endoscopy",
+    llm_config: dict | None = None,
+    schema_key: str | None = None,
+    context: str = "",
+    trace=None,
+    on_partial=None,
+) -> dict | None:
+    """Fake of llm_caller.call_llm: sleep for a sampled latency, return a small update."""
+    cfg = llm_config or {}
+    fcfg = cfg.get("fake") or {}
+    delay = sample_latency(fcfg.get("latency_median_ms", _DEFAULT_LATENCY_MEDIAN_MS),
+                           fcfg.get("latency_p95_ms", _DEFAULT_LATENCY_P95_MS))
+    report = copy.deepcopy(current_report or {})
+    dname = _named_disease(schema, transcript)
+    if dname:
+        locs = schema["diseases"][dname].get("locations", [])
+        if locs and not any(dname in (report.get(l) or {}).get("diseases", {}) for l in locs):
+            loc = report.setdefault(locs[0], {"diseases": {}})
+            loc.setdefault("diseases", {})[dname] = {"sublocations": [], "sections": {}, "comments": ""}
+    remarks = f"{overall_remarks} {transcript}".strip() if overall_remarks else transcript
+    result = {"report": report, "overallRemarks": remarks}
+    if cfg.get("output_mode") == "delta":
+        base = {"report": current_report or {}, "overallRemarks": overall_remarks or ""}
+        result = {"patch": make_patch(base, result)}
+
+    if trace is not None:
+        trace.mark("prompt")
+    if cfg.get("stream"):
+        await _stream(json.dumps(result, ensure_ascii=False), delay,
+                      StreamedResult(current_report, overall_remarks, cfg.get("output_mode", "full")),
+                      on_partial)
+    else:
+        await asyncio.sleep(delay)
+    if trace is not None:
+        trace.mark("llm")
+    if _rng.random() < fcfg.get("error_rate", _DEFAULT_ERROR_RATE):
+        raise RuntimeError("fake LLM error")
+
+    log.info("Fake LLM: %.0f ms, transcript=%r", delay * 1000, transcript[:80])
+    return result
+
+
+async def _stream(text: str, delay: float, partial: StreamedResult, on_partial):
+    """Release text in chunks over delay seconds, reporting provisional states."""
+    pieces = [text[i:i + _STREAM_CHUNK_CHARS] for i in range(0, len(text), _STREAM_CHUNK_CHARS)]
+    first = delay * _STREAM_FIRST_FRACTION
+    step = (delay - first) / max(1, len(pieces) - 1)
+    await asyncio.sleep(first)
+    for i, piece in enumerate(pieces):
+        if i:
+            await asyncio.sleep(step)
+        doc = partial.feed(piece)
+        if doc is not None and on_partial is not None:
+            try:
+                await on_partial(doc)
+            except Exception:
+                log.exception("Provisional update failed")
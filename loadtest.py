@@ -0,0 +1,397 @@
+"""
+Load test — N concurrent /ws/voice sessions against one server process.
+
+By default a server is started as a subprocess with a temporary config
+(EHR_CONFIG) that switches to the offline backends: the replay ASR
+(asr.backend: replay, driven by the audio each session streams) and the fake
+LLM (llm.backend: fake, log-normal latency). Nothing needs network access.
+
+Each session does what the browser does: fetches the CSV from /api/csv, sends
+init with csv_hash (csv_text on schema_miss), streams 100 ms PCM frames in
+real time (silence, or a mono 16-bit WAV), then sends stop and waits for the
+server to close. Measured:
+- latency from each final_transcript to the next report_update/report_patch
+  (the update that contains it), p50/p95/p99; with --stream also to the
+  first update that shows anything of it (provisional updates count)
+- messages and bytes per type, per second
+- server CPU and RSS (from /proc, sampled) when the server is local, and
+  the mean time per pipeline stage from the server's /metrics
+
+Usage:
+    python loadtest.py --sessions 20 --duration 60
+    python loadtest.py --sessions 50 --llm-median-ms 1200 --llm-p95-ms 4000 --out run.json
+    python loadtest.py --sessions 20 --stream   # Streamed LLM responses (llm.stream)
+    python loadtest.py --url ws://localhost:8000 --sessions 5   # Existing server (its own config)
+
+Results go to a JSON file (--out) to compare across commits.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import wave
+from collections import Counter
+from pathlib import Path
+
+import websockets
+import yaml
+
+from schema_builder import content_hash
+
+PROJECT_DIR = Path(__file__).parent
+
+_SAMPLE_RATE = 16000
+_FRAME_MS = 100
+_UPDATE_TYPES = ("report_update", "report_patch")
+
+
+# ── Server process ──
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _write_config(args) -> Path:
+    """config.yaml with the offline backends switched on, in a temporary file."""
+    cfg = yaml.safe_load((PROJECT_DIR / "config.yaml").read_text(encoding="utf-8")) or {}
+    asr = cfg.setdefault("asr", {})
+    asr["backend"] = "replay"
+    asr["replay"] = {"script": str(Path(args.script).resolve()), "loop": True}
+    llm = cfg.setdefault("llm", {})
+    llm["backend"] = "fake"
+    llm["fake"] = {"latency_median_ms": args.llm_median_ms, "latency_p95_ms": args.llm_p95_ms,
+                   "error_rate": args.llm_error_rate}
+    llm["stream"] = args.stream
+    fd, path = tempfile.mkstemp(prefix="ehr-loadtest-", suffix=".yaml")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        yaml.safe_dump(cfg, f)
+    return Path(path)
+
+
+def _start_server(port: int, config_path: Path, log_path: str | None) -> subprocess.Popen:
+    env = dict(os.environ, EHR_CONFIG=str(config_path))
+    log_file = open(log_path, "w", encoding="utf-8") if log_path else subprocess.DEVNULL
+    proc = subprocess.Popen(
+        [sys.executable, str(PROJECT_DIR / "server.py"), "--host", "127.0.0.1",
+         "--port", str(port), "--ssl-cert", ""],
+        env=env, stdout=log_file, stderr=log_file,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/config", timeout=1).read()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("server did not start within 30 s")
+
+
+class _ProcSampler:
+    """Samples a process's CPU % and RSS from /proc while the test runs."""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.cpu: list[float] = []
+        self.rss_mb: list[float] = []
+        self._ticks = os.sysconf("SC_CLK_TCK")
+
+    def _cpu_seconds(self) -> float:
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self._ticks   # utime + stime
+
+    def _rss(self) -> float:
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+        return 0.0
+
+    async def run(self):
+        try:
+            last_cpu, last_t = self._cpu_seconds(), time.monotonic()
+            while True:
+                await asyncio.sleep(self.interval)
+                cpu, t = self._cpu_seconds(), time.monotonic()
+                self.cpu.append(100.0 * (cpu - last_cpu) / (t - last_t))
+                self.rss_mb.append(self._rss())
+                last_cpu, last_t = cpu, t
+        except (OSError, IndexError, ValueError):
+            pass   # Process gone or /proc unavailable
+
+    def summary(self) -> dict:
+        if not self.cpu:
+            return {}
+        return {
+            "cpu_percent_mean": round(statistics.fmean(self.cpu), 1),
+            "cpu_percent_peak": round(max(self.cpu), 1),
+            "rss_mb_start": round(self.rss_mb[0], 1),
+            "rss_mb_peak": round(max(self.rss_mb), 1),
+            "rss_mb_end": round(self.rss_mb[-1], 1),
+        }
+
+
+# ── Sessions ──
+
+class _SessionStats:
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.first_latencies: list[float] = []   # To the first update, provisional or final
+        self.recv = Counter()
+        self.recv_bytes = Counter()
+        self.sent_frames = 0
+        self.sent_bytes = 0
+        self.connect_ms: float | None = None
+        self.errors: list[str] = []
+
+
+def _frames(wav_pcm: bytes | None, duration: float):
+    """100 ms PCM frames for `duration` seconds (the WAV looped, or silence)."""
+    frame_bytes = _SAMPLE_RATE * 2 * _FRAME_MS // 1000
+    silence = bytes(frame_bytes)
+    for i in range(int(duration * 1000 / _FRAME_MS)):
+        if wav_pcm:
+            start = (i * frame_bytes) % max(frame_bytes, len(wav_pcm) - frame_bytes)
+            yield wav_pcm[start:start + frame_bytes]
+        else:
+            yield silence
+
+
+async def _run_session(idx: int, args, ws_url: str, csv_text: str, wav_pcm: bytes | None,
+                       stats: _SessionStats):
+    await asyncio.sleep(args.ramp * idx / max(1, args.sessions))
+    init = {"type": "init", "procedure_type": args.procedure, "report": {},
+            "overallRemarks": "", "patch_sync": True, "csv_hash": content_hash(csv_text)}
+    pending: list[float] = []            # Send times of finals not yet in an update
+    unseen: list[float] = []             # ... and not yet in a provisional update either
+    stopped = False
+
+    t0 = time.perf_counter()
+    try:
+        async with websockets.connect(f"{ws_url}/ws/voice", max_size=None) as ws:
+            await ws.send(json.dumps(init))
+            stats.connect_ms = (time.perf_counter() - t0) * 1000
+
+            ready = asyncio.Event()
+
+            async def receive():
+                try:
+                    async for raw in ws:
+                        now = time.perf_counter()
+                        msg = json.loads(raw)
+                        kind = msg.get("type", "?")
+                        stats.recv[kind] += 1
+                        stats.recv_bytes[kind] += len(raw)
+                        if kind == "schema_miss":
+                            await ws.send(json.dumps(dict(init, csv_text=csv_text)))
+                        elif kind == "status" and msg.get("asr") == "active":
+                            ready.set()
+                        elif kind == "final_transcript":
+                            pending.append(now)
+                            unseen.append(now)
+                        elif kind in _UPDATE_TYPES and pending:
+                            stats.first_latencies.extend(now - t for t in unseen)
+                            unseen.clear()
+                            if not msg.get("provisional"):
+                                stats.latencies.extend(now - t for t in pending)
+                                pending.clear()
+                        elif kind == "error":
+                            stats.errors.append(msg.get("message", ""))
+                except websockets.ConnectionClosedError as e:
+                    if not stopped:            # The server drops the socket after stop
+                        stats.errors.append(f"{type(e).__name__}: {e}")
+                finally:
+                    ready.set()
+
+            receiver = asyncio.create_task(receive())
+            await ready.wait()                  # Like the browser: audio starts once ASR is up
+            start = time.perf_counter()
+            for n, frame in enumerate(_frames(wav_pcm, args.duration)):
+                await ws.send(frame)
+                stats.sent_frames += 1
+                stats.sent_bytes += len(frame)
+                delay = start + (n + 1) * _FRAME_MS / 1000 / args.audio_speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            stopped = True
+            await ws.send(json.dumps({"type": "stop"}))
+            try:
+                await asyncio.wait_for(receiver, timeout=args.drain_timeout)
+            except asyncio.TimeoutError:
+                receiver.cancel()
+    except (OSError, websockets.WebSocketException) as e:
+        stats.errors.append(f"{type(e).__name__}: {e}")
+
+
+# ── Report ──
+
+def _percentiles(values: list[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    ms = sorted(v * 1000 for v in values)
+
+    def pct(p):
+        return round(ms[min(len(ms) - 1, int(round(p / 100 * (len(ms) - 1))))], 1)
+
+    return {"count": len(ms), "p50": pct(50), "p95": pct(95), "p99": pct(99),
+            "mean": round(statistics.fmean(ms), 1), "max": round(ms[-1], 1)}
+
+
+def _stage_means(http_url: str) -> dict:
+    """Mean milliseconds per pipeline stage, from the server's /metrics histograms."""
+    try:
+        text = urllib.request.urlopen(f"{http_url}/metrics", timeout=5).read().decode("utf-8")
+    except OSError:
+        return {}
+    sums, counts = {}, {}
+    for line in text.splitlines():
+        for suffix, target in (("_sum", sums), ("_count", counts)):
+            prefix = f"ehr_voice_stage_seconds{suffix}{{stage=\""
+            if line.startswith(prefix):
+                stage, value = line[len(prefix):].split("\"} ")
+                target[stage] = float(value)
+    return {k: round(1000 * sums[k] / counts[k], 1) for k in sums if counts.get(k)}
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _summarize(args, sessions: list[_SessionStats], wall: float, server: dict) -> dict:
+    recv, recv_bytes = Counter(), Counter()
+    for s in sessions:
+        recv.update(s.recv)
+        recv_bytes.update(s.recv_bytes)
+    latencies = [v for s in sessions for v in s.latencies]
+    errors = [e for s in sessions for e in s.errors]
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "params": {k: v for k, v in vars(args).items() if k != "out"},
+        "wall_seconds": round(wall, 2),
+        "final_to_update_ms": _percentiles(latencies),
+        "final_to_first_update_ms": _percentiles([v for s in sessions for v in s.first_latencies]),
+        "connect_ms": _percentiles([s.connect_ms / 1000 for s in sessions if s.connect_ms is not None]),
+        "messages_received": dict(recv),
+        "messages_per_second": round(sum(recv.values()) / wall, 1),
+        "bytes_received": dict(recv_bytes),
+        "audio_frames_sent": sum(s.sent_frames for s in sessions),
+        "audio_bytes_per_second": round(sum(s.sent_bytes for s in sessions) / wall),
+        "sessions_with_errors": sum(1 for s in sessions if s.errors),
+        "errors": sorted(Counter(errors).items(), key=lambda kv: -kv[1])[:10],
+        "server": server,
+    }
+
+
+async def _main(args) -> dict:
+    proc = config_path = None
+    ws_url = args.url
+    if ws_url is None:
+        port = _free_port()
+        config_path = _write_config(args)
+        proc = _start_server(port, config_path, args.server_log)
+        ws_url = f"ws://127.0.0.1:{port}"
+    http_url = ws_url.replace("ws://", "http://", 1).replace("wss://", "https://", 1)
+
+    sampler_task = sampler = None
+    try:
+        csv_text = urllib.request.urlopen(f"{http_url}/api/csv", timeout=10).read().decode("utf-8")
+        wav_pcm = None
+        if args.wav:
+            with wave.open(args.wav, "rb") as w:
+                if w.getnchannels() != 1 or w.getsampwidth() != 2 or w.getframerate() != _SAMPLE_RATE:
+                    raise SystemExit(f"{args.wav}: expected mono 16-bit {_SAMPLE_RATE} Hz PCM")
+                wav_pcm = w.readframes(w.getnframes())
+
+        if proc is not None:
+            sampler = _ProcSampler(proc.pid)
+            sampler_task = asyncio.create_task(sampler.run())
+
+        sessions = [_SessionStats() for _ in range(args.sessions)]
+        t0 = time.perf_counter()
+        await asyncio.gather(*(_run_session(i, args, ws_url, csv_text, wav_pcm, s)
+                               for i, s in enumerate(sessions)))
+        wall = time.perf_counter() - t0
+        stages = _stage_means(http_url)
+    finally:
+        if sampler_task is not None:
+            sampler_task.cancel()
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if config_path is not None:
+            config_path.unlink(missing_ok=True)
+
+    server = sampler.summary() if sampler else {}
+    server["stage_mean_ms"] = stages
+    return _summarize(args, sessions, wall, server)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=10, help="Concurrent sessions")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of audio per session")
+    parser.add_argument("--ramp", type=float, default=2.0, help="Seconds over which sessions start")
+    parser.add_argument("--audio-speed", type=float, default=1.0,
+                        help="Audio send rate relative to real time")
+    parser.add_argument("--procedure", default="endoscopy")
+    parser.add_argument("--script", default=str(PROJECT_DIR / "replay_sample.jsonl"),
+                        help="Replay ASR transcript script (local server only)")
+    parser.add_argument("--wav", help="Mono 16-bit 16 kHz WAV streamed as session audio (default: silence)")
+    parser.add_argument("--llm-median-ms", type=float, default=900)
+    parser.add_argument("--llm-p95-ms", type=float, default=2500)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream LLM responses (provisional updates as findings complete)")
+    parser.add_argument("--drain-timeout", type=float, default=20.0,
+                        help="Seconds to wait for final updates after stop")
+    parser.add_argument("--server-log", help="Write the local server's log to this file")
+    parser.add_argument("--url", help="ws:// URL of a running server instead of starting one")
+    parser.add_argument("--out", default="loadtest_results.json")
+    args = parser.parse_args()
+
+    result = asyncio.run(_main(args))
+    Path(args.out).write_text(json.dumps(result, indent=2), encoding="utf-8")
+
+    lat = result["final_to_update_ms"]
+    print(f"{args.sessions} sessions, {result['wall_seconds']} s")
+    if lat["count"]:
+        print(f"final → update: p50 {lat['p50']} ms, p95 {lat['p95']} ms, "
+              f"p99 {lat['p99']} ms (n={lat['count']})")
+    first = result["final_to_first_update_ms"]
+    if args.stream and first["count"]:
+        print(f"final → first update: p50 {first['p50']} ms, p95 {first['p95']} ms, "
+              f"p99 {first['p99']} ms (n={first['count']})")
+    print(f"messages/s: {result['messages_per_second']}, "
+          f"sessions with errors: {result['sessions_with_errors']}")
+    if result["server"]:
+        srv = result["server"]
+        print(f"server CPU mean {srv['cpu_percent_mean']}% (peak {srv['cpu_percent_peak']}%), "
+              f"RSS peak {srv['rss_mb_peak']} MB")
+    print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Metrics — In-process counters, gauges and histograms in Prometheus text format.
+
+No client library: the few metric types the voice server needs are kept in a
+module-level registry (REGISTRY) and rendered by server.py's /metrics
+endpoint. Updates happen on the event loop or take the metric's lock, so
+ASR threads may update them too.
+
+Trace follows one batch of dictation from the ASR final to the report update
+sent to the client, recording how long each stage took:
+
+    asr       speech end → final result (when the ASR reports speech end)
+    queue     final result posted by the ASR thread → seen by the batcher
+    batch     batcher → dispatch (debounce, waiting for an LLM slot)
+    prompt    schema selection + prompt building
+    llm       model call (includes response parsing)
+    validate  patch application + compiled schema validation
+    order     waiting for earlier in-flight batches to be applied first
+    fast_path local resolution (instead of prompt/llm/validate)
+    apply     rebase + merge into the session report
+    send      serialising and sending the update
+"""
+
+import math
+import threading
+import time
+
+# Latency buckets (seconds), from sub-millisecond local stages to slow LLM calls
+_DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                    1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(v: float) -> str:
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+def _escape_label(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_str(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape_label(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: dict = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key: tuple, value) -> list[str]:
+        return [f"{self.name}{_label_str(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        super().__init__(name, help_text, labelnames)
+        if not self.labelnames:
+            self._values[()] = 0.0  # Exported as 0 before the first increment
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        super().__init__(name, help_text, labelnames)
+        if not self.labelnames:
+            self._values[()] = 0.0
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (),
+                 buckets: tuple = _DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            counts = entry[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            entry[1] += 1
+            entry[2] += value
+
+    def _render_sample(self, key: tuple, value) -> list[str]:
+        counts, total, sum_ = value
+        lines, cumulative = [], 0
+        for bound, c in zip(self.buckets, counts):
+            cumulative += c
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_label_str(self.labelnames, key, le)} {cumulative}")
+        inf = 'le="+Inf"'
+        lines.append(f"{self.name}_bucket{_label_str(self.labelnames, key, inf)} {total}")
+        lines.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {_format_value(sum_)}")
+        lines.append(f"{self.name}_count{_label_str(self.labelnames, key)} {total}")
+        return lines
+
+
+class Registry:
+    """Named metrics, rendered together in registration order."""
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing  # Module reloads reuse the same series
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple = (),
+                  buckets: tuple = _DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# ── Per-batch trace ──
+
+class Trace:
+    """Stage durations of one batch, measured between consecutive marks."""
+
+    def __init__(self, origin: float | None = None):
+        self.origin = time.monotonic() if origin is None else origin
+        self._last = self.origin
+        self.stages: dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float):
+        """Record a duration measured elsewhere (does not move the mark)."""
+        self.stages[stage] = self.stages.get(stage, 0.0) + max(0.0, seconds)
+
+    def mark(self, stage: str, at: float | None = None):
+        """Attribute the time since the previous mark to stage."""
+        now = time.monotonic() if at is None else at
+        self.add(stage, now - self._last)
+        self._last = max(self._last, now)
+
+    def total(self) -> float:
+        """Seconds from origin (the batch's last ASR final) to the latest mark."""
+        return max(0.0, self._last - self.origin)
+
+    def compact(self) -> dict:
+        """Whole-millisecond breakdown for the client, plus the running total."""
+        out = {stage: round(s * 1000) for stage, s in self.stages.items()}
+        out["total"] = round(self.total() * 1000)
+        return out
+
+    def observe(self, histogram: Histogram):
+        for stage, seconds in self.stages.items():
+            histogram.observe(seconds, stage=stage)
+        histogram.observe(self.total(), stage="total")
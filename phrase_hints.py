@@ -0,0 +1,142 @@
+"""
+Phrase Hints — ASR vocabulary derived from the EHR schema.
+
+Hints come from two sources:
+- the built schema (disease names, section names, attribute values,
+  locations and sublocations), so they track the CSV menu automatically
+- hand-maintained static files per procedure (asr.phrase_files, default
+  endoscopy → endoscopy_phraseset.txt), each read once
+
+They are merged, ranked and capped at max_phrases per procedure/schema, and
+cached per schema_key so every session on the same menu shares one list (and
+the ASR bridge's phrase-set protos, which are cached by that list's key).
+
+Ranking: disease names first, then curated static phrases, then terms shared
+by many diseases (they recur in dictation), then the rest. A static file's
+phrases are kept in full for its own procedure; for other procedures only
+phrases whose words all occur in that procedure's schema survive, so
+colonoscopy sessions do not carry endoscopy-only vocabulary.
+"""
+
+import logging
+import re
+from collections import OrderedDict, defaultdict
+from pathlib import Path
+
+log = logging.getLogger("ehr-voice")
+
+_DEFAULT_MAX_PHRASES = 1200
+
+# Source weights for ranking
+_WEIGHTS = {"disease": 10.0, "static": 6.0, "section": 3.0, "location": 3.0,
+            "attribute": 2.0, "sublocation": 2.0}
+
+_BOX_RE = re.compile(r"\b(int|float|alphanum)_box\b")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+_HINTS_CACHE_MAX = 16
+_hints_cache: OrderedDict = OrderedDict()
+_static_cache: dict[Path, list[str]] = {}
+
+
+def load_static_hints(path: Path) -> list[str]:
+    """Read a phrase-set file (one phrase per line) once per process."""
+    hints = _static_cache.get(path)
+    if hints is None:
+        if path.exists():
+            lines = path.read_text(encoding="utf-8").splitlines()
+            hints = [line.strip() for line in lines if line.strip()]
+            log.info("Loaded %d phrase hints from %s", len(hints), path.name)
+        else:
+            log.warning("Phrase set file not found: %s", path)
+            hints = []
+        _static_cache[path] = hints
+    return hints
+
+
+def _clean(text: str) -> list[str]:
+    """Speakable phrases in a schema label ("IIb — Adherent clot" → "IIb", "Adherent clot")."""
+    text = _BOX_RE.sub(" ", text)
+    phrases = []
+    for part in re.split(r"\s+[—–-]\s+|/|\(|\)|:", text):
+        part = " ".join(part.replace("_", " ").split()).strip(" ,.;")
+        if len(part) >= 3 and not part.replace(".", "").isdigit():
+            phrases.append(part)
+    return phrases
+
+
+def _schema_terms(schema: dict):
+    """Yield (source, phrase) for every speakable schema label."""
+    for loc in schema.get("locations", []):
+        yield "location", loc
+    for loc, sub in schema.get("sublocations", {}).items():
+        if isinstance(sub, dict):
+            for region, options in sub.items():
+                if region != "_standalone":
+                    yield "sublocation", region
+                for opt in options:
+                    yield "sublocation", opt
+        else:
+            for s in sub:
+                yield "sublocation", s
+    for dname, ddef in schema.get("diseases", {}).items():
+        yield "disease", dname
+        for sname, sdef in ddef.get("sections", {}).items():
+            yield "section", sname
+            for a in sdef.get("attributes", []):
+                yield "attribute", a
+            for subname, subdef in sdef.get("subsections", {}).items():
+                yield "section", subname
+                for a in subdef.get("attributes", []):
+                    yield "attribute", a
+
+
+def build_phrase_hints(schema: dict, procedure_type: str, static: dict[str, list[str]],
+                       max_phrases: int = _DEFAULT_MAX_PHRASES) -> list[str]:
+    """
+    Merge schema-derived and static hints, ranked and capped at max_phrases.
+
+    static maps the procedure each phrase file was curated for to its phrases.
+    """
+    scores = defaultdict(float)
+    display = {}
+    vocab = set()
+
+    for source, label in _schema_terms(schema):
+        for phrase in _clean(label):
+            key = phrase.lower()
+            display.setdefault(key, phrase)
+            # Repeats add a little: values shared by many diseases recur in dictation
+            scores[key] = max(scores[key], _WEIGHTS[source]) + 0.1
+            vocab.update(_WORD_RE.findall(key))
+
+    for owner, phrases in static.items():
+        for phrase in phrases:
+            key = phrase.lower()
+            if owner != procedure_type and not set(_WORD_RE.findall(key)) <= vocab:
+                continue
+            display.setdefault(key, phrase)
+            scores[key] = max(scores[key], _WEIGHTS["static"]) + 0.1
+
+    ranked = sorted(scores, key=lambda k: (-scores[k], k))
+    return [display[k] for k in ranked[:max_phrases]]
+
+
+def get_phrase_hints(schema: dict, schema_key: str | None, procedure_type: str,
+                     phrase_files: dict[str, Path],
+                     max_phrases: int = _DEFAULT_MAX_PHRASES) -> list[str]:
+    """Return the ranked hint list for a schema, built once per schema_key."""
+    key = (schema_key, procedure_type, max_phrases)
+    hints = _hints_cache.get(key) if schema_key else None
+    if hints is not None:
+        _hints_cache.move_to_end(key)
+        return hints
+
+    static = {proc: load_static_hints(path) for proc, path in phrase_files.items()}
+    hints = build_phrase_hints(schema, procedure_type, static, max_phrases)
+    log.info("Phrase hints for %s: %d (cap %d)", procedure_type, len(hints), max_phrases)
+    if schema_key:
+        _hints_cache[key] = hints
+        while len(_hints_cache) > _HINTS_CACHE_MAX:
+            _hints_cache.popitem(last=False)
+    return hints
@@ -0,0 +1,145 @@
+"""
+Phrase Matcher — token-level Aho-Corasick automaton for dictation phrases.
+
+Phrases are matched on normalized word tokens rather than characters, so a
+match always starts and ends on a word boundary ("pause" never matches inside
+"pauses") and one pass over the transcript finds every phrase regardless of
+how many are registered.
+
+tokenize() is the shared normalization: lowercase, split letter/digit runs
+("2b" → "2", "b"), spelled-out numbers to digits ("two" → "2").
+"""
+
+from __future__ import annotations
+
+import re
+from collections import deque
+from dataclasses import dataclass
+
+_TOKEN_RE = re.compile(r"[a-z]+|[0-9]+")
+
+_NUMBER_WORDS = {
+    "zero": "0", "one": "1", "two": "2", "three": "3", "four": "4", "five": "5",
+    "six": "6", "seven": "7", "eight": "8", "nine": "9", "ten": "10",
+    "eleven": "11", "twelve": "12", "thirteen": "13", "fourteen": "14",
+    "fifteen": "15", "sixteen": "16", "seventeen": "17", "eighteen": "18",
+    "nineteen": "19", "twenty": "20",
+}
+
+
+def tokenize(text: str) -> list[str]:
+    """Normalize text into matcher tokens."""
+    return [_NUMBER_WORDS.get(t, t) for t in _TOKEN_RE.findall(text.lower())]
+
+
+@dataclass
+class Match:
+    """A phrase occurrence: tokens[start:end] and every payload registered for it."""
+    start: int
+    end: int
+    payloads: list
+
+
+class PhraseMatcher:
+    """
+    Aho-Corasick automaton over token sequences.
+
+    add() phrases, then build() once; find_all()/cover() are then linear in
+    the number of transcript tokens (plus matches reported). step() and
+    payloads_at() expose the underlying trie for callers that walk it with
+    their own (e.g. fuzzy) token matching.
+    """
+
+    def __init__(self):
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[int]] = [[]]       # phrase ids ending at each state
+        self._phrases: list[tuple[int, list]] = []  # (length, payloads) per phrase id
+        self._terminal: dict[int, int] = {}      # state → phrase id
+        self._built = False
+
+    def __len__(self) -> int:
+        return len(self._phrases)
+
+    def add(self, tokens, payload) -> None:
+        """Register a phrase (token sequence or text). Duplicate phrases share a match."""
+        if isinstance(tokens, str):
+            tokens = tokenize(tokens)
+        if not tokens:
+            return
+        state = 0
+        for t in tokens:
+            nxt = self._goto[state].get(t)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][t] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        pid = self._terminal.get(state)
+        if pid is None:
+            pid = len(self._phrases)
+            self._terminal[state] = pid
+            self._phrases.append((len(tokens), []))
+            self._out[state].append(pid)
+        if payload not in self._phrases[pid][1]:
+            self._phrases[pid][1].append(payload)
+        self._built = False
+
+    def build(self) -> "PhraseMatcher":
+        """Compute failure links (BFS) and merge output sets."""
+        queue = deque()
+        for nxt in self._goto[0].values():
+            self._fail[nxt] = 0
+            queue.append(nxt)
+        while queue:
+            state = queue.popleft()
+            for t, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and t not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(t, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        self._built = True
+        return self
+
+    def step(self, state: int, token: str) -> int | None:
+        """Trie transition without failure links (None if no phrase continues with token)."""
+        return self._goto[state].get(token)
+
+    def payloads_at(self, state: int) -> list:
+        """Payloads of the phrase ending exactly at state (empty if none)."""
+        pid = self._terminal.get(state)
+        return self._phrases[pid][1] if pid is not None else []
+
+    def find_all(self, tokens: list[str]) -> list[Match]:
+        """Every phrase occurrence in tokens, ordered by end position."""
+        if not self._built:
+            self.build()
+        matches = []
+        state = 0
+        for i, t in enumerate(tokens):
+            while state and t not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(t, 0)
+            for pid in self._out[state]:
+                length, payloads = self._phrases[pid]
+                matches.append(Match(i + 1 - length, i + 1, payloads))
+        return matches
+
+    def cover(self, tokens: list[str]) -> list[Match]:
+        """Non-overlapping matches chosen leftmost-longest, in transcript order."""
+        best: dict[int, Match] = {}
+        for m in self.find_all(tokens):
+            cur = best.get(m.start)
+            if cur is None or m.end > cur.end:
+                best[m.start] = m
+        chosen = []
+        pos = 0
+        for start in sorted(best):
+            if start >= pos:
+                chosen.append(best[start])
+                pos = best[start].end
+        return chosen
@@ -0,0 +1,184 @@
+"""
+Report Renderer — Deterministic sentences report from the structured EHR JSON.
+
+Local alternative to llm_caller.generate_sentences_report(): walks
+location → disease → sublocations → sections → attrs / inputs and writes the
+same HTML the LLM is asked for (<h2> locations, <h3> findings, <p>
+sentences, <strong> for key findings), in milliseconds and without network.
+
+Each filled section becomes one sentence built from a clause template with
+{label} (the section / subsection name) and {value} (its selected attributes
+and filled inputs, joined as "a, b and c"):
+
+    "Size": "measuring {value}"          → "Measuring 6-10 mm."
+    default "{label}: {value}"           → "Forrest classification: IIb."
+
+A section with subsections lists them in one sentence ("Glycogen acanthosis:
+seen, size of largest <5 mm."). Yes / No answers read as presence or absence
+("Scalloping noted.", "No scalloping."). Templates come from config.yaml
+sentences.templates, merged over the defaults below.
+
+With a schema, locations, sections, subsections and attributes follow the
+menu's order; without one, the report's own order is kept.
+"""
+
+import html
+import re
+
+# ── Default clause templates (overridden per name by sentences.templates) ──
+_DEFAULT_TEMPLATES = {
+    "*": "{label}: {value}",              # Section without a template
+    "*sub": "{label} {value}",            # Subsection clause inside its section's sentence
+    "Size": "measuring {value}",
+}
+
+_YES = {"yes", "present", "seen"}
+_NO = {"no", "absent", "not seen"}
+_PRESENCE_SUBSECTIONS = {"seen", "present"}   # "Seen: Yes" reads as the parent being seen
+
+_BOX_TYPES = ("int_box", "float_box", "alphanum_box")
+
+
+def _join(items: list[str]) -> str:
+    """'a', 'a and b', 'a, b and c'."""
+    items = [i for i in items if i]
+    if len(items) <= 1:
+        return "".join(items)
+    return ", ".join(items[:-1]) + " and " + items[-1]
+
+
+def _sentence(text: str) -> str:
+    text = text.strip()
+    if not text:
+        return ""
+    text = text[0].upper() + text[1:]
+    return text if text[-1] in ".!?" else text + "."
+
+
+def _lower_label(name: str) -> str:
+    """Lowercase capitalised words for mid-sentence use, keeping acronyms and codes (LA, IIb)."""
+    return " ".join(w.lower() if w[:1].isupper() and w[1:] == w[1:].lower() and w[1:].isalpha()
+                    else w for w in name.split())
+
+
+def _ordered(keys, order: list | None) -> list:
+    """keys in schema order first, then any the schema does not know."""
+    keys = list(keys)
+    if not order:
+        return keys
+    known = [k for k in order if k in keys]
+    return known + [k for k in keys if k not in known]
+
+
+def _input_text(group: dict) -> str:
+    """Text of a filled input group, as the report pane shows it (renderGroupLabel)."""
+    if not isinstance(group, dict):
+        return ""
+    if group.get("type", "group") != "group":
+        return str(group.get("label") or group.get("value") or "").strip()
+    pattern = group.get("pattern") or []
+    values = group.get("values") or []
+    parts, filled = [], False
+    for i, token in enumerate(pattern):
+        kind = (token or {}).get("type")
+        if kind in _BOX_TYPES:
+            v = str(values[i]).strip() if i < len(values) and values[i] is not None else ""
+            filled |= bool(v)
+            parts.append(v)
+        elif kind == "text":
+            parts.append(str(token.get("value", "")))
+    if not filled:
+        return ""
+    return re.sub(r"\s+", " ", " ".join(parts)).strip()
+
+
+def _values(entry: dict, attr_order: list | None) -> list[str]:
+    # Attributes with input boxes ("Measured: int_box mm") are rendered from inputs
+    attrs = [a for a, on in (entry.get("attrs") or {}).items() if on and "_box" not in a]
+    values = [_lower_label(a) for a in _ordered(attrs, attr_order)]
+    values += [t for t in (_input_text(g) for g in entry.get("inputs") or []) if t]
+    return values
+
+
+def _clause(label: str, values: list[str], templates: dict, default_key: str) -> str:
+    lowered = [v.lower() for v in values]
+    if lowered and all(v in _YES for v in lowered):
+        return f"{_lower_label(label)} noted"
+    if lowered and all(v in _NO for v in lowered):
+        return f"no {_lower_label(label)}"
+    template = templates.get(label) or templates[default_key]
+    return template.format(label=_lower_label(label), value=_join(values))
+
+
+def _section_sentence(name: str, sec: dict, sec_schema: dict, templates: dict) -> str:
+    values = _values(sec, sec_schema.get("attributes"))
+    sub_schema = sec_schema.get("subsections") or {}
+    sub_clauses = []
+    for sub_name in _ordered((sec.get("subsections") or {}).keys(), list(sub_schema)):
+        sub = sec["subsections"][sub_name] or {}
+        sub_values = _values(sub, (sub_schema.get(sub_name) or {}).get("attributes"))
+        if not sub_values:
+            continue
+        lowered = [v.lower() for v in sub_values]
+        if sub_name.lower() in _PRESENCE_SUBSECTIONS and lowered in (["yes"], ["no"]):
+            sub_clauses.append("seen" if lowered == ["yes"] else "not seen")
+        else:
+            sub_clauses.append(_clause(sub_name, sub_values, templates, "*sub"))
+
+    if not sub_clauses:
+        return _sentence(_clause(name, values, templates, "*")) if values else ""
+    head = _lower_label(name) + (f" ({_join(values)})" if values else "")
+    return _sentence(f"{head}: {', '.join(sub_clauses)}")
+
+
+def _disease_html(loc: str, dname: str, entry: dict, disease_schema: dict,
+                  templates: dict) -> list[str]:
+    out = [f"<h3>{html.escape(dname)}</h3>"]
+    subs = [s for s in entry.get("sublocations") or [] if s]
+    where = f"in the {_lower_label(loc)}"
+    if subs:
+        where += ", at the " + _join([_lower_label(s) for s in subs])
+    sentences = [f"<strong>{html.escape(dname)}</strong> noted {html.escape(where)}."]
+
+    sec_schema_all = disease_schema.get("sections") or {}
+    sections = entry.get("sections") or {}
+    for name in _ordered(sections.keys(), list(sec_schema_all)):
+        text = _section_sentence(name, sections[name] or {}, sec_schema_all.get(name) or {}, templates)
+        if text:
+            sentences.append(html.escape(text))
+    out.append("<p>" + " ".join(sentences) + "</p>")
+
+    comments = (entry.get("comments") or "").strip()
+    if comments:
+        out.append("<p>" + html.escape(_sentence(comments)) + "</p>")
+    return out
+
+
+def render_sentences_report(report_data: dict, schema: dict | None = None,
+                            templates: dict | None = None) -> str:
+    """
+    HTML sentences report for {report, overallRemarks, ...} (the
+    /api/generate-report payload). schema (schema_builder format) sets the
+    order; templates override _DEFAULT_TEMPLATES by section name.
+    """
+    tmpl = dict(_DEFAULT_TEMPLATES)
+    tmpl.update(templates or {})
+    schema = schema or {}
+    disease_schemas = schema.get("diseases") or {}
+    report = report_data.get("report") or {}
+
+    out = []
+    for loc in _ordered(report.keys(), schema.get("locations")):
+        diseases = (report[loc] or {}).get("diseases") or {}
+        if not diseases:
+            continue
+        out.append(f"<h2>{html.escape(loc)}</h2>")
+        for dname in _ordered(diseases.keys(), list(disease_schemas)):
+            out.extend(_disease_html(loc, dname, diseases[dname] or {},
+                                     disease_schemas.get(dname) or {}, tmpl))
+
+    remarks = (report_data.get("overallRemarks") or "").strip()
+    if remarks:
+        out.append("<h2>Overall Remarks</h2>")
+        out.append("<p>" + html.escape(_sentence(remarks)) + "</p>")
+    return "\n".join(out)
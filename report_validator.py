@@ -0,0 +1,481 @@
+"""
+Report Validator — Schema-compiled deep validation of LLM report output.
+
+models.validate_llm_response() checks location and disease names only, so a
+hallucinated section, subsection, attribute or sublocation reaches the UI.
+compile_validator(schema) builds, once per schema, hash indexes of everything
+the menu allows:
+
+    disease   → locations, default sublocation, sections
+    section   → attributes, input patterns, single / multi-select, subsections
+    subsection → attributes, input patterns, single / multi-select, Conditional_on
+    location  → sublocations ("Region", "Region - Option", standalone options)
+
+ReportValidator.validate(data) walks the LLM output once, copying what is
+valid into a fresh plain-dict {report, overallRemarks} (the shape the client
+and _report_state() use) and pruning or repairing the rest:
+
+- unknown location / disease, or a disease at a location it does not occur → dropped
+- unknown section, subsection, attribute or input field → dropped
+- sublocation not offered for the location (other than the default) → dropped
+- single-select with several attributes set → the last one kept
+- subsection whose Conditional_on is not met by the entry → dropped
+- input values / comments of the wrong type → coerced to strings, input
+  patterns re-derived from the attribute (parseAttributePattern)
+
+It returns (doc, dropped); dropped lists "path: reason" for each pruned node
+and is counted in ehr_validation_dropped_total{kind}. doc is None only when
+the top-level shape is unusable. Valid subtrees are shared with the input,
+not copied, so a clean response costs one walk and no allocation below the
+report. Without a schema only the structure and the location names are
+checked.
+"""
+
+import re
+from collections import OrderedDict
+
+from metrics import REGISTRY
+from models import VALID_LOCATIONS
+
+DROPPED = REGISTRY.counter("ehr_validation_dropped_total",
+                           "Nodes pruned from LLM output by the compiled validator", ("kind",))
+
+_VALIDATOR_CACHE_MAX = 16
+_validator_cache: OrderedDict = OrderedDict()    # id(schema) → (schema, ReportValidator)
+
+_BOX_RE = re.compile(r"(int_box|float_box|alphanum_box)", re.IGNORECASE)
+_BOX_TYPES = ("int_box", "float_box", "alphanum_box")
+_RANGE_RE = re.compile(r"^Range\(\s*(-?\d+)\s*,\s*(-?\d+)\s*\)$", re.IGNORECASE)
+_TRUE_STRINGS = {"true", "yes", "1"}
+
+
+# ── Menu helpers (ports of the frontend's CSV parsing) ──
+
+def parse_attribute_pattern(attr: str) -> list[dict]:
+    """Token pattern of an input attribute, as parseAttributePattern() builds it."""
+    result = []
+    for tok in attr.strip().split():
+        parts = _BOX_RE.split(tok) if len(_BOX_RE.findall(tok)) > 1 else [tok]
+        for part in parts:
+            lower = part.lower()
+            if lower in _BOX_TYPES:
+                result.append({"type": lower})
+            elif part.strip():
+                result.append({"type": "text", "value": part})
+    return result
+
+
+def _expand_attributes(attrs: list[str]) -> tuple[frozenset, dict]:
+    """(selectable attribute names, input attribute → pattern), expanding Range(a, b)."""
+    pills, inputs = set(), {}
+    for a in attrs:
+        m = _RANGE_RE.match(a)
+        if m:
+            pills.update(str(i) for i in range(int(m.group(1)), int(m.group(2))))
+        elif _BOX_RE.search(a):
+            inputs[a] = parse_attribute_pattern(a)
+        else:
+            pills.add(a)
+    return frozenset(pills), inputs
+
+
+def _compile_condition(cond: str):
+    """
+    Conditional_on as a predicate tree, mirroring evaluateConditional():
+    ("or", [...]), ("and", [...]), ("loc", main), ("sec", section, attr),
+    ("sub", subsection, attr). Unrecognised conditions compile to None and
+    never prune (the validator must not drop data over a menu typo).
+    """
+    s = (cond or "").strip()
+    if not s:
+        return None
+    if re.search(r"\sOR\s", s, re.IGNORECASE):
+        parts = [_compile_condition(p) for p in re.split(r"\sOR\s", s, flags=re.IGNORECASE)]
+        return None if None in parts else ("or", parts)
+    if re.search(r"\sAND\s", s, re.IGNORECASE):
+        parts = [_compile_condition(p) for p in re.split(r"\sAND\s", s, flags=re.IGNORECASE)]
+        return None if None in parts else ("and", parts)
+    m = re.match(r"^Location\(\s*Main\s*=\s*(.+?)\s*\)$", s, re.IGNORECASE)
+    if m:
+        return ("loc", m.group(1))
+    m = re.match(r"^(Section|Subsection)\(\s*([^=]+?)\s*=\s*(.+?)\s*\)$", s, re.IGNORECASE)
+    if m:
+        return ("sec" if m.group(1).lower() == "section" else "sub", m.group(2).strip(), m.group(3).strip())
+    return None
+
+
+def _condition_met(pred, loc: str, sections: dict, context: str) -> bool:
+    kind = pred[0]
+    if kind == "or":
+        return any(_condition_met(p, loc, sections, context) for p in pred[1])
+    if kind == "and":
+        return all(_condition_met(p, loc, sections, context) for p in pred[1])
+    if kind == "loc":
+        return loc == pred[1]
+    if kind == "sec":
+        sec = sections.get(pred[1])
+        if sec is None:
+            return False
+        return pred[2] in sec["attrs"] or any(pred[2] in sub["attrs"]
+                                              for sub in sec["subsections"].values())
+    # "sub": the context section first, then any section (evaluateSingleCondition)
+    name, value = pred[1], pred[2]
+    sec = sections.get(context)
+    if sec is not None:
+        sub = sec["subsections"].get(name)
+        if sub is not None and value in sub["attrs"]:
+            return True
+    return any(value in s["subsections"][name]["attrs"]
+               for s in sections.values() if name in s["subsections"])
+
+
+class _NodeSpec:
+    """What a section or subsection may hold."""
+    __slots__ = ("attrs", "inputs", "multi", "subsections", "conditional", "conditional_subs")
+
+    def __init__(self, sdef: dict):
+        self.attrs, self.inputs = _expand_attributes(sdef.get("attributes") or [])
+        self.multi = bool(sdef.get("multi"))
+        self.subsections = {name: _NodeSpec(sub) for name, sub in (sdef.get("subsections") or {}).items()}
+        self.conditional = _compile_condition(sdef.get("conditional", ""))
+        self.conditional_subs = tuple((name, sub.conditional) for name, sub in self.subsections.items()
+                                      if sub.conditional is not None)
+
+
+class _DiseaseSpec:
+    __slots__ = ("locations", "default_sublocation", "sections", "conditional_sections")
+
+    def __init__(self, ddef: dict):
+        self.locations = frozenset(ddef.get("locations") or ())
+        self.default_sublocation = ddef.get("default_sublocation") or ""
+        self.sections = {name: _NodeSpec(sdef) for name, sdef in (ddef.get("sections") or {}).items()}
+        self.conditional_sections = tuple((name, sec.conditional_subs) for name, sec in self.sections.items()
+                                          if sec.conditional_subs)
+
+
+def _sublocation_index(sublocations: dict) -> dict:
+    index = {}
+    for loc, sub in (sublocations or {}).items():
+        allowed = set()
+        if isinstance(sub, dict):
+            for region, options in sub.items():
+                if region == "_standalone":
+                    allowed.update(options)
+                    continue
+                allowed.add(region)
+                allowed.update(f"{region} - {opt}" for opt in options)
+        else:
+            allowed.update(sub or ())
+        index[loc] = frozenset(allowed)
+    return index
+
+
+def _is_on(v) -> bool:
+    """Attribute value as the UI reads it (Pydantic's lax bool for strings / ints)."""
+    if v is True:
+        return True
+    if isinstance(v, str):
+        return v.strip().lower() in _TRUE_STRINGS
+    return type(v) is int and v == 1
+
+
+def _int_or_none(v):
+    if v is None or isinstance(v, bool):
+        return None
+    if isinstance(v, int):
+        return v
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+_DISEASE_FIELDS = ("sublocations", "sections", "comments", "startFrame", "endFrame", "segmentationFrame")
+_FRAME_FIELDS = ("startFrame", "endFrame", "segmentationFrame")
+_SECTION_FIELDS = frozenset(("attrs", "inputs", "subsections"))
+_SUBSECTION_FIELDS = frozenset(("attrs", "inputs"))
+
+
+class ReportValidator:
+    """
+    Validates and prunes LLM report output against one compiled schema.
+
+    Nodes that are already valid are returned as they are, not copied — the
+    output shares them with the input (which may itself share with the
+    session state, see json_patch), so neither may be mutated in place.
+    Only repaired nodes and their ancestors are new objects.
+    """
+
+    def __init__(self, schema: dict | None):
+        schema = schema or {}
+        self.locations = frozenset(schema.get("locations") or ()) | VALID_LOCATIONS
+        diseases = schema.get("diseases")
+        self.diseases = ({name: _DiseaseSpec(ddef) for name, ddef in diseases.items()}
+                         if diseases is not None else None)
+        self.sublocations = _sublocation_index(schema.get("sublocations"))
+
+    # ── Sections / subsections ──
+
+    def _attrs(self, attrs, spec: _NodeSpec | None, path: str, dropped: list) -> dict:
+        if type(attrs) is not dict:
+            return {}
+        allowed = spec.attrs if spec is not None else None
+        for name, value in attrs.items():
+            if value is not True or (allowed is not None and name not in allowed):
+                break
+        else:
+            if spec is None or spec.multi or len(attrs) <= 1:
+                return attrs
+
+        out = {}
+        for name, value in attrs.items():
+            if value is not True and not _is_on(value):
+                continue  # Unselected: the UI deletes the key
+            if allowed is not None and name not in allowed:
+                self._drop(dropped, "attribute", f"{path}/attrs/{name}", "unknown attribute")
+                continue
+            out[name] = True
+        if spec is not None and not spec.multi and len(out) > 1:
+            keep = list(out)[-1]
+            for name in list(out)[:-1]:
+                self._drop(dropped, "attribute", f"{path}/attrs/{name}", f"single-select, kept {keep}")
+            out = {keep: True}
+        return out
+
+    def _inputs(self, inputs, spec: _NodeSpec | None, path: str, dropped: list) -> list:
+        if type(inputs) is not list:
+            return []
+        if not inputs:
+            return inputs
+        out = []
+        for group in inputs:
+            if not isinstance(group, dict):
+                self._drop(dropped, "input", f"{path}/inputs", "not an input group")
+                continue
+            raw_key = group.get("rawKey")
+            raw_key = raw_key if isinstance(raw_key, str) else ""
+            if spec is not None:
+                pattern = spec.inputs.get(raw_key)
+                if pattern is None:
+                    self._drop(dropped, "input", f"{path}/inputs/{raw_key}", "unknown input field")
+                    continue
+            else:
+                pattern = group.get("pattern") if isinstance(group.get("pattern"), list) else []
+            values = group.get("values")
+            values = [("" if v is None else str(v)) for v in values] if isinstance(values, list) else []
+            if spec is not None:
+                values = (values + [""] * len(pattern))[:len(pattern)]
+                if not any(values[i].strip() for i, tok in enumerate(pattern) if tok["type"] in _BOX_TYPES):
+                    self._drop(dropped, "input", f"{path}/inputs/{raw_key}", "no value")
+                    continue
+            clean = {k: v for k, v in group.items() if k not in ("type", "rawKey", "pattern", "values")}
+            clean.update(type=group.get("type") if isinstance(group.get("type"), str) else "group",
+                         rawKey=raw_key, pattern=pattern, values=values)
+            out.append(clean)
+        return out
+
+    def _node(self, entry, spec: _NodeSpec | None, path: str, dropped: list, subsection: bool) -> dict | None:
+        if type(entry) is not dict:
+            self._drop(dropped, "field", path, "not an object")
+            return None
+        attrs = self._attrs(entry.get("attrs"), spec, path, dropped)
+        inputs = self._inputs(entry.get("inputs"), spec, path, dropped)
+        fields = _SUBSECTION_FIELDS if subsection else _SECTION_FIELDS
+        if subsection:
+            subs = None
+        else:
+            subs = self._subsections(entry.get("subsections"), spec, path, dropped)
+        if (attrs is entry.get("attrs") and inputs is entry.get("inputs")
+                and subs is entry.get("subsections") and len(entry) == len(fields)):
+            return entry
+
+        for k in entry:
+            if k not in fields:
+                self._drop(dropped, "field", f"{path}/{k}", "unknown field")
+        out = {"attrs": attrs, "inputs": inputs}
+        if not subsection:
+            out["subsections"] = subs
+        return out
+
+    def _subsections(self, subs, spec: _NodeSpec | None, path: str, dropped: list) -> dict:
+        if type(subs) is not dict:
+            return {}
+        out, changed = {}, False
+        for name, sub in subs.items():
+            sub_spec = None
+            if spec is not None:
+                sub_spec = spec.subsections.get(name)
+                if sub_spec is None:
+                    self._drop(dropped, "subsection", f"{path}/subsections/{name}", "unknown subsection")
+                    changed = True
+                    continue
+            node = self._node(sub, sub_spec, f"{path}/subsections/{name}", dropped, True)
+            if node is not sub:
+                changed = True
+                if node is None:
+                    continue
+            out[name] = node
+        return out if changed else subs
+
+    # ── Diseases ──
+
+    def _sublocations(self, sublocs, loc: str, spec: _DiseaseSpec | None, path: str, dropped: list) -> list:
+        if type(sublocs) is not list:
+            return []
+        allowed = self.sublocations.get(loc) if spec is not None else None
+        out = []
+        for s in sublocs:
+            if not isinstance(s, str) or s in out:
+                continue
+            if allowed is not None and s not in allowed and s != spec.default_sublocation:
+                self._drop(dropped, "sublocation", f"{path}/sublocations/{s}", "not offered here")
+                continue
+            out.append(s)
+        return sublocs if len(out) == len(sublocs) else out
+
+    def _sections(self, sections, loc: str, spec: _DiseaseSpec | None, path: str, dropped: list) -> dict:
+        if type(sections) is not dict:
+            return {}
+        out, changed = {}, False
+        for name, sec in sections.items():
+            sec_spec = None
+            if spec is not None:
+                sec_spec = spec.sections.get(name)
+                if sec_spec is None:
+                    self._drop(dropped, "section", f"{path}/sections/{name}", "unknown section")
+                    changed = True
+                    continue
+            node = self._node(sec, sec_spec, f"{path}/sections/{name}", dropped, False)
+            if node is not sec:
+                changed = True
+                if node is None:
+                    continue
+                if (sec_spec is not None and not (node["attrs"] or node["inputs"] or node["subsections"])
+                        and (sec.get("attrs") or sec.get("inputs") or sec.get("subsections"))):
+                    continue  # Held nothing but pruned content
+            out[name] = node
+
+        # Conditional subsections, checked once the rest of the entry is final
+        if spec is not None:
+            for name, conditional_subs in spec.conditional_sections:
+                node = out.get(name)
+                if node is None:
+                    continue
+                subs = node["subsections"]
+                for sub_name, pred in conditional_subs:
+                    if sub_name in subs and not _condition_met(pred, loc, out, name):
+                        self._drop(dropped, "subsection", f"{path}/sections/{name}/subsections/{sub_name}",
+                                   "condition not met")
+                        subs = {k: v for k, v in subs.items() if k != sub_name}
+                if subs is not node["subsections"]:
+                    if node["attrs"] or node["inputs"] or subs:
+                        out[name] = dict(node, subsections=subs)   # Copy on write: node may be shared
+                    else:
+                        del out[name]
+                    changed = True
+        return out if changed else sections
+
+    def _disease(self, loc: str, entry: dict, spec: _DiseaseSpec | None, path: str, dropped: list) -> dict:
+        sublocs = self._sublocations(entry.get("sublocations"), loc, spec, path, dropped)
+        sections = self._sections(entry.get("sections"), loc, spec, path, dropped)
+        comments = entry.get("comments")
+        if not isinstance(comments, str):
+            comments = "" if comments is None else str(comments)
+        frames = [entry.get(k) for k in _FRAME_FIELDS]
+        if (sublocs is entry.get("sublocations") and sections is entry.get("sections")
+                and comments is entry.get("comments")
+                and all(f is None or type(f) is int for f in frames) and len(entry) >= len(_DISEASE_FIELDS)
+                and all(k in entry for k in _FRAME_FIELDS)):
+            return entry
+
+        out = {
+            "sublocations": sublocs,
+            "sections": sections,
+            "comments": comments,
+            "startFrame": _int_or_none(frames[0]),
+            "endFrame": _int_or_none(frames[1]),
+            "segmentationFrame": _int_or_none(frames[2]),
+        }
+        for k, v in entry.items():
+            if k not in _DISEASE_FIELDS:
+                out[k] = v  # Extra fields (frame metadata etc.) pass through, as with Pydantic
+        return out
+
+    # ── API ──
+
+    def validate(self, data) -> tuple[dict | None, list[str]]:
+        """(validated {report, overallRemarks}, dropped) — the input is not modified."""
+        dropped: list[str] = []
+        if not isinstance(data, dict):
+            return None, ["/: not an object"]
+        # The LLM sometimes returns the report directly, without the wrapper
+        if "report" not in data and any(k in self.locations for k in data):
+            data = {"report": data}
+        report = data.get("report", {})
+        if not isinstance(report, dict):
+            return None, ["/report: not an object"]
+
+        out_report = {}
+        for loc, loc_entry in report.items():
+            if loc not in self.locations:
+                self._drop(dropped, "location", loc, "unknown location")
+                continue
+            if not isinstance(loc_entry, dict):
+                self._drop(dropped, "location", loc, "not an object")
+                continue
+            diseases = loc_entry.get("diseases")
+            out_diseases, changed = {}, not isinstance(diseases, dict) or len(loc_entry) != 1
+            for dname, entry in (diseases.items() if isinstance(diseases, dict) else ()):
+                path = f"{loc}/{dname}"
+                spec = None
+                if self.diseases is not None:
+                    spec = self.diseases.get(dname)
+                    if spec is None:
+                        self._drop(dropped, "disease", path, "unknown disease")
+                        changed = True
+                        continue
+                    if loc not in spec.locations:
+                        self._drop(dropped, "disease", path, "not found at this location")
+                        changed = True
+                        continue
+                if not isinstance(entry, dict):
+                    self._drop(dropped, "disease", path, "not an object")
+                    changed = True
+                    continue
+                out = self._disease(loc, entry, spec, path, dropped)
+                changed |= out is not entry
+                out_diseases[dname] = out
+            if out_diseases or self.diseases is None:
+                out_report[loc] = {"diseases": out_diseases} if changed else loc_entry
+
+        remarks = data.get("overallRemarks")
+        remarks = remarks if isinstance(remarks, str) else ("" if remarks is None else str(remarks))
+        return {"report": out_report, "overallRemarks": remarks}, dropped
+
+    @staticmethod
+    def _drop(dropped: list, kind: str, path: str, reason: str):
+        dropped.append(f"{path}: {reason}")
+        DROPPED.inc(kind=kind)
+
+
+def compile_validator(schema: dict | None) -> ReportValidator:
+    """
+    The compiled validator for a schema, built on first use. Schemas come from
+    schema_builder's cache and are shared read-only, so they are keyed by
+    identity (the entry holds the schema, so its id cannot be reused).
+    """
+    key = id(schema)
+    entry = _validator_cache.get(key)
+    if entry is not None and entry[0] is schema:
+        _validator_cache.move_to_end(key)
+        return entry[1]
+    validator = ReportValidator(schema)
+    _validator_cache[key] = (schema, validator)
+    while len(_validator_cache) > _VALIDATOR_CACHE_MAX:
+        _validator_cache.popitem(last=False)
+    return validator
+
+
+def validate_report(data, schema: dict | None = None) -> tuple[dict | None, list[str]]:
+    """Validate LLM output against schema with its compiled validator (see ReportValidator)."""
+    return compile_validator(schema).validate(data)
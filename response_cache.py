@@ -0,0 +1,185 @@
+"""
+Response Cache — Memoized LLM responses, in memory and optionally on disk.
+
+Identical prompts recur: reconnects that resend the same state, a batch
+re-sent by the stop flush, QA replays of the same recordings, "generate
+sentences" clicked again on an unchanged report. llm_caller looks each call
+up here by a canonical hash of everything that determines the response
+(model, generation settings, prompt parts) before calling Gemini.
+
+Two tiers:
+- memory: LRU of parsed results (max_entries), shared and read-only — a hit
+  is a dict lookup, no copy or re-parse
+- disk (optional): SQLite file of JSON-encoded results that survives
+  restarts; hits are promoted to memory. Trimmed to disk_max_entries, oldest
+  first, every _DISK_TRIM_EVERY writes
+
+Entries expire ttl seconds after they were stored (wall clock, so the disk
+tier keeps its meaning across restarts). Only successful responses are
+stored. Lookups, hits per tier and evictions are exported via metrics.REGISTRY.
+"""
+
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import jsonfast
+from metrics import REGISTRY
+
+log = logging.getLogger("ehr-voice")
+
+# ── Defaults (overridden by llm.response_cache_* config) ──
+_DEFAULT_MAX_ENTRIES = 512
+_DEFAULT_TTL = 86400               # seconds
+_DEFAULT_DISK_MAX_ENTRIES = 20000
+
+_DISK_TRIM_EVERY = 100             # Disk writes between expiry/size sweeps
+
+LOOKUPS = REGISTRY.counter("ehr_llm_cache_lookups_total",
+                           "LLM response cache lookups by call kind and result (memory|disk|miss)",
+                           ("kind", "result"))
+EVICTIONS = REGISTRY.counter("ehr_llm_cache_evictions_total",
+                             "LLM response cache entries evicted (size or TTL)", ("tier",))
+ENTRIES = REGISTRY.gauge("ehr_llm_cache_entries", "LLM response cache entries held", ("tier",))
+
+
+def cache_key(*parts) -> str:
+    """
+    SHA-256 over the parts, each length-prefixed so that no two different
+    part lists hash alike. Strings are hashed as is; anything else as
+    canonical JSON (sorted keys).
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, str):
+            part = jsonfast.dumps(part, sort_keys=True)
+        data = part.encode("utf-8")
+        h.update(b"%d:" % len(data))
+        h.update(data)
+    return h.hexdigest()
+
+
+class ResponseCache:
+    """LRU of LLM results with TTL, backed by an optional SQLite store."""
+
+    def __init__(self, max_entries: int = _DEFAULT_MAX_ENTRIES, ttl: float = _DEFAULT_TTL,
+                 path: Path | None = None, disk_max_entries: int = _DEFAULT_DISK_MAX_ENTRIES):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self.path = path
+        self.disk_max_entries = max(1, int(disk_max_entries))
+        self._mem: OrderedDict[str, tuple[float, object]] = OrderedDict()  # key → (expires, value)
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        self._writes = 0
+        if path is not None:
+            self._db = self._open(path)
+
+    # ── Memory tier ──
+
+    def _get_memory(self, key: str):
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._mem[key]
+                EVICTIONS.inc(tier="memory")
+                ENTRIES.set(len(self._mem), tier="memory")
+                return None
+            self._mem.move_to_end(key)
+            return entry[1]
+
+    def _put_memory(self, key: str, value, expires: float):
+        with self._lock:
+            self._mem[key] = (expires, value)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+                EVICTIONS.inc(tier="memory")
+            ENTRIES.set(len(self._mem), tier="memory")
+
+    # ── Disk tier ──
+
+    def _open(self, path: Path) -> sqlite3.Connection:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                   "key TEXT PRIMARY KEY, kind TEXT, stored REAL, expires REAL, value TEXT)")
+        db.execute("CREATE INDEX IF NOT EXISTS responses_stored ON responses (stored)")
+        count = db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        ENTRIES.set(count, tier="disk")
+        log.info("LLM response cache: %s (%d entries on disk)", path, count)
+        return db
+
+    def _get_disk(self, key: str):
+        with self._lock:
+            row = self._db.execute("SELECT expires, value FROM responses WHERE key = ?",
+                                   (key,)).fetchone()
+        if row is None or row[0] < time.time():
+            return None, 0.0
+        return jsonfast.loads(row[1]), row[0]
+
+    def _put_disk(self, key: str, kind: str, value, expires: float):
+        text = jsonfast.dumps(value)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                             (key, kind, time.time(), expires, text))
+            self._writes += 1
+            if self._writes % _DISK_TRIM_EVERY == 0:
+                self._trim_disk()
+
+    def _trim_disk(self):
+        """Drop expired rows, then the oldest beyond disk_max_entries (lock held)."""
+        removed = self._db.execute("DELETE FROM responses WHERE expires < ?",
+                                   (time.time(),)).rowcount
+        count = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.disk_max_entries:
+            removed += self._db.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY stored LIMIT ?)",
+                (count - self.disk_max_entries,)).rowcount
+            count = self.disk_max_entries
+        if removed:
+            EVICTIONS.inc(removed, tier="disk")
+        ENTRIES.set(count, tier="disk")
+
+    # ── API ──
+
+    async def get(self, key: str, kind: str):
+        """Cached result for key, or None. Memory hits do not leave the event loop."""
+        value = self._get_memory(key)
+        if value is not None:
+            LOOKUPS.inc(kind=kind, result="memory")
+            return value
+        if self._db is not None:
+            try:
+                value, expires = await asyncio.to_thread(self._get_disk, key)
+            except (sqlite3.Error, ValueError):
+                log.exception("LLM response cache: disk read failed")
+                value = None
+            if value is not None:
+                self._put_memory(key, value, expires)
+                LOOKUPS.inc(kind=kind, result="disk")
+                return value
+        LOOKUPS.inc(kind=kind, result="miss")
+        return None
+
+    async def put(self, key: str, kind: str, value):
+        """Store a result (JSON-serialisable; shared by later hits, so never mutated)."""
+        if value is None:
+            return
+        expires = time.time() + self.ttl
+        self._put_memory(key, value, expires)
+        if self._db is not None:
+            try:
+                await asyncio.to_thread(self._put_disk, key, kind, value, expires)
+            except sqlite3.Error:
+                log.exception("LLM response cache: disk write failed")
@@ -8,10 +8,13 @@ Outputs:
     - EHR schema JSON (for LLM context)
 """
 
+import copy
 import csv
+import hashlib
 import json
 import sys
 import io
+import re
 from collections import OrderedDict
 
 
@@ -241,6 +244,411 @@ def build_schema(csv_text: str, procedure_type: str = "endoscopy",
     }
 
 
+# ── Schema cache ──
+# Process-wide cache of built schemas keyed by (CSV content hash, procedure
+# type, config hash). Cached schemas are shared by every session that uses the
+# same menu and are frozen (freeze_schema): per-schema caches elsewhere (the
+# serialized prompt segments, retrieval index, fast-path matcher, compiled
+# validator) are only valid as long as the schema never changes.
+
+_SCHEMA_CACHE_MAX = 16
+_schema_cache: OrderedDict = OrderedDict()
+
+
+class _FrozenDict(dict):
+    """dict that refuses in-place changes. Copies (dict(), copy, deepcopy) are plain dicts."""
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("cached schema is read-only; copy it before changing it")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+    def __deepcopy__(self, memo):
+        return {k: copy.deepcopy(v, memo) for k, v in self.items()}
+
+
+class _FrozenList(list):
+    """list that refuses in-place changes. Copies (list(), copy, deepcopy) are plain lists."""
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("cached schema is read-only; copy it before changing it")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = remove = pop = clear = sort = reverse = _read_only
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(v, memo) for v in self]
+
+
+def freeze_schema(obj):
+    """
+    Read-only copy of a schema (nested dicts and lists). The frozen types
+    subclass dict and list, so readers and JSON encoders see no difference;
+    any attempt to modify it raises TypeError.
+    """
+    if isinstance(obj, dict):
+        return _FrozenDict((k, freeze_schema(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return _FrozenList(freeze_schema(v) for v in obj)
+    return obj
+
+
+def content_hash(text: str) -> str:
+    """SHA-256 hex digest of UTF-8 text (same as the browser's crypto.subtle digest)."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def config_hash(config: dict | None, procedure_type: str = "endoscopy") -> str:
+    """Hash of the config section that affects build_schema() for a procedure type."""
+    cfg = config or {}
+    section = cfg.get("colonoscopy" if procedure_type == "colonoscopy" else "endoscopy", {})
+    return content_hash(json.dumps(section, sort_keys=True, ensure_ascii=False, default=str))
+
+
+def get_schema(procedure_type: str = "endoscopy", config: dict | None = None,
+               csv_text: str | None = None,
+               csv_hash: str | None = None) -> tuple[str, dict] | None:
+    """
+    Return (schema_key, schema) from the cache, building it on a miss.
+
+    Either csv_text or csv_hash must be given. With only a hash, a cache miss
+    returns None and the caller must fetch the CSV text. schema_key is a short
+    stable identifier that other modules use to key per-schema caches.
+    """
+    if csv_text:
+        csv_hash = content_hash(csv_text)
+    if not csv_hash:
+        return None
+
+    key = (csv_hash, procedure_type, config_hash(config, procedure_type))
+    entry = _schema_cache.get(key)
+    if entry is not None:
+        _schema_cache.move_to_end(key)
+        return entry
+    if not csv_text:
+        return None
+
+    schema = freeze_schema(build_schema(csv_text, procedure_type=procedure_type, config=config))
+    schema_key = content_hash(":".join(key))[:16]
+    entry = (schema_key, schema)
+    _schema_cache[key] = entry
+    while len(_schema_cache) > _SCHEMA_CACHE_MAX:
+        _schema_cache.popitem(last=False)
+    return entry
+
+
+# ── Compact ID encoding (llm.schema_encoding: ids) ──
+# The menu repeats long names: ~230 section names are used ~360 times and of
+# ~560 attribute lists only ~420 are distinct ("Yes / No" alone recurs 46
+# times). The encoded schema names each disease, section and subsection once
+# and refers to them by short stable IDs; attribute lists are deduplicated
+# into a shared table and an attribute is addressed by its list and position:
+#
+#     "sections":        {"S1": "Size", ...}
+#     "subsections":     {"U1": "Seen", ...}
+#     "attribute_lists": {"a": ["Yes", "No"], "b": ["<5 mm", "5-10 mm", ...], ...}
+#     "diseases": {"D1": {"name": "Gastric Ulcer", "locations": [...], "sections": {
+#         "S1": "b",                                  single-select from list b
+#         "S2": "c*",                                 multi-select from list c
+#         "S3": {"attributes": "a", "subsections": {"U1": "a", "U2": "d if Subsection(Seen=Yes)"}}}}}
+#
+# "b1" is then "5-10 mm". The current state is sent and answered in the same
+# IDs, and SchemaCodec decodes the response (full report, disease entry or
+# patch operation) back to the canonical names before validation. IDs follow
+# schema order, so they are stable for a given menu. Locations, sublocations
+# and conditionals keep their names; a key the codec does not know passes
+# through unchanged (the validator prunes it).
+
+_ID_ATTR_RE = re.compile(r"^([a-z]+)(\d+)$")
+
+_CODEC_CACHE_MAX = 16
+_codec_cache: OrderedDict = OrderedDict()
+
+
+def _list_id(n: int) -> str:
+    """0 → "a", 25 → "z", 26 → "aa", ... (bijective base 26)."""
+    out = ""
+    n += 1
+    while n:
+        n, r = divmod(n - 1, 26)
+        out = chr(ord("a") + r) + out
+    return out
+
+
+def _id_order(ids) -> list[str]:
+    return sorted(ids, key=lambda i: (len(i), i) if i.islower() else (0, int(i[1:])))
+
+
+class SchemaCodec:
+    """ID tables of one schema: encodes schema and report state, decodes LLM output."""
+
+    def __init__(self, schema: dict):
+        self.schema = schema
+        self.disease_ids: dict[str, str] = {}
+        self.section_ids: dict[str, str] = {}
+        self.subsection_ids: dict[str, str] = {}
+        self.lists: dict[str, list[str]] = {}          # list ID → attribute names
+        self._list_ids: dict[tuple, str] = {}          # attribute names → list ID
+        self._attr_ids: dict[str, dict[str, str]] = {}  # list ID → {name: attribute ID}
+        self._node_lists: dict[tuple, str] = {}        # (disease, section[, subsection]) → list ID
+        self._encoded: dict[str, tuple[str, dict, tuple]] = {}  # disease → (ID, entry, tables used)
+
+        for dname, ddef in (schema.get("diseases") or {}).items():
+            did = self.disease_ids[dname] = f"D{len(self.disease_ids) + 1}"
+            used_s, used_u, used_l = [], [], []
+            sections = {}
+            for sname, sdef in (ddef.get("sections") or {}).items():
+                sid = self.section_ids.setdefault(sname, f"S{len(self.section_ids) + 1}")
+                used_s.append(sid)
+                sec = self._encode_spec(sdef, (dname, sname), used_l)
+                if sdef.get("subsections"):
+                    subs = {}
+                    for uname, udef in sdef["subsections"].items():
+                        uid = self.subsection_ids.setdefault(uname, f"U{len(self.subsection_ids) + 1}")
+                        used_u.append(uid)
+                        subs[uid] = self._encode_spec(udef, (dname, sname, uname), used_l)
+                    sec = {"attributes": sec, "subsections": subs} if sec else {"subsections": subs}
+                sections[sid] = sec
+            entry = {"name": dname, "locations": ddef.get("locations", [])}
+            if ddef.get("default_sublocation"):
+                entry["default_sublocation"] = ddef["default_sublocation"]
+            entry["sections"] = sections
+            self._encoded[dname] = (did, entry, (used_s, used_u, used_l))
+
+        self.disease_names = {v: k for k, v in self.disease_ids.items()}
+        self.section_names = {v: k for k, v in self.section_ids.items()}
+        self.subsection_names = {v: k for k, v in self.subsection_ids.items()}
+
+    def _encode_spec(self, spec: dict, node: tuple, used_lists: list) -> str:
+        """Section / subsection as "<list ID>[*][ if <conditional>]" ("*" = multi-select)."""
+        out = ""
+        attrs = spec.get("attributes")
+        if attrs:
+            key = tuple(attrs)
+            lid = self._list_ids.get(key)
+            if lid is None:
+                lid = self._list_ids[key] = _list_id(len(self.lists))
+                self.lists[lid] = list(attrs)
+                self._attr_ids[lid] = {a: f"{lid}{i}" for i, a in enumerate(attrs)}
+            self._node_lists[node] = lid
+            used_lists.append(lid)
+            out = lid
+        if spec.get("multi"):
+            out += "*"
+        if spec.get("conditional"):
+            out += " if " + spec["conditional"]
+        return out
+
+    # ── Schema ──
+
+    def encode_schema(self, schema: dict | None = None) -> dict:
+        """Encoded form of the schema, or of a select_schema() subset of it."""
+        schema = self.schema if schema is None else schema
+        diseases, used_s, used_u, used_l = {}, set(), set(), set()
+        for dname, ddef in (schema.get("diseases") or {}).items():
+            encoded = self._encoded.get(dname)
+            if encoded is None:
+                diseases[dname] = ddef                  # Not from this schema: sent as is
+                continue
+            did, entry, (s, u, l) = encoded
+            diseases[did] = entry
+            used_s.update(s)
+            used_u.update(u)
+            used_l.update(l)
+        return {
+            "locations": schema.get("locations", []),
+            "sublocations": schema.get("sublocations", {}),
+            "sections": {i: self.section_names[i] for i in _id_order(used_s)},
+            "subsections": {i: self.subsection_names[i] for i in _id_order(used_u)},
+            "attribute_lists": {i: self.lists[i] for i in _id_order(used_l)},
+            "diseases": diseases,
+        }
+
+    # ── Report state → IDs ──
+
+    def encode_report(self, report: dict) -> dict:
+        """{location: {diseases: {...}}} with known names replaced by IDs."""
+        if not isinstance(report, dict):
+            return report
+        out = {}
+        for loc, loc_entry in report.items():
+            if isinstance(loc_entry, dict) and isinstance(loc_entry.get("diseases"), dict):
+                loc_entry = dict(loc_entry)
+                loc_entry["diseases"] = {self.disease_ids.get(d, d): self._encode_disease(d, e)
+                                         for d, e in loc_entry["diseases"].items()}
+            out[loc] = loc_entry
+        return out
+
+    def _encode_disease(self, dname: str, entry):
+        if not isinstance(entry, dict) or not isinstance(entry.get("sections"), dict):
+            return entry
+        entry = dict(entry)
+        sections = {}
+        for sname, sec in entry["sections"].items():
+            sec = self._encode_node(sec, (dname, sname))
+            if isinstance(sec, dict) and isinstance(sec.get("subsections"), dict):
+                sec["subsections"] = {self.subsection_ids.get(u, u): self._encode_node(sub, (dname, sname, u))
+                                      for u, sub in sec["subsections"].items()}
+            sections[self.section_ids.get(sname, sname)] = sec
+        entry["sections"] = sections
+        return entry
+
+    def _encode_node(self, node, key: tuple):
+        if not isinstance(node, dict):
+            return node
+        ids = self._attr_ids.get(self._node_lists.get(key), {})
+        node = dict(node)
+        if isinstance(node.get("attrs"), dict):
+            node["attrs"] = {ids.get(a, a): v for a, v in node["attrs"].items()}
+        if isinstance(node.get("inputs"), list):
+            # Pattern and type are implied by the attribute (restored by the decoder / validator)
+            node["inputs"] = [{k: (ids.get(v, v) if k == "rawKey" else v) for k, v in g.items()
+                               if k != "pattern" and not (k == "type" and v == "group")}
+                              if isinstance(g, dict) else g for g in node["inputs"]]
+        return node
+
+    # ── IDs → names (context-free, so partial documents decode too) ──
+
+    def attr_name(self, key):
+        m = _ID_ATTR_RE.match(key) if isinstance(key, str) else None
+        if m:
+            names = self.lists.get(m.group(1))
+            i = int(m.group(2))
+            if names is not None and i < len(names):
+                return names[i]
+        return key
+
+    def decode_report(self, report):
+        if not isinstance(report, dict):
+            return report
+        out = {}
+        for loc, loc_entry in report.items():
+            if isinstance(loc_entry, dict) and isinstance(loc_entry.get("diseases"), dict):
+                loc_entry = dict(loc_entry)
+                loc_entry["diseases"] = dict(self.decode_disease(d, e)
+                                             for d, e in loc_entry["diseases"].items())
+            out[loc] = loc_entry
+        return out
+
+    def decode_disease(self, did: str, entry) -> tuple[str, object]:
+        """(disease name, decoded entry) of an encoded disease entry."""
+        name = self.disease_names.get(did, did)
+        if isinstance(entry, dict):
+            entry = dict(entry)
+            entry.pop("name", None)                     # Echoed from the schema table
+            if isinstance(entry.get("sections"), dict):
+                entry["sections"] = {self.section_names.get(s, s): self._decode_node(sec)
+                                     for s, sec in entry["sections"].items()}
+        return name, entry
+
+    def _decode_node(self, node):
+        if not isinstance(node, dict):
+            return node
+        node = dict(node)
+        if isinstance(node.get("attrs"), dict):
+            node["attrs"] = {self.attr_name(a): v for a, v in node["attrs"].items()}
+        if isinstance(node.get("inputs"), list):
+            node["inputs"] = [self._decode_input(g) for g in node["inputs"]]
+        if isinstance(node.get("subsections"), dict):
+            node["subsections"] = {self.subsection_names.get(u, u): self._decode_node(sub)
+                                   for u, sub in node["subsections"].items()}
+        return node
+
+    def _decode_input(self, group):
+        if not isinstance(group, dict) or "rawKey" not in group:
+            return group
+        group = dict(group)
+        group["rawKey"] = self.attr_name(group["rawKey"])
+        group.setdefault("type", "group")
+        return group
+
+    def _decode_path(self, path):
+        """JSON Pointer with the disease / section / subsection / attribute tokens decoded."""
+        if not isinstance(path, str) or not path.startswith("/report/"):
+            return path
+        tokens = [t.replace("~1", "/").replace("~0", "~") for t in path[1:].split("/")]
+        n = len(tokens)
+        if n > 3 and tokens[2] == "diseases":
+            tokens[3] = self.disease_names.get(tokens[3], tokens[3])
+            if n > 5 and tokens[4] == "sections":
+                tokens[5] = self.section_names.get(tokens[5], tokens[5])
+                i = 6
+                if n > 7 and tokens[6] == "subsections":
+                    tokens[7] = self.subsection_names.get(tokens[7], tokens[7])
+                    i = 8
+                if n > i + 1 and tokens[i] == "attrs":
+                    tokens[i + 1] = self.attr_name(tokens[i + 1])
+        return "/" + "/".join(t.replace("~", "~0").replace("/", "~1") for t in tokens)
+
+    def _decode_value(self, path: str, value):
+        """
+        Decode a patch value by where it goes: it is wrapped in the skeleton
+        of its path, decoded as a report and unwrapped again.
+        """
+        if not isinstance(path, str) or not path.startswith("/report"):
+            return value
+        tokens = path[1:].split("/")[1:]
+        if tokens and tokens[-1] == "rawKey":
+            return self.attr_name(value)
+        wrapped = value
+        for i in range(len(tokens) - 1, -1, -1):
+            if i > 0 and tokens[i - 1] in ("inputs", "sublocations", "values"):
+                wrapped = [wrapped]
+            else:
+                wrapped = {tokens[i]: wrapped}
+        decoded = self.decode_report(wrapped)
+        for _ in tokens:
+            if isinstance(decoded, list) and decoded:
+                decoded = decoded[0]
+            elif isinstance(decoded, dict) and decoded:
+                decoded = next(iter(decoded.values()))
+            else:
+                return value                            # Path into a field the codec drops
+        return decoded
+
+    def decode_op(self, op):
+        """A JSON Patch operation with paths and value decoded."""
+        if not isinstance(op, dict):
+            return op
+        out = dict(op)
+        if "value" in op:
+            out["value"] = self._decode_value(op.get("path"), op["value"])
+        for k in ("path", "from"):
+            if k in op:
+                out[k] = self._decode_path(op[k])
+        return out
+
+    def decode_result(self, result: dict) -> dict:
+        """A parsed call_llm result ({report, overallRemarks} or {patch}) in canonical names."""
+        if isinstance(result.get("patch"), list):
+            return {**result, "patch": [self.decode_op(op) for op in result["patch"]]}
+        if "report" in result:
+            return {**result, "report": self.decode_report(result["report"])}
+        return result
+
+
+def get_codec(schema: dict, schema_key: str | None = None) -> SchemaCodec:
+    """SchemaCodec of a schema, cached by schema_key (or identity) — schemas are immutable."""
+    key = schema_key if schema_key is not None else id(schema)
+    codec = _codec_cache.get(key)
+    if codec is not None and codec.schema is schema:
+        _codec_cache.move_to_end(key)
+        return codec
+    codec = _codec_cache[key] = SchemaCodec(schema)
+    while len(_codec_cache) > _CODEC_CACHE_MAX:
+        _codec_cache.popitem(last=False)
+    return codec
+
+
 # ── CLI ──
 
 def main():
@@ -0,0 +1,196 @@
+"""
+Schema Retrieval — Picks the diseases relevant to a transcript batch.
+
+A sparse TF-IDF index over word tokens and character trigrams is built once
+per schema from disease names, section/subsection names and attribute values.
+Each LLM call scores the diseases against the transcript and the prompt then
+carries only the top-k matches plus the diseases already in the report.
+
+The index is a plain inverted index (term → postings), so scoring touches only
+the postings of the transcript's terms and needs no numeric dependencies.
+"""
+
+import logging
+import math
+import re
+from collections import OrderedDict, defaultdict
+
+log = logging.getLogger("ehr-voice")
+
+# ── Defaults (overridden by llm_config dict) ──
+_DEFAULT_TOP_K = 8
+_DEFAULT_FULL_FALLBACK = True
+
+_DEFAULT_MIN_SCORE = 0.08
+
+# Relative weight of each schema field in a disease's document
+_FIELD_WEIGHTS = {"disease": 3.0, "section": 1.5, "attribute": 1.0, "location": 0.5}
+_TRIGRAM_WEIGHT = 0.4
+
+# Input-box placeholders carry no meaning for retrieval
+_BOX_RE = re.compile(r"(int|float|alphanum)_box")
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOP_WORDS = {
+    "a", "an", "the", "is", "are", "was", "there", "this", "that", "of", "in", "on",
+    "at", "to", "with", "and", "or", "it", "its", "seen", "see", "noted", "also",
+    "some", "we", "i", "has", "have", "be", "as", "for", "from", "by",
+}
+
+_INDEX_CACHE_MAX = 16
+_index_cache: OrderedDict = OrderedDict()
+
+
+def _terms(text: str) -> list[tuple[str, float]]:
+    """
+    Weighted word tokens plus character trigrams of longer words.
+
+    Trigrams tolerate plurals and ASR spelling drift ("ulcers", "varix").
+    """
+    words = [w for w in _TOKEN_RE.findall(_BOX_RE.sub(" ", text.lower()))
+             if w not in _STOP_WORDS]
+    terms = [("w:" + w, 1.0) for w in words]
+    for w in words:
+        if len(w) > 3:
+            padded = f" {w} "
+            terms.extend(("c:" + padded[i:i + 3], _TRIGRAM_WEIGHT)
+                         for i in range(len(padded) - 2))
+    return terms
+
+
+def _location_words(schema: dict, loc: str) -> list[str]:
+    """A location name plus its sublocation/region names."""
+    words = [loc]
+    sub = schema.get("sublocations", {}).get(loc)
+    if isinstance(sub, dict):
+        words.extend(r for r in sub if not r.startswith("_"))
+        words.extend(sub.get("_standalone", []))
+    elif isinstance(sub, list):
+        words.extend(sub)
+    return words
+
+
+def _disease_fields(schema: dict, ddef: dict, name: str):
+    """Yield (field, text) pairs describing one disease."""
+    yield "disease", name
+    for loc in ddef.get("locations", []):
+        for w in _location_words(schema, loc):
+            yield "location", w
+    for sname, sdef in ddef.get("sections", {}).items():
+        yield "section", sname
+        for a in sdef.get("attributes", []):
+            yield "attribute", a
+        for subname, subdef in sdef.get("subsections", {}).items():
+            yield "section", subname
+            for a in subdef.get("attributes", []):
+                yield "attribute", a
+
+
+class SchemaIndex:
+    """TF-IDF inverted index over the diseases of one schema."""
+
+    def __init__(self, schema: dict):
+        self.names = list(schema.get("diseases", {}).keys())
+        raw_docs = []
+        df = defaultdict(int)
+        for name in self.names:
+            tf = defaultdict(float)
+            for field, text in _disease_fields(schema, schema["diseases"][name], name):
+                weight = _FIELD_WEIGHTS[field]
+                for t, tw in _terms(text):
+                    tf[t] += weight * tw
+            raw_docs.append(tf)
+            for t in tf:
+                df[t] += 1
+
+        n = len(self.names)
+        self.idf = {t: math.log((n + 1) / (c + 1)) + 1.0 for t, c in df.items()}
+
+        self.postings = defaultdict(list)
+        for idx, tf in enumerate(raw_docs):
+            vec = {t: math.log1p(w) * self.idf[t] for t, w in tf.items()}
+            norm = math.sqrt(sum(v * v for v in vec.values())) or 1.0
+            for t, v in vec.items():
+                self.postings[t].append((idx, v / norm))
+
+    def score(self, text: str) -> list[tuple[str, float]]:
+        """Return (disease, cosine score) pairs with a positive score, best first."""
+        tf = defaultdict(float)
+        for t, tw in _terms(text):
+            if t in self.idf:
+                tf[t] += tw
+        if not tf:
+            return []
+        qvec = {t: math.log1p(w) * self.idf[t] for t, w in tf.items()}
+        qnorm = math.sqrt(sum(v * v for v in qvec.values())) or 1.0
+
+        scores = defaultdict(float)
+        for t, qv in qvec.items():
+            for idx, dv in self.postings[t]:
+                scores[idx] += qv * dv
+        ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+        return [(self.names[idx], s / qnorm) for idx, s in ranked]
+
+
+def get_index(schema: dict, schema_key: str | None = None) -> SchemaIndex:
+    """Return the index for a schema, built once per schema_key."""
+    if schema_key is None:
+        return SchemaIndex(schema)
+    index = _index_cache.get(schema_key)
+    if index is None:
+        index = SchemaIndex(schema)
+        _index_cache[schema_key] = index
+        while len(_index_cache) > _INDEX_CACHE_MAX:
+            _index_cache.popitem(last=False)
+        log.info("Schema retrieval index built: %d diseases, %d terms",
+                 len(index.names), len(index.idf))
+    else:
+        _index_cache.move_to_end(schema_key)
+    return index
+
+
+def _report_diseases(current_report: dict | None) -> set[str]:
+    names = set()
+    for loc_entry in (current_report or {}).values():
+        if isinstance(loc_entry, dict):
+            names.update((loc_entry.get("diseases") or {}).keys())
+    return names
+
+
+def select_schema(schema: dict, transcript: str, current_report: dict | None = None,
+                  llm_config: dict | None = None,
+                  schema_key: str | None = None) -> tuple[dict, bool]:
+    """
+    Reduce the schema to the diseases relevant to a transcript.
+
+    Returns (schema, is_subset). The subset keeps locations and sublocations,
+    the top-k scored diseases and every disease already present in the report,
+    in schema order. With llm.schema_top_k <= 0, or when no disease reaches
+    llm.schema_min_score and llm.schema_full_fallback is set, the full schema
+    is returned unchanged.
+    """
+    cfg = llm_config or {}
+    top_k = cfg.get("schema_top_k", _DEFAULT_TOP_K)
+    full_fallback = cfg.get("schema_full_fallback", _DEFAULT_FULL_FALLBACK)
+    min_score = cfg.get("schema_min_score", _DEFAULT_MIN_SCORE)
+    diseases = schema.get("diseases", {})
+    if top_k <= 0 or len(diseases) <= top_k:
+        return schema, False
+
+    ranked = [(n, sc) for n, sc in get_index(schema, schema_key).score(transcript)
+              if sc >= min_score]
+    if not ranked and full_fallback:
+        log.info("Schema retrieval: no match, sending full schema")
+        return schema, False
+
+    keep = {name for name, _ in ranked[:top_k]}
+    keep.update(n for n in _report_diseases(current_report) if n in diseases)
+
+    subset = {
+        "locations": schema.get("locations", []),
+        "sublocations": schema.get("sublocations", {}),
+        "diseases": {n: d for n, d in diseases.items() if n in keep},
+    }
+    log.info("Schema retrieval: %d/%d diseases (top: %s)",
+             len(subset["diseases"]), len(diseases),
+             ", ".join(name for name, _ in ranked[:3]))
+    return subset, True
@@ -7,13 +7,18 @@ real-time voice dictation → ASR → LLM → EHR JSON updates.
 Usage:
     python server.py                    # Start on port 8000
     python server.py --port 9000        # Custom port
+    EHR_CONFIG=other.yaml python server.py   # Alternate config file
 
 Then open http://localhost:8000 in Chrome.
 """
 
 import asyncio
-import json
+import functools
 import logging
+import os
+import secrets
+import threading
+import time
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Optional
@@ -25,8 +30,15 @@ from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.websockets import WebSocketState
 
-from schema_builder import build_schema
-from models import validate_llm_response
+from schema_builder import get_schema
+from report_validator import validate_report
+from json_patch import JsonPatchError, MergeConflict, apply_patch, make_patch, merge
+import fast_path
+import jsonfast
+from voice_commands import CommandEngine
+from audio_buffer import AudioRingBuffer
+from phrase_hints import get_phrase_hints
+from metrics import REGISTRY, Trace
 
 # ── Logging ──
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -35,8 +47,7 @@ log = logging.getLogger("ehr-voice")
 # ── Paths ──
 PROJECT_DIR = Path(__file__).parent
 SRC_DIR = PROJECT_DIR / "src"
-PHRASESET_FILE = PROJECT_DIR / "endoscopy_phraseset.txt"
-CONFIG_FILE = PROJECT_DIR / "config.yaml"
+CONFIG_FILE = Path(os.environ.get("EHR_CONFIG") or PROJECT_DIR / "config.yaml")
 
 
 def _load_config() -> dict:
@@ -47,10 +58,10 @@ def _load_config() -> dict:
     try:
         with open(CONFIG_FILE, "r", encoding="utf-8") as f:
             cfg = yaml.safe_load(f) or {}
-        log.info("Loaded config.yaml")
+        log.info("Loaded %s", CONFIG_FILE.name)
         return cfg
     except Exception as e:
-        log.warning("Failed to load config.yaml: %s", e)
+        log.warning("Failed to load %s: %s", CONFIG_FILE.name, e)
         return {}
 
 
@@ -60,33 +71,54 @@ APP_CONFIG = _load_config()
 _voice_cfg = APP_CONFIG.get("voice", {})
 _asr_cfg = APP_CONFIG.get("asr", {})
 _llm_cfg = APP_CONFIG.get("llm", {})
+_sentences_cfg = APP_CONFIG.get("sentences", {}) or {}
 
 FILLER_WORDS = set(_voice_cfg.get("filler_words",
     ["um", "uh", "ah", "okay", "ok", "so", "like", "yeah", "yes", "hmm", "hm"]))
 
-_cmd_cfg = _voice_cfg.get("commands", {})
-VOICE_COMMANDS = set(
-    _cmd_cfg.get("pause", ["pause dictation", "stop recording", "pause"])
-    + _cmd_cfg.get("resume", ["resume dictation", "start recording", "resume"])
-    + _cmd_cfg.get("capture_photo", ["capture photo", "take photo", "take picture", "take a photo"])
-)
-_PAUSE_CMDS = set(_cmd_cfg.get("pause", ["pause dictation", "stop recording", "pause"]))
-_RESUME_CMDS = set(_cmd_cfg.get("resume", ["resume dictation", "start recording", "resume"]))
-_CAPTURE_CMDS = set(_cmd_cfg.get("capture_photo",
-    ["capture photo", "take photo", "take picture", "take a photo"]))
+COMMAND_ENGINE = CommandEngine.from_config(_voice_cfg, fillers=FILLER_WORDS)
 
+AUDIO_WARN_INTERVAL = 5.0          # Seconds between audio-overflow warnings
 DEBOUNCE_SECONDS = _voice_cfg.get("debounce_seconds", 1.5)
-
-
-def _load_phrase_hints() -> list[str]:
-    """Load phrase hints from endoscopy_phraseset.txt (one phrase per line)."""
-    if not PHRASESET_FILE.exists():
-        log.warning("Phrase set file not found: %s", PHRASESET_FILE)
-        return []
-    lines = PHRASESET_FILE.read_text(encoding="utf-8").splitlines()
-    hints = [line.strip() for line in lines if line.strip()]
-    log.info("Loaded %d phrase hints from %s", len(hints), PHRASESET_FILE.name)
-    return hints
+MAX_INFLIGHT_LLM = max(1, int(_voice_cfg.get("max_inflight_llm", 1)))
+FAST_PATH = bool(_voice_cfg.get("fast_path", True))
+SPEECH_END_DISPATCH = bool(_voice_cfg.get("dispatch_on_speech_end", True))
+SPECULATIVE = bool(_voice_cfg.get("speculative", False))
+SPECULATIVE_STABLE_SECONDS = _voice_cfg.get("speculative_stable_ms", 400) / 1000.0
+RESUME_GRACE_SECONDS = max(0.0, float(_voice_cfg.get("resume_grace_seconds", 60)))
+LLM_STREAM = bool(_llm_cfg.get("stream", False))
+
+
+# Static phrase files per procedure, merged with schema-derived hints
+PHRASE_FILES = {proc: PROJECT_DIR / name for proc, name in
+                _asr_cfg.get("phrase_files", {"endoscopy": "endoscopy_phraseset.txt"}).items()}
+MAX_PHRASES = _asr_cfg.get("max_phrases_per_set", 1200)
+
+# ── Metrics (rendered by /metrics) ──
+STAGE_SECONDS = REGISTRY.histogram(
+    "ehr_voice_stage_seconds", "Time per pipeline stage of a dictation batch (see metrics.py)", ("stage",))
+LLM_CALLS = REGISTRY.counter("ehr_voice_llm_calls_total", "LLM calls by outcome", ("outcome",))
+LLM_REDISPATCHES = REGISTRY.counter("ehr_voice_llm_redispatches_total",
+                                    "LLM batches re-run after their result conflicted with the report")
+GARBAGE_SKIPS = REGISTRY.counter("ehr_voice_garbage_skipped_total", "Batches skipped as too short or filler")
+VALIDATION_FAILURES = REGISTRY.counter("ehr_voice_validation_failures_total",
+                                       "LLM responses rejected by validation")
+VOICE_COMMANDS = REGISTRY.counter("ehr_voice_commands_total", "Voice commands detected", ("command",))
+FAST_PATH_RESULTS = REGISTRY.counter("ehr_voice_fast_path_total", "Fast path attempts", ("result",))
+PROVISIONAL_UPDATES = REGISTRY.counter("ehr_voice_provisional_updates_total",
+                                       "Provisional report updates sent from streamed LLM responses")
+FIRST_UPDATE_SECONDS = REGISTRY.histogram(
+    "ehr_voice_first_update_seconds", "ASR final to the first provisional update of a batch")
+SESSIONS_STARTED = REGISTRY.counter("ehr_voice_sessions_total", "Voice sessions started")
+SESSIONS_OPEN = REGISTRY.gauge("ehr_voice_sessions_open", "Voice sessions currently open")
+SESSIONS_DETACHED = REGISTRY.gauge("ehr_voice_sessions_detached",
+                                   "Open voice sessions waiting for their client to reconnect")
+SESSION_RESUMES = REGISTRY.counter("ehr_voice_session_resumes_total",
+                                   "Session resume requests by result (resumed|expired)", ("result",))
+AUDIO_DROPPED = REGISTRY.counter("ehr_voice_audio_dropped_seconds_total",
+                                 "Audio dropped because a session buffer was full")
+AUDIO_BUFFERED = REGISTRY.gauge("ehr_voice_audio_buffered_seconds",
+                                "Audio waiting for ASR over open sessions", ("agg",))
 
 # ── App ──
 app = FastAPI(title="Endoscopy EHR Voice Server")
@@ -186,12 +218,50 @@ async def serve_config():
     })
 
 
+# ── Metrics API ──
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of the counters, gauges and stage histograms."""
+    buffered = [s.audio_buffer.stats()["fill_ms"] / 1000 for s in _open_sessions.values()]
+    AUDIO_BUFFERED.set(sum(buffered), agg="sum")
+    AUDIO_BUFFERED.set(max(buffered, default=0.0), agg="max")
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 # ── Sentences Report API ──
 
 
+SENTENCES_MODES = ("llm", "local", "local-then-llm-polish")
+SENTENCES_MODE = _sentences_cfg.get("mode", "llm")
+if SENTENCES_MODE not in SENTENCES_MODES:
+    log.warning("Unknown sentences.mode %r, using 'llm'", SENTENCES_MODE)
+    SENTENCES_MODE = "llm"
+
+
+def _render_local_report(body: dict, report_data: dict) -> str:
+    """Template-rendered sentences report, in the menu's order when the schema is cached."""
+    from report_renderer import render_sentences_report
+    schema = None
+    csv_hash = body.get("csv_hash")
+    if csv_hash:
+        entry = get_schema(body.get("procedure_type") or "endoscopy", APP_CONFIG, csv_hash=csv_hash)
+        if entry is not None:
+            schema = entry[1]
+    return render_sentences_report(report_data, schema=schema,
+                                   templates=_sentences_cfg.get("templates"))
+
+
 @app.post("/api/generate-report")
 async def api_generate_report(request: Request):
-    """Generate a natural-language sentences report from structured EHR JSON."""
+    """
+    Generate a natural-language sentences report from structured EHR JSON.
+
+    sentences.mode selects how: "llm" (one model call), "local" (report_renderer
+    templates, no network) or "local-then-llm-polish" — the local draft is
+    returned at once with "polish": true, and the client asks again with
+    "stage": "polish" for the model's rewording of that draft.
+    """
     try:
         body = await request.json()
     except Exception:
@@ -201,12 +271,28 @@ async def api_generate_report(request: Request):
     if not report_data or not isinstance(report_data, dict):
         return JSONResponse(status_code=400, content={"error": "Missing or invalid 'report_data'"})
 
+    polish_stage = SENTENCES_MODE == "local-then-llm-polish" and body.get("stage") == "polish"
+    if SENTENCES_MODE != "llm" and not polish_stage:
+        try:
+            html = _render_local_report(body, report_data)
+        except Exception as e:
+            log.exception("Local sentences report failed")
+            return JSONResponse(status_code=500, content={"error": str(e)})
+        content = {"html": html, "source": "local"}
+        if SENTENCES_MODE == "local-then-llm-polish" and html:
+            content["polish"] = True
+        return JSONResponse(content=content)
+
     try:
-        from llm_caller import generate_sentences_report
-        result = await generate_sentences_report(report_data, llm_config=_llm_cfg)
+        from llm_caller import generate_sentences_report, polish_sentences_report
+        if polish_stage:
+            result = await polish_sentences_report(_render_local_report(body, report_data),
+                                                   llm_config=_llm_cfg)
+        else:
+            result = await generate_sentences_report(report_data, llm_config=_llm_cfg)
         if result is None:
             return JSONResponse(status_code=500, content={"error": "LLM returned empty response"})
-        return JSONResponse(content={"html": result})
+        return JSONResponse(content={"html": result, "source": "llm"})
     except ImportError:
         return JSONResponse(status_code=500, content={"error": "LLM module not available"})
     except Exception as e:
@@ -216,24 +302,58 @@ async def api_generate_report(request: Request):
 
 # ── Session state per WebSocket connection ──
 
+def _new_audio_buffer() -> AudioRingBuffer:
+    return AudioRingBuffer(
+        sample_rate=_asr_cfg.get("sample_rate", 16000),
+        chunk_ms=_asr_cfg.get("chunk_ms", 100),
+        capacity_seconds=_asr_cfg.get("buffer_seconds", 10),
+    )
+
+
 @dataclass
 class SessionState:
-    """Per-WebSocket-connection state."""
-    audio_queue: asyncio.Queue = field(default_factory=asyncio.Queue)
+    """
+    Per-dictation-session state.
+
+    A session outlives its WebSocket connection: after a disconnect it is
+    detached (ws None, ASR paused) for voice.resume_grace_seconds and a
+    reconnecting client reattaches to it with {"type": "resume"}.
+    """
+    session_id: str = field(default_factory=lambda: secrets.token_urlsafe(16))
+    ws: Optional[WebSocket] = None        # Attached connection; None while detached
+    audio_buffer: AudioRingBuffer = field(default_factory=_new_audio_buffer)
     transcript_queue: asyncio.Queue = field(default_factory=asyncio.Queue)
 
     current_report: dict = field(default_factory=dict)
     overall_remarks: str = ""
-    ehr_schema: Optional[dict] = None
+    ehr_schema: Optional[dict] = None     # Shared via the schema cache — read-only
+    schema_key: Optional[str] = None
     phrase_hints: list = field(default_factory=list)
+    phrase_hints_key: Optional[str] = None   # Shared hint list's schema_key (ASR config cache key)
     procedure_type: str = "endoscopy"
 
     paused: bool = False           # Voice pause command active
     llm_busy: bool = False
+    report_version: int = 0        # Bumped on every change to current_report
+    batch_seq: int = 0
+    inflight: list = field(default_factory=list)  # _LLMBatch, in dispatch order
+    patch_sync: bool = False       # Client takes report_patch / sends report_patch (init capability)
+    timing: bool = False           # Client wants per-stage timing on report updates (init flag)
+    active: Optional[dict] = None  # {"loc", "disease"} — mirrors the frontend's active disease
+    audio_warned_at: float = 0.0   # Last audio-overflow warning sent to the client
+    fast_hits: int = 0
+    fast_misses: int = 0
+    spec_hits: int = 0             # Speculative calls whose result was used
+    spec_wasted: int = 0           # Speculative calls cancelled (final differed)
     cancel_event: asyncio.Event = field(default_factory=asyncio.Event)
+    asr_paused: threading.Event = field(default_factory=threading.Event)  # Set while detached
+    expiry: Optional[asyncio.Task] = None  # Grace timer while detached
     tasks: list = field(default_factory=list)
 
 
+_open_sessions: dict[str, SessionState] = {}   # session_id → session (attached or detached)
+
+
 def is_garbage(text: str) -> bool:
     """Check if transcript is too short/filler to warrant an LLM call."""
     words = [w for w in text.lower().split() if w not in FILLER_WORDS]
@@ -241,238 +361,711 @@ def is_garbage(text: str) -> bool:
 
 
 def detect_voice_command(text: str) -> Optional[str]:
-    """Check if transcript matches a known voice command."""
-    normalized = text.strip().lower().rstrip(".")
-    for cmd in VOICE_COMMANDS:
-        if cmd in normalized:
-            return cmd
-    return None
+    """Return the command ("pause", "resume", "capture_photo") spoken in text, if any."""
+    match = COMMAND_ENGINE.match(text)
+    if match is None:
+        return None
+    log.debug("Voice command %s (%r, confidence %.2f)", match.command, match.phrase, match.confidence)
+    return match.command
 
 
-async def send_safe(ws: WebSocket, data: dict):
-    """Send JSON to WebSocket, ignoring errors if connection is closing."""
+async def send_safe(ws: Optional[WebSocket], data: dict):
+    """Send JSON to WebSocket, ignoring errors if connection is closing (or detached: ws None)."""
     try:
-        if ws.client_state == WebSocketState.CONNECTED:
-            await ws.send_text(json.dumps(data))
+        if ws is not None and ws.client_state == WebSocketState.CONNECTED:
+            await ws.send_text(jsonfast.dumps(data))
     except Exception:
         pass
 
 
+async def _warn_audio_overflow(session: SessionState, dropped: int):
+    """Tell the client audio is being dropped (STT falling behind), at most every few seconds."""
+    now = time.monotonic()
+    if now - session.audio_warned_at < AUDIO_WARN_INTERVAL:
+        return
+    session.audio_warned_at = now
+    stats = session.audio_buffer.stats()
+    log.warning("Audio buffer overflow: dropped %d ms so far (%s)", stats["dropped_ms"], stats)
+    await send_safe(session.ws, {
+        "type": "warning",
+        "message": f"Speech recognition is falling behind — {stats['dropped_ms']} ms of audio dropped",
+    })
+
+
 # ── Transcript Batcher ──
 
-async def transcript_batcher(ws: WebSocket, session: SessionState):
+@dataclass
+class _LLMBatch:
+    """An in-flight LLM call, tagged with the report version it was based on."""
+    seq: int
+    batch_text: str
+    base: dict                    # {report, overallRemarks} the call was based on
+    base_version: int
+    task: asyncio.Task
+    trace: Trace
+    provisional: Optional[list] = None   # Ops of the last provisional update sent (llm.stream)
+    redispatched: bool = False    # Re-run once after its result conflicted with the report
+
+
+@dataclass
+class _Speculation:
+    """An LLM call started early on a stable interim transcript."""
+    interim: str                  # The stable interim transcript
+    batch_text: str               # Accumulated finals + the interim text
+    base: dict
+    base_version: int
+    task: asyncio.Task
+    trace: Trace                  # Started with the call; re-based on the final when adopted
+
+
+def _normalize_utterance(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace for transcript comparison."""
+    return " ".join("".join(c if c.isalnum() else " " for c in text.lower()).split())
+
+
+def _report_state(session: SessionState) -> dict:
+    """Snapshot of the session report as the {report, overallRemarks} document."""
+    return {
+        "report": session.current_report or {},
+        "overallRemarks": session.overall_remarks or "",
+    }
+
+
+def _cancel_speculation(session: SessionState, spec: Optional[_Speculation], reason: str):
+    """Cancel an in-flight speculative call (or drop its finished result) and count it as wasted."""
+    if spec is None:
+        return
+    session.spec_wasted += 1
+    if spec.task.done():
+        # Retrieve the outcome so a failed call is not reported as never retrieved
+        failed = not spec.task.cancelled() and spec.task.exception() is not None
+        LLM_CALLS.inc(outcome="error" if failed else "cancelled")
+    else:
+        spec.task.cancel()
+        LLM_CALLS.inc(outcome="cancelled")
+    log.info("Speculation wasted (%s) — hits=%d wasted=%d",
+             reason, session.spec_hits, session.spec_wasted)
+
+
+def _llm_calls(session: SessionState, spec: Optional[_Speculation]) -> int:
+    """LLM calls running for the session: in-flight batches plus a pending speculation."""
+    return len(session.inflight) + (spec is not None)
+
+
+def _settle_speculation(session: SessionState, spec: Optional[_Speculation],
+                        batch_text: str) -> Optional[_Speculation]:
+    """The speculation to adopt for batch_text, or None after cancelling one that does not match."""
+    if spec is None:
+        return None
+    if _normalize_utterance(batch_text) == _normalize_utterance(spec.batch_text):
+        return spec
+    _cancel_speculation(session, spec, "final differs")
+    return None
+
+
+async def transcript_batcher(session: SessionState):
     """
     Consumes transcript_queue, debounces rapid finals, calls LLM, sends results.
 
     State machine:
     - IDLE: waiting for transcripts
     - DEBOUNCING: received a final, waiting for more finals or timeout
-    - LLM_BUSY: sent to LLM, accumulating new transcripts for next batch
+    - READY: debounce elapsed (or ASR reported end of speech), waiting for a
+      free LLM slot
+
+    With voice.dispatch_on_speech_end, the ASR's SPEECH_ACTIVITY_END event
+    ({"speech_event": "end"}) makes the batch ready as soon as the utterance's
+    final is in; the debounce timer only covers streams without those events.
+
+    Up to voice.max_inflight_llm calls run concurrently. Each is tagged with
+    the report version it was based on; results are applied strictly in
+    dispatch order and rebased onto the latest report when it has moved on
+    (see _apply_llm_result). Completed calls wake the batcher through an
+    {"llm_done": seq} queue message.
+
+    With voice.speculative enabled, an interim transcript that stays unchanged
+    for voice.speculative_stable_ms starts the LLM call early; it takes one of
+    the max_inflight_llm slots. If the final matches the speculated text the
+    batch is ready at once (no debounce). Whenever a batch is dispatched, the
+    speculation is settled first (_settle_speculation): adopted if it covers
+    exactly the batch's text, cancelled otherwise, so no text is sent twice.
     """
+    loop = asyncio.get_running_loop()
     accumulated = []
+    deadline = None                # Debounce deadline while finals are accumulating
+    batch_ready = False            # Debounce elapsed, waiting for an LLM slot
+    interim_text = ""              # Latest interim transcript
+    interim_at = 0.0               # When interim_text last changed
+    speaking = True                # False between ASR speech-end and speech-begin events
+    spec: Optional[_Speculation] = None
+    speech_end_t = None            # When the ASR reported the current speech end
+    final_t = final_seen = 0.0     # Last final: posted by the ASR / seen by the batcher
+    asr_lag = None                 # Speech end → last final, if the end came first
 
     while not session.cancel_event.is_set():
+        # A pending speculation is adopted by or cancelled for this batch, so
+        # its slot passes to the batch
+        if batch_ready and len(session.inflight) < MAX_INFLIGHT_LLM:
+            batch_text = " ".join(accumulated)
+            await _dispatch_batch(session, batch_text, _batch_trace(final_t, final_seen, asr_lag),
+                                  spec=_settle_speculation(session, spec, batch_text))
+            spec = None
+            accumulated = []
+            batch_ready = False
+
+        now = loop.time()
+        timeout = 1.0
+        if deadline is not None:
+            timeout = min(timeout, max(0.0, deadline - now))
+        if SPECULATIVE and interim_text and spec is None:
+            timeout = min(timeout, max(0.0, interim_at + SPECULATIVE_STABLE_SECONDS - now))
+
         try:
             msg = await asyncio.wait_for(
-                session.transcript_queue.get(), timeout=1.0
+                session.transcript_queue.get(), timeout=timeout
             )
         except asyncio.TimeoutError:
+            now = loop.time()
+            if (SPECULATIVE and spec is None and interim_text and not session.paused
+                    and not batch_ready and _llm_calls(session, spec) < MAX_INFLIGHT_LLM
+                    and now - interim_at >= SPECULATIVE_STABLE_SECONDS):
+                spec = _start_speculation(session, accumulated, interim_text)
+                interim_text = ""
+            if deadline is not None and now >= deadline:
+                deadline = None
+                batch_ready = True
             continue
 
         if "flush" in msg:
             # Stop signal — process remaining accumulated text and exit
             break
 
+        if "speech_event" in msg:
+            speaking = msg["speech_event"] == "begin"
+            speech_end_t = None if speaking else msg.get("t", time.monotonic())
+            # Speech ended and its final is already in: dispatch without waiting
+            # for the debounce. If an interim is still pending, its final will.
+            if (not speaking and SPEECH_END_DISPATCH and accumulated
+                    and not interim_text and spec is None and not batch_ready):
+                log.debug("Speech end — dispatching without debounce")
+                deadline = None
+                batch_ready = True
+            continue
+
+        if "llm_done" in msg:
+            await _apply_finished_batches(session)
+            continue
+
         if "error" in msg:
-            await send_safe(ws, {"type": "error", "message": msg["error"]})
+            await send_safe(session.ws, {"type": "error", "message": msg["error"]})
             continue
 
         if "info" in msg:
-            await send_safe(ws, {"type": "info", "message": msg["info"]})
+            await send_safe(session.ws, {"type": "info", "message": msg["info"]})
             continue
 
         # Forward interim transcripts to frontend for display
         if not msg.get("is_final"):
-            await send_safe(ws, {
+            await send_safe(session.ws, {
                 "type": "interim_transcript",
                 "text": msg["text"],
             })
+            if (spec is not None and
+                    _normalize_utterance(msg["text"]) != _normalize_utterance(spec.interim)):
+                _cancel_speculation(session, spec, "interim changed")
+                spec = None
+            if msg["text"] != interim_text:
+                interim_text = msg["text"]
+                interim_at = loop.time()
             continue
 
         final_text = msg["text"]
+        interim_text = ""
+        final_seen = time.monotonic()
+        final_t = msg.get("t", final_seen)
+        asr_lag = final_t - speech_end_t if speech_end_t is not None else None
 
         # Check for voice commands BEFORE accumulating
         cmd = detect_voice_command(final_text)
         if cmd:
-            await _handle_voice_command(ws, session, cmd, final_text)
+            _cancel_speculation(session, spec, "voice command")
+            spec = None
+            await _handle_voice_command(session, cmd, final_text)
             continue
 
         # Send final transcript to frontend for display
-        await send_safe(ws, {"type": "final_transcript", "text": final_text})
+        await send_safe(session.ws, {"type": "final_transcript", "text": final_text})
 
         # If paused, don't accumulate for LLM
         if session.paused:
+            _cancel_speculation(session, spec, "paused")
+            spec = None
             continue
 
         accumulated.append(final_text)
 
-        # Debounce: keep collecting finals until silence
-        while True:
-            try:
-                msg2 = await asyncio.wait_for(
-                    session.transcript_queue.get(),
-                    timeout=DEBOUNCE_SECONDS,
-                )
-                if "flush" in msg2:
-                    break
-                if "error" in msg2 or "info" in msg2:
-                    continue
-                if not msg2.get("is_final"):
-                    await send_safe(ws, {
-                        "type": "interim_transcript",
-                        "text": msg2["text"],
-                    })
-                    continue
-
-                final2 = msg2["text"]
-                cmd2 = detect_voice_command(final2)
-                if cmd2:
-                    await _handle_voice_command(ws, session, cmd2, final2)
-                    continue
-
-                await send_safe(ws, {"type": "final_transcript", "text": final2})
-                if not session.paused:
-                    accumulated.append(final2)
-
-            except asyncio.TimeoutError:
-                break
-
-        if not accumulated:
-            continue
+        if spec is not None:
+            spec = _settle_speculation(session, spec, " ".join(accumulated))
+            if spec is not None:
+                deadline = None
+                batch_ready = True        # Adopted when dispatched at the top of the loop
+                continue
+
+        # Debounce: keep collecting finals until silence. A final arriving after
+        # the ASR already reported end of speech is dispatched right away.
+        if not batch_ready:
+            if SPEECH_END_DISPATCH and not speaking:
+                deadline = None
+                batch_ready = True
+            else:
+                deadline = loop.time() + DEBOUNCE_SECONDS
 
-        # Batch text and send to LLM
+    # Flush: process any remaining accumulated text, then wait for in-flight calls
+    if accumulated:
         batch_text = " ".join(accumulated)
-        accumulated = []
+        log.info("Batcher flushing final batch: %s", batch_text[:80])
+        await _dispatch_batch(session, batch_text, _batch_trace(final_t, final_seen, asr_lag),
+                              spec=_settle_speculation(session, spec, batch_text))
+    else:
+        _cancel_speculation(session, spec, "session ending")
+    if session.inflight:
+        await asyncio.wait([b.task for b in session.inflight])
+        await _apply_finished_batches(session)
+
+    if FAST_PATH and session.fast_hits + session.fast_misses:
+        log.info("Fast path stats: hits=%d misses=%d",
+                 session.fast_hits, session.fast_misses)
+    if SPECULATIVE:
+        log.info("Speculation stats: hits=%d wasted=%d", session.spec_hits, session.spec_wasted)
+    log.info("Batcher exiting")
 
-        if is_garbage(batch_text):
-            log.debug("Skipping garbage transcript: %s", batch_text[:80])
-            continue
 
+def _batch_trace(final_t: float, seen_t: float, asr_lag: Optional[float]) -> Trace:
+    """Trace for a batch, starting at its last ASR final."""
+    trace = Trace(origin=final_t)
+    if asr_lag is not None:
+        trace.add("asr", asr_lag)
+    trace.mark("queue", at=seen_t)
+    return trace
+
+
+def _pending_context(session: SessionState) -> str:
+    """Transcripts of calls still in flight, as context for the next call."""
+    return " ".join(b.batch_text for b in session.inflight)
+
+
+def _partial_sender(session: SessionState):
+    """on_partial callback for a streamed LLM call, or None when streaming is off."""
+    return functools.partial(_publish_provisional, session) if LLM_STREAM else None
+
+
+def _start_speculation(session: SessionState, accumulated: list,
+                       interim_text: str) -> Optional[_Speculation]:
+    """Start an LLM call on accumulated finals + a stable interim transcript."""
+    batch_text = " ".join(accumulated + [interim_text])
+    if is_garbage(batch_text) or detect_voice_command(interim_text):
+        return None
+    log.info("Speculative LLM call on stable interim: %s", interim_text[:80])
+    base = _report_state(session)
+    trace = Trace()
+    task = asyncio.create_task(call_llm_wrapper(
+        session, batch_text, base=base, context=_pending_context(session), trace=trace,
+        on_partial=_partial_sender(session)))
+    return _Speculation(interim_text, batch_text, base, session.report_version, task, trace)
+
+
+async def _dispatch_batch(session: SessionState, batch_text: str,
+                          trace: Trace, spec: Optional[_Speculation] = None):
+    """Start an LLM call for a batch (or adopt a speculative one) without waiting for it."""
+    if is_garbage(batch_text):
+        log.debug("Skipping garbage transcript: %s", batch_text[:80])
+        GARBAGE_SKIPS.inc()
+        _cancel_speculation(session, spec, "garbage")
+        return
+
+    trace.mark("batch")
+    if spec is not None:
+        session.spec_hits += 1
+        log.info("Speculation hit — hits=%d wasted=%d", session.spec_hits, session.spec_wasted)
+        base, base_version, task = spec.base, spec.base_version, spec.task
+        # The call started before the final: measure from the final like any batch
+        spec.trace.origin = trace.origin
+        spec.trace.stages.update(trace.stages)
+        trace = spec.trace
+    elif FAST_PATH and not session.inflight and await _try_fast_path(session, batch_text, trace):
+        return
+    else:
+        base, base_version = _report_state(session), session.report_version
+        task = asyncio.create_task(call_llm_wrapper(
+            session, batch_text, base=base, context=_pending_context(session), trace=trace,
+            on_partial=_partial_sender(session)))
+
+    session.batch_seq += 1
+    seq = session.batch_seq
+    task.add_done_callback(
+        lambda _t: session.transcript_queue.put_nowait({"llm_done": seq}))
+    session.inflight.append(_LLMBatch(seq, batch_text, base, base_version, task, trace))
+
+    if not session.llm_busy:
         session.llm_busy = True
-        await send_safe(ws, {"type": "status", "llm": "processing"})
+        await send_safe(session.ws, {"type": "status", "llm": "processing"})
+    log.info("LLM batch #%d dispatched on v%d (%d in flight)",
+             seq, base_version, len(session.inflight))
 
+
+async def _apply_finished_batches(session: SessionState):
+    """Apply completed LLM calls in dispatch order; later results wait for earlier ones."""
+    while session.inflight and session.inflight[0].task.done():
+        batch = session.inflight.pop(0)
+        batch.trace.mark("order")
+        applied = False
         try:
-            updated = await call_llm_wrapper(session, batch_text)
+            updated = batch.task.result()
             if updated is not None:
-                session.current_report = updated.get("report", {})
-                session.overall_remarks = updated.get("overallRemarks", "")
-                await send_safe(ws, {
-                    "type": "report_update",
-                    "report": session.current_report,
-                    "overallRemarks": session.overall_remarks,
-                })
+                LLM_CALLS.inc(outcome="ok")
+                prev, prev_version = _report_state(session), session.report_version
+                if not _apply_llm_result(session, batch, updated):
+                    _redispatch_batch(session, batch)
+                    return
+                batch.trace.mark("apply")
+                await _publish_report(session, prev, prev_version, batch.trace)
+                applied = True
             else:
-                await send_safe(ws, {
+                LLM_CALLS.inc(outcome="invalid")
+                await send_safe(session.ws, {
                     "type": "error",
                     "message": "LLM returned invalid response",
                 })
+        except asyncio.CancelledError:
+            LLM_CALLS.inc(outcome="cancelled")
+            log.info("LLM batch #%d cancelled", batch.seq)
         except Exception as e:
-            log.exception("LLM error")
-            await send_safe(ws, {
+            LLM_CALLS.inc(outcome="error")
+            log.error("LLM error in batch #%d", batch.seq, exc_info=e)
+            await send_safe(session.ws, {
                 "type": "error",
                 "message": f"LLM error: {str(e)}",
             })
-        finally:
-            session.llm_busy = False
-            await send_safe(ws, {"type": "status", "llm": "idle"})
+        if batch.provisional is not None and not applied:
+            # The client shows provisional findings that never became final
+            await _send_full_report(session)
 
-        # Drain any transcripts that arrived during LLM processing
-        while not session.transcript_queue.empty():
-            try:
-                msg3 = session.transcript_queue.get_nowait()
-                if msg3.get("is_final"):
-                    cmd3 = detect_voice_command(msg3["text"])
-                    if cmd3:
-                        await _handle_voice_command(ws, session, cmd3, msg3["text"])
-                    elif not session.paused:
-                        accumulated.append(msg3["text"])
-                        await send_safe(ws, {"type": "final_transcript", "text": msg3["text"]})
-            except asyncio.QueueEmpty:
-                break
-
-    # Flush: process any remaining accumulated text before exiting
-    if accumulated:
-        batch_text = " ".join(accumulated)
-        accumulated = []
-        if not is_garbage(batch_text):
-            log.info("Batcher flushing final batch: %s", batch_text[:80])
-            try:
-                updated = await call_llm_wrapper(session, batch_text)
-                if updated is not None:
-                    session.current_report = updated.get("report", {})
-                    session.overall_remarks = updated.get("overallRemarks", "")
-                    await send_safe(ws, {
-                        "type": "report_update",
-                        "report": session.current_report,
-                        "overallRemarks": session.overall_remarks,
-                    })
-            except Exception:
-                log.exception("Flush LLM error")
+    if not session.inflight and session.llm_busy:
+        session.llm_busy = False
+        await send_safe(session.ws, {"type": "status", "llm": "idle"})
 
-    log.info("Batcher exiting")
 
+async def _try_fast_path(session: SessionState, batch_text: str,
+                         trace: Trace) -> bool:
+    """
+    Apply a batch locally if the fast-path matcher resolves it unambiguously.
 
-async def _handle_voice_command(ws: WebSocket, session: SessionState, cmd: str, text: str):
+    Only used while no LLM call is in flight, so the active disease and the
+    report it resolves against are current.
+    """
+    t0 = time.perf_counter()
+    matcher = fast_path.get_matcher(session.ehr_schema, session.schema_key)
+    result = fast_path.resolve(matcher, batch_text, session.current_report,
+                               session.active, ignorable=FILLER_WORDS)
+    if result is None:
+        session.fast_misses += 1
+        FAST_PATH_RESULTS.inc(result="miss")
+        return False
+
+    prev, prev_version = _report_state(session), session.report_version
+    updated = apply_patch(prev, result.ops)
+    session.current_report = updated["report"]
+    session.overall_remarks = updated["overallRemarks"]
+    session.report_version += 1
+    session.active = result.active
+    session.fast_hits += 1
+    FAST_PATH_RESULTS.inc(result="hit")
+    trace.mark("fast_path")
+    total = session.fast_hits + session.fast_misses
+    log.info("Fast path hit in %.1fms: %s — hit rate %d/%d (%.0f%%)",
+             (time.perf_counter() - t0) * 1000, "; ".join(result.summary),
+             session.fast_hits, total, 100.0 * session.fast_hits / total)
+    await _publish_report(session, prev, prev_version, trace)
+    return True
+
+
+# ── Report Sync ──
+
+async def _send_full_report(session: SessionState, timing: Optional[dict] = None):
+    """Send the whole report with its version (initial state, resync, fallback)."""
+    msg = {
+        "type": "report_update",
+        "version": session.report_version,
+        "report": session.current_report,
+        "overallRemarks": session.overall_remarks,
+    }
+    if timing is not None:
+        msg["timing"] = timing
+    await send_safe(session.ws, msg)
+
+
+async def _publish_report(session: SessionState,
+                          prev: Optional[dict], prev_version: int,
+                          trace: Optional[Trace] = None):
+    """
+    Send a report change to the client.
+
+    Patch-capable clients get a report_patch from prev_version to the current
+    version, so the payload tracks the size of the change; others get the
+    full report. A batch's trace is completed with the send and recorded;
+    clients that asked for timing get its breakdown (up to the send).
+    """
+    timing = trace.compact() if trace is not None and session.timing else None
+    if not session.patch_sync or prev is None:
+        await _send_full_report(session, timing)
+    else:
+        msg = {
+            "type": "report_patch",
+            "base_version": prev_version,
+            "version": session.report_version,
+            "ops": make_patch(prev, _report_state(session)),
+        }
+        if timing is not None:
+            msg["timing"] = timing
+        await send_safe(session.ws, msg)
+    if trace is not None:
+        trace.mark("send")
+        trace.observe(STAGE_SECONDS)
+
+
+async def _publish_provisional(session: SessionState, doc: dict):
+    """
+    Send a provisional state from a streamed LLM response (on_partial callback).
+
+    Only the call at the head of the in-flight queue, still based on the
+    current version, shows early: its result is the next to be applied and
+    needs no rebase, so the final update replaces the provisional one
+    without surprises. Provisional updates do not change the version; the
+    client displays them without moving its synced snapshot, and the final
+    report_update / report_patch (or a full resync if the call fails)
+    supersedes them.
+    """
+    task = asyncio.current_task()
+    if not session.inflight or session.inflight[0].task is not task:
+        return  # Later in the queue, or a speculative call not adopted yet
+    batch = session.inflight[0]
+    if batch.base_version != session.report_version:
+        return
+    state, _ = validate_report(doc, session.ehr_schema)
+    if state is None:
+        return
+    ops = make_patch(_report_state(session), state)
+    if not ops or ops == batch.provisional:
+        return
+    if batch.provisional is None:
+        FIRST_UPDATE_SECONDS.observe(time.monotonic() - batch.trace.origin)
+    batch.provisional = ops
+    PROVISIONAL_UPDATES.inc()
+    if session.patch_sync:
+        msg = {
+            "type": "report_patch",
+            "provisional": True,
+            "base_version": session.report_version,
+            "version": session.report_version,
+            "ops": ops,
+        }
+    else:
+        msg = {"type": "report_update", "provisional": True,
+               "version": session.report_version, **state}
+    await send_safe(session.ws, msg)
+
+
+async def _handle_client_patch(session: SessionState, data: dict):
+    """
+    Apply a report_patch from the client (manual edits).
+
+    On a version match the patch applies as is and is acknowledged. If the
+    server moved on meanwhile (an LLM update crossed the edit), the edits are
+    applied to the current report — ops that no longer fit are dropped — and
+    the full result is sent back so the client converges.
+    """
+    base_version = data.get("base_version")
+    in_sync = base_version == session.report_version
+    ops = data.get("ops") or []
+    if isinstance(data.get("active"), dict):
+        session.active = data["active"]
+    if not ops:
+        # Active-disease change only
+        if in_sync:
+            await send_safe(session.ws, {"type": "report_ack", "version": session.report_version})
+        else:
+            await _send_full_report(session)
+        return
+    try:
+        updated = apply_patch(_report_state(session), ops, skip_errors=not in_sync)
+        if not isinstance(updated, dict):
+            raise JsonPatchError("Patched document is not an object")
+    except JsonPatchError as e:
+        log.warning("Client patch on v%s rejected: %s — resyncing", base_version, e)
+        await _send_full_report(session)
+        return
+
+    session.current_report = updated.get("report", {})
+    session.overall_remarks = updated.get("overallRemarks", "")
+    session.report_version += 1
+    _update_active(session, session.current_report)
+
+    if in_sync:
+        await send_safe(session.ws, {"type": "report_ack", "version": session.report_version})
+    else:
+        log.info("Client patch on v%s rebased onto v%d", base_version, session.report_version - 1)
+        await _send_full_report(session)
+
+
+def _update_active(session: SessionState, old_report: dict):
+    """Track the active disease the way applyVoiceUpdate() does on the frontend."""
+    report = session.current_report or {}
+    newest = None
+    for loc, loc_entry in report.items():
+        for dname in (loc_entry or {}).get("diseases", {}):
+            if dname not in ((old_report or {}).get(loc) or {}).get("diseases", {}):
+                newest = {"loc": loc, "disease": dname}
+    if newest:
+        session.active = newest
+        return
+    act = session.active
+    if act and act.get("disease") in (report.get(act.get("loc")) or {}).get("diseases", {}):
+        return
+    session.active = None
+    for loc, loc_entry in report.items():
+        diseases = list((loc_entry or {}).get("diseases", {}))
+        if diseases:
+            session.active = {"loc": loc, "disease": diseases[0]}
+            break
+
+
+def _apply_llm_result(session: SessionState, batch: _LLMBatch, updated: dict) -> bool:
+    """
+    Make an LLM result the current report.
+
+    If the report is still at the version the call was based on, the result
+    is taken as is. Otherwise the call's own changes (base → result) are
+    three-way merged onto the current report (json_patch.merge): findings
+    added by both land side by side, remark appends are kept in order, and
+    changes inside something removed meanwhile are dropped. Returns False,
+    leaving the report untouched, if the merge conflicts; a batch that was
+    already re-run keeps the current values where it conflicts.
+    """
+    if session.report_version != batch.base_version:
+        try:
+            updated = merge(batch.base, _report_state(session), updated,
+                            strict=not batch.redispatched)
+        except MergeConflict as e:
+            log.info("LLM batch #%d conflicts with v%d (%s)",
+                     batch.seq, session.report_version, e)
+            return False
+        log.info("LLM batch #%d rebased from v%d onto v%d",
+                 batch.seq, batch.base_version, session.report_version)
+    old_report = session.current_report
+    session.current_report = updated.get("report", {})
+    session.overall_remarks = updated.get("overallRemarks", "")
+    session.report_version += 1
+    _update_active(session, old_report)
+    return True
+
+
+def _redispatch_batch(session: SessionState, batch: _LLMBatch):
+    """Re-run a batch whose result conflicted, on the current report, at the head of the queue."""
+    batch.base, batch.base_version = _report_state(session), session.report_version
+    batch.redispatched = True
+    batch.task = asyncio.create_task(call_llm_wrapper(
+        session, batch.batch_text, base=batch.base, context=_pending_context(session),
+        trace=batch.trace, on_partial=_partial_sender(session)))
+    batch.task.add_done_callback(
+        lambda _t, seq=batch.seq: session.transcript_queue.put_nowait({"llm_done": seq}))
+    session.inflight.insert(0, batch)
+    LLM_REDISPATCHES.inc()
+    log.info("LLM batch #%d re-dispatched on v%d", batch.seq, batch.base_version)
+
+
+async def _handle_voice_command(session: SessionState, cmd: str, text: str):
     """Handle a detected voice command."""
-    await send_safe(ws, {"type": "final_transcript", "text": text})
+    VOICE_COMMANDS.inc(command=cmd)
+    await send_safe(session.ws, {"type": "final_transcript", "text": text})
 
-    if cmd in _PAUSE_CMDS:
+    if cmd == "pause":
         session.paused = True
-        await send_safe(ws, {"type": "status", "paused": True})
+        await send_safe(session.ws, {"type": "status", "paused": True})
         log.info("Dictation paused by voice command")
-    elif cmd in _RESUME_CMDS:
+    elif cmd == "resume":
         session.paused = False
-        await send_safe(ws, {"type": "status", "paused": False})
+        await send_safe(session.ws, {"type": "status", "paused": False})
         log.info("Dictation resumed by voice command")
-    elif cmd in _CAPTURE_CMDS:
-        await send_safe(ws, {"type": "capture_photo"})
+    elif cmd == "capture_photo":
+        await send_safe(session.ws, {"type": "capture_photo"})
         log.info("Capture photo command received")
 
 
-async def call_llm_wrapper(session: SessionState, transcript: str) -> dict | None:
+async def call_llm_wrapper(session: SessionState, transcript: str,
+                           base: Optional[dict] = None, context: str = "",
+                           trace: Optional[Trace] = None,
+                           on_partial=None) -> dict | None:
     """
     Call the LLM to update EHR JSON from transcript.
+
+    base is the {report, overallRemarks} state the call works on (defaults to
+    the session's current state); context is earlier dictation still being
+    processed by other in-flight calls. trace, if given, gets the prompt, llm
+    and validate stages. on_partial receives provisional states of a streamed
+    response (llm.stream).
     Returns dict with {report, overallRemarks} or None.
     """
+    if base is None:
+        base = _report_state(session)
     try:
-        from llm_caller import call_llm
+        if _llm_cfg.get("backend") == "fake":
+            from llm_fake import call_llm
+        else:
+            from llm_caller import call_llm
         result = await call_llm(
             session.ehr_schema,
-            session.current_report,
-            session.overall_remarks,
+            base["report"],
+            base["overallRemarks"],
             transcript,
             procedure_type=session.procedure_type,
             llm_config=_llm_cfg,
+            schema_key=session.schema_key,
+            context=context,
+            trace=trace,
+            on_partial=on_partial,
         )
         if result is None:
             log.warning("LLM returned None for transcript: %s", transcript[:80])
             return None
 
+        if "patch" in result:
+            # Delta mode: apply the patch to the base state, then validate the result
+            try:
+                result = apply_patch(base, result["patch"])
+            except JsonPatchError as e:
+                log.warning("LLM patch could not be applied: %s", e)
+                return None
+            if not isinstance(result, dict):
+                log.warning("LLM patch replaced the document with %s", type(result).__name__)
+                return None
+
         log.info("LLM response: %d locations", len(result.get("report", {})))
 
-        # Validate with Pydantic
-        validated = validate_llm_response(result, session.ehr_schema)
+        # Validate against the compiled schema, pruning what the menu does not offer
+        validated, dropped = validate_report(result, session.ehr_schema)
+        if trace is not None:
+            trace.mark("validate")
         if validated is None:
+            VALIDATION_FAILURES.inc()
             log.warning(
                 "LLM response failed validation. Raw keys: %s",
                 list(result.keys()) if isinstance(result, dict) else type(result),
             )
             return None
+        if dropped:
+            log.info("LLM response pruned %d node(s): %s", len(dropped), "; ".join(dropped[:5]))
 
-        return {
-            "report": {k: v.model_dump() for k, v in validated.report.items()},
-            "overallRemarks": validated.overallRemarks,
-        }
+        return validated
     except ImportError:
         log.warning("llm_caller not available yet — returning None")
         return None
@@ -480,107 +1073,268 @@ async def call_llm_wrapper(session: SessionState, transcript: str) -> dict | Non
 
 # ── WebSocket endpoint ──
 
-@app.websocket("/ws/voice")
-async def voice_ws(ws: WebSocket):
-    await ws.accept()
-    session = SessionState()
-    log.info("WebSocket connection accepted")
+async def _receive_json(ws: WebSocket) -> dict:
+    """Next text message, parsed; audio frames sent before the session is ready are skipped."""
+    while True:
+        message = await ws.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        if message.get("text") is not None:
+            return jsonfast.loads(message["text"])
 
+
+async def _init_schema(session: SessionState, init_data: dict, procedure_type: str) -> dict:
+    """
+    Look up the session schema from the init message.
+
+    Clients may send only `csv_hash`. On a cache miss the server replies with
+    `schema_miss` and waits for a second init message carrying `csv_text`.
+    Returns the init message that was finally used.
+    """
+    csv_text = init_data.get("csv_text", "")
+    csv_hash = init_data.get("csv_hash", "")
+    entry = get_schema(procedure_type, APP_CONFIG, csv_text=csv_text, csv_hash=csv_hash)
+
+    if entry is None and csv_hash and not csv_text:
+        log.info("Schema cache miss for %s, requesting CSV", csv_hash[:12])
+        await send_safe(session.ws, {"type": "schema_miss", "csv_hash": csv_hash})
+        retry = await asyncio.wait_for(_receive_json(session.ws), timeout=10.0)
+        if retry.get("type") == "init" and retry.get("csv_text"):
+            init_data = retry
+            entry = get_schema(procedure_type, APP_CONFIG, csv_text=retry["csv_text"])
+
+    if entry is not None:
+        session.schema_key, session.ehr_schema = entry
+    return init_data
+
+
+async def _start_session(ws: WebSocket, init_data: dict) -> SessionState:
+    """Create a session from its init message: schema, ASR bridge, transcript batcher."""
+    session = SessionState(ws=ws)
+    _open_sessions[session.session_id] = session
+    SESSIONS_STARTED.inc()
+    SESSIONS_OPEN.inc()
+
+    # Resolve schema (hash-only init hits the cache; a miss asks for the CSV)
+    procedure_type = init_data.get("procedure_type", "endoscopy")
     try:
-        # Wait for init message
-        init_raw = await asyncio.wait_for(ws.receive_text(), timeout=10.0)
-        init_data = json.loads(init_raw)
+        init_data = await _init_schema(session, init_data, procedure_type)
+    except BaseException:
+        await _close_session(session)
+        raise
+    if session.ehr_schema is not None:
+        session.phrase_hints = get_phrase_hints(
+            session.ehr_schema, session.schema_key, procedure_type,
+            PHRASE_FILES, MAX_PHRASES,
+        )
+        session.phrase_hints_key = session.schema_key
+        log.info(
+            "Schema ready (%s): %d diseases, %d phrase hints",
+            session.schema_key,
+            len(session.ehr_schema.get("diseases", {})),
+            len(session.phrase_hints),
+        )
+    else:
+        log.warning("No CSV text in init message")
 
-        if init_data.get("type") != "init":
-            await send_safe(ws, {
-                "type": "error",
-                "message": "First message must be type:init",
-            })
-            await ws.close()
-            return
-
-        # Parse CSV and build schema
-        csv_text = init_data.get("csv_text", "")
-        procedure_type = init_data.get("procedure_type", "endoscopy")
-        if csv_text:
-            session.ehr_schema = build_schema(
-                csv_text, procedure_type=procedure_type, config=APP_CONFIG)
-            session.phrase_hints = _load_phrase_hints()
-            log.info(
-                "Schema built: %d diseases, %d phrase hints",
-                len(session.ehr_schema.get("diseases", {})),
-                len(session.phrase_hints),
-            )
-        else:
-            log.warning("No CSV text in init message")
+    session.procedure_type = procedure_type
+    session.current_report = init_data.get("report", {})
+    session.overall_remarks = init_data.get("overallRemarks", "")
+    session.patch_sync = bool(init_data.get("patch_sync"))
+    session.timing = bool(init_data.get("timing"))
+
+    # Start ASR bridge
+    try:
+        from asr_backend import get_asr_backend
+        run_asr = get_asr_backend(_asr_cfg)
+        asr_task = asyncio.create_task(
+            run_asr(session, asr_config=_asr_cfg)
+        )
+        session.tasks.append(asr_task)
+        log.info("ASR bridge started")
+    except (ImportError, ValueError) as e:
+        log.warning("ASR backend not available (%s) — ASR disabled", e)
+
+    # Start transcript batcher
+    batcher_task = asyncio.create_task(
+        transcript_batcher(session)
+    )
+    session.tasks.append(batcher_task)
 
-        session.procedure_type = procedure_type
-        session.current_report = init_data.get("report", {})
-        session.overall_remarks = init_data.get("overallRemarks", "")
+    await send_safe(ws, {"type": "session", "session_id": session.session_id,
+                         "resume_seconds": RESUME_GRACE_SECONDS})
+    await send_safe(ws, {"type": "status", "asr": "active"})
+    return session
+
+
+async def _resume_session(ws: WebSocket, data: dict) -> Optional[SessionState]:
+    """
+    Reattach a connection to the session named in a resume message.
+
+    Nothing is re-initialised: schema, ASR bridge, batcher, report and
+    pending batches are those the session kept while detached. The client
+    gets the server's report version and syncs from there (its pending edits
+    as a report_patch, or a resync). A session that is still attached — a
+    half-open connection the server has not noticed yet — is taken over.
+    Returns None (after telling the client) if the session has expired.
+    """
+    session = _open_sessions.get(data.get("session_id") or "")
+    if session is None:
+        SESSION_RESUMES.inc(result="expired")
+        log.info("Resume of unknown or expired session — client will re-initialise")
+        await send_safe(ws, {"type": "session_expired"})
+        return None
 
-        # Start ASR bridge
+    old_ws = session.ws
+    session.ws = ws
+    if session.expiry is not None:
+        session.expiry.cancel()
+        session.expiry = None
+        SESSIONS_DETACHED.dec()
+        detached = "detached"
+    else:
+        detached = "still attached"
         try:
-            from asr_bridge import run_asr_bridge
-            asr_task = asyncio.create_task(
-                run_asr_bridge(ws, session, asr_config=_asr_cfg)
-            )
-            session.tasks.append(asr_task)
-            log.info("ASR bridge started")
-        except ImportError:
-            log.warning("asr_bridge not available — ASR disabled")
-
-        # Start transcript batcher
-        batcher_task = asyncio.create_task(
-            transcript_batcher(ws, session)
-        )
-        session.tasks.append(batcher_task)
+            await asyncio.wait_for(old_ws.close(), timeout=1.0)
+        except Exception:
+            pass
+    session.asr_paused.clear()
+    SESSION_RESUMES.inc(result="resumed")
+    log.info("Session %s resumed (%s) at v%d, %d batch(es) in flight",
+             session.session_id[:8], detached, session.report_version, len(session.inflight))
+
+    await send_safe(ws, {"type": "resumed", "session_id": session.session_id,
+                         "version": session.report_version, "paused": session.paused})
+    await send_safe(ws, {"type": "status", "asr": "active"})
+    if session.llm_busy:
+        await send_safe(ws, {"type": "status", "llm": "processing"})
+    return session
+
 
-        await send_safe(ws, {"type": "status", "asr": "active"})
+def _detach_session(session: SessionState):
+    """Keep a disconnected session for the grace period, with ASR paused."""
+    session.ws = None
+    session.asr_paused.set()
+    SESSIONS_DETACHED.inc()
+    session.expiry = asyncio.create_task(_expire_session(session))
+    log.info("Session %s detached — kept %.0fs for resume (%d batch(es) in flight)",
+             session.session_id[:8], RESUME_GRACE_SECONDS, len(session.inflight))
 
-        # Main receive loop
-        while True:
-            message = await ws.receive()
 
-            if "bytes" in message:
-                # Binary frame = audio data
-                await session.audio_queue.put(message["bytes"])
+async def _expire_session(session: SessionState):
+    await asyncio.sleep(RESUME_GRACE_SECONDS)
+    session.expiry = None
+    SESSIONS_DETACHED.dec()
+    log.info("Session %s not resumed within %.0fs", session.session_id[:8], RESUME_GRACE_SECONDS)
+    await _close_session(session)
 
-            elif "text" in message:
-                data = json.loads(message["text"])
-                msg_type = data.get("type")
 
-                if msg_type == "report_state":
-                    session.current_report = data.get("report", {})
-                    session.overall_remarks = data.get("overallRemarks", "")
-                elif msg_type == "stop":
-                    log.info("Stop message received")
-                    break
+async def _close_session(session: SessionState):
+    """Flush and tear down a session for good."""
+    _open_sessions.pop(session.session_id, None)   # No resume from here on
+    session.audio_buffer.close()  # Stops the STT thread once drained
+    session.asr_paused.clear()
+
+    # Tell batcher to flush remaining text before exiting
+    await session.transcript_queue.put({"flush": True})
+
+    # Wait for batcher to process final batch (may include LLM call)
+    for task in session.tasks:
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout=15.0)
+        except (asyncio.TimeoutError, asyncio.CancelledError, Exception):
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    session.cancel_event.set()
+    SESSIONS_OPEN.dec()
+    log.info("Session cleaned up")
+
+
+async def _receive_loop(ws: WebSocket, session: SessionState):
+    """Handle audio and client messages until the client stops dictation."""
+    while True:
+        message = await ws.receive()
+
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+
+        if "bytes" in message and message["bytes"] is not None:
+            # Binary frame = audio data
+            dropped = session.audio_buffer.write(message["bytes"])
+            if dropped:
+                AUDIO_DROPPED.inc(dropped / session.audio_buffer.bytes_per_sec)
+                await _warn_audio_overflow(session, dropped)
+
+        elif "text" in message:
+            data = jsonfast.loads(message["text"])
+            msg_type = data.get("type")
+
+            if msg_type == "report_state":
+                session.current_report = data.get("report", {})
+                session.overall_remarks = data.get("overallRemarks", "")
+                session.report_version += 1
+                if isinstance(data.get("active"), dict):
+                    session.active = data["active"]
+                else:
+                    _update_active(session, session.current_report)
+                if session.patch_sync:
+                    await send_safe(ws, {"type": "report_ack",
+                                         "version": session.report_version})
+            elif msg_type == "report_patch":
+                await _handle_client_patch(session, data)
+            elif msg_type == "resync":
+                await _send_full_report(session)
+            elif msg_type == "stop":
+                log.info("Stop message received")
+                return
+
+
+@app.websocket("/ws/voice")
+async def voice_ws(ws: WebSocket):
+    await ws.accept()
+    log.info("WebSocket connection accepted")
+    session = None
+    detach = False                 # Disconnected: keep the session for a resume
+
+    try:
+        # Wait for init (or resume) message
+        first = await asyncio.wait_for(_receive_json(ws), timeout=10.0)
+        if first.get("type") == "resume":
+            session = await _resume_session(ws, first)
+            if session is None:
+                # Expired: the client falls back to a fresh init on this connection
+                first = await asyncio.wait_for(_receive_json(ws), timeout=10.0)
+
+        if session is None:
+            if first.get("type") != "init":
+                await send_safe(ws, {
+                    "type": "error",
+                    "message": "First message must be type:init",
+                })
+                await ws.close()
+                return
+            session = await _start_session(ws, first)
+
+        await _receive_loop(ws, session)
 
     except WebSocketDisconnect:
         log.info("WebSocket disconnected")
+        detach = RESUME_GRACE_SECONDS > 0
     except asyncio.TimeoutError:
         log.warning("Timeout waiting for init message")
     except Exception:
         log.exception("WebSocket error")
     finally:
-        await session.audio_queue.put(None)  # Sentinel to stop ASR
-
-        # Tell batcher to flush remaining text before exiting
-        await session.transcript_queue.put({"flush": True})
-
-        # Wait for batcher to process final batch (may include LLM call)
-        for task in session.tasks:
-            try:
-                await asyncio.wait_for(asyncio.shield(task), timeout=15.0)
-            except (asyncio.TimeoutError, asyncio.CancelledError, Exception):
-                task.cancel()
-                try:
-                    await task
-                except (asyncio.CancelledError, Exception):
-                    pass
-
-        session.cancel_event.set()
-        log.info("Session cleaned up")
+        # A session taken over by a resumed connection is no longer ours
+        if session is not None and session.ws is ws:
+            if detach and session.tasks:
+                _detach_session(session)
+            else:
+                await _close_session(session)
 
 
 # ── Entrypoint ──
@@ -602,7 +1356,6 @@ if __name__ == "__main__":
 
     ssl_kwargs = {}
     if args.ssl_cert and args.ssl_key:
-        import os
         if os.path.isfile(args.ssl_cert) and os.path.isfile(args.ssl_key):
             ssl_kwargs["ssl_certfile"] = args.ssl_cert
             ssl_kwargs["ssl_keyfile"] = args.ssl_key
@@ -15,6 +15,18 @@ let voiceWs = null;            // WebSocket instance
 let voiceAudioCtx = null;      // AudioContext (16kHz)
 let voiceMediaStream = null;   // getUserMedia stream
 let voiceActive = false;       // Dictation running
+let _voiceCsvHash = null;      // SHA-256 of loadedCsvText (schema cache key on the server)
+let _voiceCsvHashFor = null;   // CSV text the cached hash was computed for
+let _voiceReportVersion = 0;   // Server report version our snapshot corresponds to
+let _voiceSynced = null;       // {report, overallRemarks} as last agreed with the server
+let _voiceSyncedActive = null; // JSON of the active disease last sent to the server
+let _voiceProvisional = false; // Showing a streamed LLM update not yet made final
+let _voiceSessionId = null;     // Server session to resume after a dropped connection
+let _voiceResumeSeconds = 0;    // How long the server keeps a detached session
+let _voiceResumeUntil = 0;      // Deadline (Date.now()) for resuming after a drop
+let _voiceAttached = false;     // Socket bound to a live server session (audio may flow)
+let _voiceReconnectTimer = null;
+let _voiceReconnectDelay = 0;   // ms, doubled per failed attempt
 
 // ── applyVoiceUpdate ──
 
@@ -146,6 +158,135 @@ function applyVoiceUpdate(data) {
   log("applyVoiceUpdate: report applied");
 }
 
+// ── Report patch sync ──
+// Both directions exchange RFC 6902 JSON Patches against a versioned snapshot,
+// so payloads track the size of the change rather than the report. A version
+// mismatch falls back to a full report_update (server) / resync request (client).
+
+function _voiceClone(obj) {
+  return typeof structuredClone === "function" ? structuredClone(obj) : JSON.parse(JSON.stringify(obj));
+}
+
+function _voicePtrEscape(key) {
+  return String(key).replace(/~/g, "~0").replace(/\//g, "~1");
+}
+
+function _voicePtrTokens(path) {
+  if (path === "") return [];
+  return path.slice(1).split("/").map(t => t.replace(/~1/g, "/").replace(/~0/g, "~"));
+}
+
+// Apply ops to doc in place (doc must be a private copy); throws on a bad path
+function _voiceApplyPatch(doc, ops) {
+  for (const op of ops) {
+    const tokens = _voicePtrTokens(op.path);
+    if (!tokens.length) {
+      if (op.op !== "remove") doc = _voiceClone(op.value);
+      continue;
+    }
+    let node = doc;
+    for (const t of tokens.slice(0, -1)) {
+      if (Array.isArray(node)) {
+        node = node[parseInt(t, 10)];
+      } else {
+        if (node[t] === undefined || node[t] === null) node[t] = {};
+        node = node[t];
+      }
+      if (!node || typeof node !== "object") throw new Error("Bad patch path: " + op.path);
+    }
+    const last = tokens[tokens.length - 1];
+    if (Array.isArray(node)) {
+      const idx = last === "-" ? node.length : parseInt(last, 10);
+      if (op.op === "remove") node.splice(idx, 1);
+      else if (op.op === "add") node.splice(idx, 0, op.value);
+      else node[idx] = op.value;
+    } else if (op.op === "remove") {
+      delete node[last];
+    } else {
+      node[last] = op.value;
+    }
+  }
+  return doc;
+}
+
+// Patch turning src into dst: objects key by key, arrays/scalars replaced wholesale
+function _voiceMakePatch(src, dst, path = "", ops = []) {
+  if (src === dst) return ops;
+  const isObj = v => v !== null && typeof v === "object" && !Array.isArray(v);
+  if (isObj(src) && isObj(dst)) {
+    Object.keys(src).forEach(k => {
+      const p = path + "/" + _voicePtrEscape(k);
+      if (!(k in dst)) ops.push({ op: "remove", path: p });
+      else _voiceMakePatch(src[k], dst[k], p, ops);
+    });
+    Object.keys(dst).forEach(k => {
+      if (!(k in src)) ops.push({ op: "add", path: path + "/" + _voicePtrEscape(k), value: dst[k] });
+    });
+    return ops;
+  }
+  if (JSON.stringify(src) === JSON.stringify(dst)) return ops;
+  ops.push({ op: "replace", path, value: dst });
+  return ops;
+}
+
+function _voiceCurrentState() {
+  return {
+    report: report,
+    overallRemarks: document.getElementById("overallRemarks").value || "",
+  };
+}
+
+function _voiceRequestResync(reason) {
+  logWarn("Voice: report out of sync (" + reason + "), requesting full state");
+  _voiceSynced = null;
+  if (voiceWs && voiceWs.readyState === WebSocket.OPEN) {
+    voiceWs.send(JSON.stringify({ type: "resync" }));
+  }
+}
+
+// Full report from the server: becomes the new synced snapshot
+function _voiceApplyFullReport(data) {
+  _voiceProvisional = false;
+  _voiceSynced = _voiceClone({ report: data.report || {}, overallRemarks: data.overallRemarks || "" });
+  if (typeof data.version === "number") _voiceReportVersion = data.version;
+  applyVoiceUpdate(data);
+}
+
+function _voiceApplyReportPatch(data) {
+  if (!_voiceSynced || data.base_version !== _voiceReportVersion) {
+    _voiceRequestResync("have v" + _voiceReportVersion + ", patch is on v" + data.base_version);
+    return;
+  }
+  try {
+    _voiceSynced = _voiceApplyPatch(_voiceSynced, data.ops || []);
+  } catch (e) {
+    _voiceRequestResync(e.message);
+    return;
+  }
+  _voiceReportVersion = data.version;
+  _voiceProvisional = false;
+  applyVoiceUpdate(_voiceClone(_voiceSynced));
+}
+
+// Provisional update from a streamed LLM response: shown right away, but the
+// synced snapshot and version stay put until the final update replaces it
+function _voiceApplyProvisional(data) {
+  if (data.version !== _voiceReportVersion) return;
+  let doc;
+  if (data.ops) {
+    if (!_voiceSynced) return;
+    try {
+      doc = _voiceApplyPatch(_voiceClone(_voiceSynced), data.ops);
+    } catch (e) {
+      return;  // The final update follows anyway
+    }
+  } else {
+    doc = { report: data.report || {}, overallRemarks: data.overallRemarks || "" };
+  }
+  _voiceProvisional = true;
+  applyVoiceUpdate(doc);
+}
+
 // ── WebSocket ──
 
 function _voiceWsUrl() {
@@ -154,6 +295,49 @@ function _voiceWsUrl() {
   return proto + "//" + loc.host + "/ws/voice";
 }
 
+// SHA-256 hex digest of the loaded CSV (null if crypto.subtle is unavailable)
+async function _voiceCsvDigest() {
+  const text = loadedCsvText || "";
+  if (!text || !(window.crypto && crypto.subtle)) return null;
+  if (_voiceCsvHashFor === text) return _voiceCsvHash;
+  try {
+    const buf = await crypto.subtle.digest("SHA-256", new TextEncoder().encode(text));
+    _voiceCsvHash = Array.from(new Uint8Array(buf))
+      .map(b => b.toString(16).padStart(2, "0")).join("");
+    _voiceCsvHashFor = text;
+    return _voiceCsvHash;
+  } catch (e) {
+    logWarn("CSV hash failed, sending full CSV:", e);
+    return null;
+  }
+}
+
+// Per-stage latency of the batch behind an update (init timing: DEBUG)
+function _voiceLogTiming(timing) {
+  if (!timing) return;
+  const stages = Object.keys(timing).filter(k => k !== "total")
+    .map(k => k + " " + timing[k] + "ms").join(", ");
+  log("Voice timing: " + timing.total + "ms after final (" + stages + ")");
+}
+
+// Init message: hash-only when possible, full CSV when withCsv (or no hash)
+function _voiceInitMessage(csvHash, withCsv) {
+  const msg = {
+    type: "init",
+    report: report,
+    overallRemarks: document.getElementById("overallRemarks").value || "",
+    procedure_type: procedureType || "endoscopy",
+    patch_sync: true,
+    timing: DEBUG,
+  };
+  _voiceSynced = _voiceClone({ report: msg.report, overallRemarks: msg.overallRemarks });
+  _voiceReportVersion = 0;
+  _voiceProvisional = false;
+  if (csvHash) msg.csv_hash = csvHash;
+  if (withCsv || !csvHash) msg.csv_text = loadedCsvText || "";
+  return msg;
+}
+
 function _voiceConnect() {
   if (voiceWs) return;
 
@@ -162,19 +346,24 @@ function _voiceConnect() {
 
   voiceWs = new WebSocket(url);
 
-  voiceWs.onopen = () => {
+  voiceWs.onopen = async () => {
     log("Voice WS connected");
+
+    // Reattach to the detached server session: no re-init, pending batches kept
+    if (_voiceSessionId) {
+      voiceWs.send(JSON.stringify({
+        type: "resume",
+        session_id: _voiceSessionId,
+        version: _voiceReportVersion,
+      }));
+      return;
+    }
     _voiceSetStatus("Connecting...");
 
-    // Send init message with CSV and current report state
-    const initMsg = {
-      type: "init",
-      csv_text: loadedCsvText || "",
-      report: report,
-      overallRemarks: document.getElementById("overallRemarks").value || "",
-      procedure_type: procedureType || "endoscopy",
-    };
-    voiceWs.send(JSON.stringify(initMsg));
+    // Send init with the CSV hash; the server asks for the CSV on a cache miss
+    const csvHash = await _voiceCsvDigest();
+    if (!voiceWs || voiceWs.readyState !== WebSocket.OPEN) return;
+    voiceWs.send(JSON.stringify(_voiceInitMessage(csvHash, false)));
   };
 
   voiceWs.onmessage = (evt) => {
@@ -195,14 +384,50 @@ function _voiceConnect() {
   voiceWs.onclose = () => {
     log("Voice WS closed");
     voiceWs = null;
-    if (voiceActive) {
-      _voiceStop();
-      _voiceSetStatus("Disconnected");
+    _voiceAttached = false;
+    if (!voiceActive) return;
+    // Dropped mid-dictation: the server keeps the session for resume_seconds,
+    // so keep capturing and reconnect until then
+    if (_voiceSessionId) {
+      if (!_voiceResumeUntil) _voiceResumeUntil = Date.now() + _voiceResumeSeconds * 1000;
+      if (Date.now() < _voiceResumeUntil) {
+        _voiceReconnectDelay = Math.min(Math.max(_voiceReconnectDelay * 2, 250), 4000);
+        _voiceSetStatus("Reconnecting...");
+        _voiceReconnectTimer = setTimeout(() => {
+          _voiceReconnectTimer = null;
+          if (voiceActive) _voiceConnect();
+        }, _voiceReconnectDelay);
+        return;
+      }
     }
+    _voiceStop();
+    _voiceSetStatus("Disconnected");
   };
 }
 
+// Reattached after a reconnect: catch up on whatever was missed while detached
+function _voiceOnResumed(data) {
+  _voiceAttached = true;
+  _voiceResumeUntil = 0;
+  _voiceReconnectDelay = 0;
+  log("Voice session resumed at v" + data.version);
+  _voiceSetStatus(data.paused ? "Paused" : "Listening...");
+  if (_voiceProvisional || !_voiceSynced || data.version !== _voiceReportVersion) {
+    _voiceRequestResync("resumed at v" + data.version + ", have v" + _voiceReportVersion);
+  } else {
+    _voiceSyncReportState();  // Manual edits made while disconnected
+  }
+}
+
 function _voiceDisconnect() {
+  if (_voiceReconnectTimer) {
+    clearTimeout(_voiceReconnectTimer);
+    _voiceReconnectTimer = null;
+  }
+  _voiceSessionId = null;
+  _voiceResumeUntil = 0;
+  _voiceReconnectDelay = 0;
+  _voiceAttached = false;
   if (voiceWs) {
     try {
       voiceWs.send(JSON.stringify({ type: "stop" }));
@@ -214,6 +439,36 @@ function _voiceDisconnect() {
 
 function _voiceHandleMessage(data) {
   switch (data.type) {
+    case "schema_miss":
+      log("Voice: server schema cache miss, sending CSV");
+      if (voiceWs && voiceWs.readyState === WebSocket.OPEN) {
+        voiceWs.send(JSON.stringify(_voiceInitMessage(data.csv_hash, true)));
+      }
+      break;
+
+    case "session":
+      _voiceSessionId = data.session_id;
+      _voiceResumeSeconds = data.resume_seconds || 0;
+      _voiceAttached = true;
+      break;
+
+    case "resumed":
+      _voiceOnResumed(data);
+      break;
+
+    case "session_expired":
+      log("Voice session expired on the server, re-initialising");
+      _voiceSessionId = null;
+      _voiceResumeUntil = 0;
+      _voiceReconnectDelay = 0;
+      _voiceSetStatus("Connecting...");
+      _voiceCsvDigest().then((csvHash) => {
+        if (voiceWs && voiceWs.readyState === WebSocket.OPEN) {
+          voiceWs.send(JSON.stringify(_voiceInitMessage(csvHash, false)));
+        }
+      });
+      break;
+
     case "status":
       if (data.asr) _voiceSetStatus("Listening...");
       if (data.llm === "processing") _voiceSetStatus("AI Processing...");
@@ -236,7 +491,25 @@ function _voiceHandleMessage(data) {
       break;
 
     case "report_update":
-      applyVoiceUpdate(data);
+      if (data.provisional) {
+        _voiceApplyProvisional(data);
+        break;
+      }
+      _voiceLogTiming(data.timing);
+      _voiceApplyFullReport(data);
+      break;
+
+    case "report_patch":
+      if (data.provisional) {
+        _voiceApplyProvisional(data);
+        break;
+      }
+      _voiceLogTiming(data.timing);
+      _voiceApplyReportPatch(data);
+      break;
+
+    case "report_ack":
+      _voiceReportVersion = data.version;
       break;
 
     case "capture_photo":
@@ -249,20 +522,44 @@ function _voiceHandleMessage(data) {
       _voiceShowToast("Error: " + data.message);
       break;
 
+    case "warning":
+      logWarn("Voice warning:", data.message);
+      _voiceShowToast(data.message);
+      break;
+
     case "info":
       log("Voice info:", data.message);
       break;
   }
 }
 
-// Send current report state to backend (after manual UI edits)
+// Send manual UI edits to backend: a patch against the synced snapshot,
+// or the full state when no snapshot is available
 function _voiceSyncReportState() {
   if (!voiceWs || voiceWs.readyState !== WebSocket.OPEN) return;
-  voiceWs.send(JSON.stringify({
-    type: "report_state",
-    report: report,
-    overallRemarks: document.getElementById("overallRemarks").value || "",
-  }));
+  // The display is ahead of the server until the final update arrives
+  if (_voiceProvisional) return;
+  const current = _voiceCurrentState();
+  if (_voiceSynced) {
+    const ops = _voiceMakePatch(_voiceSynced, current);
+    const activeKey = JSON.stringify(active);
+    if (!ops.length && activeKey === _voiceSyncedActive) return;
+    _voiceSyncedActive = activeKey;
+    voiceWs.send(JSON.stringify({
+      type: "report_patch",
+      base_version: _voiceReportVersion,
+      ops: ops,
+      active: active,
+    }));
+  } else {
+    voiceWs.send(JSON.stringify({
+      type: "report_state",
+      report: current.report,
+      overallRemarks: current.overallRemarks,
+      active: active,
+    }));
+  }
+  _voiceSynced = _voiceClone(current);
 }
 
 // ── Audio Capture ──
@@ -308,7 +605,7 @@ async function _voiceStartAudio() {
     const workletNode = new AudioWorkletNode(voiceAudioCtx, "pcm-processor");
 
     workletNode.port.onmessage = (evt) => {
-      if (voiceWs && voiceWs.readyState === WebSocket.OPEN) {
+      if (_voiceAttached && voiceWs && voiceWs.readyState === WebSocket.OPEN) {
         voiceWs.send(evt.data); // ArrayBuffer of Int16 PCM
       }
     };
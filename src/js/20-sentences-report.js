@@ -1,4 +1,4 @@
-/* ---------- Sentences Report (LLM → Rich Text → PDF) ---------- */
+/* ---------- Sentences Report (LLM or local templates → Rich Text → PDF) ---------- */
 
 // ── Build report payload ──
 
@@ -41,11 +41,21 @@ function _sentencesBuildPayload() {
 
 // ── API call ──
 
-async function _sentencesCallApi(reportData) {
+// stage "polish" asks for the LLM rewording of the server's local draft
+// (sentences.mode: local-then-llm-polish). csv_hash lets the server order the
+// local draft like the menu when the voice session has cached the schema.
+async function _sentencesCallApi(reportData, stage) {
+  const body = { report_data: reportData, procedure_type: procedureType };
+  if (typeof _voiceCsvDigest === 'function') {
+    const csvHash = await _voiceCsvDigest();
+    if (csvHash) body.csv_hash = csvHash;
+  }
+  if (stage) body.stage = stage;
+
   const resp = await fetch('/api/generate-report', {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ report_data: reportData }),
+    body: JSON.stringify(body),
   });
 
   if (!resp.ok) {
@@ -53,13 +63,13 @@ async function _sentencesCallApi(reportData) {
     throw new Error(err.error || 'HTTP ' + resp.status);
   }
 
-  const data = await resp.json();
-  return data.html;
+  return await resp.json();  // { html, source, polish? }
 }
 
 // ── Modal ──
 
 let _sentencesQuill = null;
+let _sentencesEdited = false;   // User typed in the editor (a late polish must not overwrite it)
 
 function _sentencesCreateModal() {
   const existing = document.getElementById('sentencesModal');
@@ -155,14 +165,57 @@ function _sentencesInitQuill(htmlContent) {
     },
   });
 
+  _sentencesSetHtml(htmlContent);
+  _sentencesEdited = false;
+  _sentencesQuill.on('text-change', function(delta, oldDelta, source) {
+    if (source === 'user') _sentencesEdited = true;
+  });
+
+  document.getElementById('sentencesPdfBtn').onclick = _sentencesGeneratePdf;
+}
+
+function _sentencesSetHtml(htmlContent) {
   // Strip code fences if Gemini wraps output
   var cleaned = htmlContent;
   cleaned = cleaned.replace(/^```html?\s*/i, '');
   cleaned = cleaned.replace(/\s*```\s*$/, '');
 
   _sentencesQuill.root.innerHTML = cleaned;
+}
 
-  document.getElementById('sentencesPdfBtn').onclick = _sentencesGeneratePdf;
+// ── Polish (local draft → LLM wording) ──
+
+function _sentencesShowPolishing(on) {
+  var footer = document.getElementById('sentencesFooter');
+  if (!footer) return;
+  var note = document.getElementById('sentencesPolishing');
+  if (on && !note) {
+    note = document.createElement('span');
+    note.id = 'sentencesPolishing';
+    note.className = 'mr-auto self-center text-sm text-gray-500';
+    note.textContent = 'Polishing wording with AI...';
+    footer.insertBefore(note, footer.firstChild);
+  } else if (!on && note) {
+    note.remove();
+  }
+}
+
+async function _sentencesPolish(payload) {
+  var quill = _sentencesQuill;
+  _sentencesShowPolishing(true);
+  try {
+    var data = await _sentencesCallApi(payload, 'polish');
+    // Keep the draft if the modal was closed / reopened or the user started editing
+    if (_sentencesQuill !== quill || _sentencesEdited) {
+      log('Sentences polish discarded (draft closed or edited)');
+      return;
+    }
+    _sentencesSetHtml(data.html);
+  } catch (err) {
+    logWarn('Sentences polish failed, keeping the local draft:', err);
+  } finally {
+    if (_sentencesQuill === quill) _sentencesShowPolishing(false);
+  }
 }
 
 function _sentencesCloseModal() {
@@ -265,8 +318,9 @@ async function _sentencesGenerate() {
 
   try {
     var payload = _sentencesBuildPayload();
-    var html = await _sentencesCallApi(payload);
-    _sentencesInitQuill(html);
+    var data = await _sentencesCallApi(payload);
+    _sentencesInitQuill(data.html);
+    if (data.polish) _sentencesPolish(payload);
   } catch (err) {
     logError('Sentences report error:', err);
     _sentencesCloseModal();
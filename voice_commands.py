@@ -0,0 +1,193 @@
+"""
+Voice Commands — Compiled matcher for spoken dictation commands.
+
+The command phrases from config.yaml voice.commands are compiled once into a
+token trie (PhraseMatcher). Matching walks the transcript token by token, so
+a command only matches on word boundaries and the cost per transcript does
+not grow with the number of commands.
+
+Each transcript token is mapped to command-vocabulary tokens by:
+- exact match
+- phonetic key ("take a foto", "paws dictation"; a one-word command heard
+  only phonetically, "paws" alone, stays below the default threshold)
+- one edit (insert/delete/substitute/transpose) for words of 4+ letters,
+  looked up through a deletion index (no scan over the vocabulary)
+
+Filler words ("the", "a", "please") may appear inside a command phrase at a
+small cost ("pause the dictation"). A match's confidence combines how closely
+the words matched with how much of the utterance the command covers, so
+"pause" inside a longer finding ("a pause in peristalsis") does not fire.
+Commands that take an object (capture_photo) are exempt when they open the
+utterance: "take a photo of the ulcer in the antrum" still fires.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+from dataclasses import dataclass
+
+from phrase_matcher import PhraseMatcher, tokenize
+
+log = logging.getLogger("ehr-voice")
+
+# ── Defaults (overridden by voice config) ──
+_DEFAULT_COMMANDS = {
+    "pause": ["pause dictation", "stop recording", "pause"],
+    "resume": ["resume dictation", "start recording", "resume"],
+    "capture_photo": ["capture photo", "take photo", "take picture", "take a photo"],
+}
+_DEFAULT_MIN_CONFIDENCE = 0.8
+
+# Per-token match costs (0 = exact)
+_PHONETIC_COST = 0.25
+_EDIT_COST = 0.35
+_SKIP_COST = 0.1
+_MIN_EDIT_LEN = 4
+
+# Commands whose phrase may be followed by what they act on ("take a photo of
+# the ulcer"): trailing words after the phrase do not lower their coverage
+# when the phrase starts the utterance
+_OBJECT_COMMANDS = {"capture_photo"}
+
+# Words that may surround or interrupt a command without changing it
+_COMMAND_FILLERS = {"the", "a", "an", "please", "now", "can", "you"}
+
+_PHONETIC_RULES = [
+    (re.compile(r"ph"), "f"), (re.compile(r"ck"), "k"), (re.compile(r"gh"), ""),
+    (re.compile(r"^kn"), "n"), (re.compile(r"^wr"), "r"), (re.compile(r"q"), "k"),
+    (re.compile(r"x"), "ks"), (re.compile(r"c(?=[eiy])"), "s"), (re.compile(r"c"), "k"),
+    (re.compile(r"z"), "s"), (re.compile(r"v"), "f"),
+]
+
+
+def phonetic_key(token: str) -> str:
+    """Crude consonant skeleton: first letter kept, vowels/h/w/y dropped, repeats collapsed."""
+    if not token.isalpha():
+        return token
+    for pattern, repl in _PHONETIC_RULES:
+        token = pattern.sub(repl, token)
+    if not token:
+        return ""
+    key = token[0]
+    for ch in token[1:]:
+        if ch in "aeiouyhw":
+            continue
+        if ch != key[-1]:
+            key += ch
+    return key
+
+
+def _deletes(token: str) -> set[str]:
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """Damerau-Levenshtein distance <= 1."""
+    if a == b:
+        return True
+    la, lb = len(a), len(b)
+    if abs(la - lb) > 1:
+        return False
+    if la == lb:
+        diff = [i for i in range(la) if a[i] != b[i]]
+        if len(diff) == 1:
+            return True
+        return (len(diff) == 2 and diff[1] == diff[0] + 1
+                and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]])
+    if la > lb:
+        a, b = b, a
+    return any(b[:i] + b[i + 1:] == a for i in range(len(b)))
+
+
+@dataclass
+class CommandMatch:
+    command: str                  # Action name, e.g. "pause"
+    phrase: str                   # The configured phrase that matched
+    confidence: float
+
+
+class CommandEngine:
+    """Fuzzy, word-boundary-aware matcher over a fixed set of command phrases."""
+
+    def __init__(self, commands: dict[str, list[str]],
+                 min_confidence: float = _DEFAULT_MIN_CONFIDENCE,
+                 fillers: set[str] | None = None):
+        self.min_confidence = min_confidence
+        self.fillers = _COMMAND_FILLERS | set(fillers or ())
+        self.trie = PhraseMatcher()
+        vocab = set()
+        for command, phrases in commands.items():
+            for phrase in phrases:
+                tokens = tokenize(phrase)
+                vocab.update(tokens)
+                self.trie.add(tokens, (command, phrase, len(tokens)))
+
+        self._vocab = vocab
+        self._phonetic: dict[str, set[str]] = {}
+        self._delete_index: dict[str, set[str]] = {}
+        for tok in vocab:
+            self._phonetic.setdefault(phonetic_key(tok), set()).add(tok)
+            if len(tok) >= _MIN_EDIT_LEN:
+                for d in _deletes(tok) | {tok}:
+                    self._delete_index.setdefault(d, set()).add(tok)
+
+    @classmethod
+    def from_config(cls, voice_cfg: dict, fillers: set[str] | None = None) -> "CommandEngine":
+        commands = dict(_DEFAULT_COMMANDS)
+        commands.update(voice_cfg.get("commands") or {})
+        return cls(commands,
+                   min_confidence=voice_cfg.get("command_min_confidence", _DEFAULT_MIN_CONFIDENCE),
+                   fillers=fillers)
+
+    def _candidates(self, token: str) -> list[tuple[str, float]]:
+        """Vocabulary tokens this transcript token may stand for, with their cost."""
+        cands = {}
+        if token in self._vocab:
+            cands[token] = 0.0
+        for v in self._phonetic.get(phonetic_key(token), ()):
+            cands.setdefault(v, _PHONETIC_COST)
+        if len(token) >= _MIN_EDIT_LEN:
+            for d in _deletes(token) | {token}:
+                for v in self._delete_index.get(d, ()):
+                    if v not in cands and _within_one_edit(token, v):
+                        cands[v] = _EDIT_COST
+        return list(cands.items())
+
+    def match(self, text: str) -> CommandMatch | None:
+        """Best command in text, or None if nothing reaches min_confidence."""
+        tokens = tokenize(text)
+        content = sum(1 for t in tokens if t not in self.fillers)
+        if not content:
+            return None
+
+        best = None
+        active = []                   # (trie state, accumulated cost, content tokens before start)
+        seen = 0                      # Content tokens before the current one
+        for tok in tokens:
+            cands = self._candidates(tok)
+            nxt = []
+            for state, cost, lead in active + [(0, 0.0, seen)]:
+                for vtok, c in cands:
+                    s = self.trie.step(state, vtok)
+                    if s is None:
+                        continue
+                    nxt.append((s, cost + c, lead))
+                    for command, phrase, n in self.trie.payloads_at(s):
+                        quality = max(0.0, 1.0 - (cost + c) / n)
+                        if command in _OBJECT_COMMANDS and not lead:
+                            coverage = 1.0
+                        else:
+                            coverage = n / max(n, content)
+                        conf = quality * coverage
+                        if best is None or conf > best.confidence:
+                            best = CommandMatch(command, phrase, conf)
+                if state and tok in self.fillers:
+                    nxt.append((state, cost + _SKIP_COST, lead))
+            active = nxt
+            if tok not in self.fillers:
+                seen += 1
+
+        if best is None or best.confidence < self.min_confidence:
+            return None
+        return best